@@ -0,0 +1,255 @@
+"""Admission control: concurrency limits, a priority wait queue and load shedding"""
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+from enum import IntEnum
+from http import HTTPStatus
+from typing import Optional
+
+from starlette.responses import JSONResponse
+from starlette.routing import compile_path
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from metrics import REGISTRY
+
+
+class Priority(IntEnum):
+    """Queued requests of a lower value are admitted first."""
+
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+# Routes admitted ahead of or behind the others, as (method, path template,
+# priority, most requests of the route served at once or None for no limit).
+# Requests to any other route are admitted with NORMAL priority.
+ROUTE_POLICIES = [
+    ("GET", "/", Priority.HIGH, None),
+    ("GET", "/model/{model_name}", Priority.HIGH, None),
+    ("GET", "/metrics", Priority.HIGH, None),
+    ("POST", "/items/bulk", Priority.LOW, 2),
+    ("POST", "/file/", Priority.LOW, 4),
+    ("POST", "/files/", Priority.LOW, 4),
+    ("POST", "/uploadfile/", Priority.LOW, 4),
+    ("POST", "/uploadfiles/", Priority.LOW, 4),
+]
+
+QUEUE_WAIT = REGISTRY.histogram(
+    "http_admission_queue_wait_seconds",
+    "Time requests waited in the admission queue, admitted or not.",
+    ("priority",),
+)
+SHED = REGISTRY.counter(
+    "http_admission_shed_total",
+    "Requests answered 503 by admission control, by priority and reason.",
+    ("priority", "reason"),
+)
+QUEUED = REGISTRY.gauge(
+    "http_admission_queued", "Requests waiting in the admission queue."
+)
+
+
+class _Waiter:
+    __slots__ = ("route", "route_limit", "future", "queued")
+
+    def __init__(
+        self, route: Optional[str], route_limit: Optional[int], future: asyncio.Future
+    ) -> None:
+        self.route = route
+        self.route_limit = route_limit
+        self.future = future
+        self.queued = True
+
+
+class AdmissionController:
+    """
+    Concurrency slots shared by all requests, with optional per-route limits.
+
+    A request that finds no free slot waits in a bounded queue, and freed
+    slots go to the waiter of the highest priority whose route is under its
+    limit. How long a waiter may queue follows CoDel as applied to request
+    queues: while the queue has emptied within the last `interval`, it is a
+    burst and waiters may wait up to `interval`; once it has stayed non-empty
+    for longer, it is a standing queue that only adds latency, and waiters
+    give up after `target`. Under overload, requests are then shed within
+    `target` instead of all getting slower.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        queue_size: int,
+        target: float = 0.05,
+        interval: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.limit = limit
+        self.queue_size = queue_size
+        self.target = target
+        self.interval = interval
+        self.clock = clock
+        self.active = 0
+        self.route_active: dict[str, int] = {}
+        self._queues: list[deque[_Waiter]] = [deque() for _ in Priority]
+        self._queued = 0
+        self._last_empty = clock()
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def timeout(self) -> float:
+        """How long a request queued now may wait for a slot."""
+        if not self._queued:
+            self._last_empty = self.clock()
+
+        if self.clock() - self._last_empty > self.interval:
+            return self.target
+
+        return self.interval
+
+    async def acquire(
+        self,
+        route: Optional[str] = None,
+        route_limit: Optional[int] = None,
+        priority: Priority = Priority.NORMAL,
+    ) -> Optional[str]:
+        """
+        Take a slot, waiting for one if needed. Returns None once it is taken,
+        or the reason the request should be shed instead.
+        """
+        if self._has_room(route, route_limit):
+            self._take(route)
+            return None
+
+        if self._queued >= self.queue_size:
+            return "queue_full"
+
+        timeout = self.timeout()
+        waiter = _Waiter(route, route_limit, asyncio.get_running_loop().create_future())
+        self._queues[priority].append(waiter)
+        self._queued += 1
+        QUEUED.inc()
+        started = self.clock()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            # Unless a slot was handed over just as the wait timed out
+            return None if waiter.future.done() else "timeout"
+        except BaseException:
+            if waiter.future.done():
+                self.release(route)
+
+            raise
+        finally:
+            QUEUE_WAIT.observe(self.clock() - started, (priority.name.lower(),))
+
+            if waiter.queued:
+                self._dequeue(priority, waiter)
+
+        return None
+
+    def release(self, route: Optional[str] = None) -> None:
+        self.active -= 1
+
+        if route is not None:
+            self.route_active[route] -= 1
+
+        self._dispatch()
+
+    def _has_room(self, route: Optional[str], route_limit: Optional[int]) -> bool:
+        return self.active < self.limit and (
+            route_limit is None or self.route_active.get(route, 0) < route_limit
+        )
+
+    def _take(self, route: Optional[str]) -> None:
+        self.active += 1
+
+        if route is not None:
+            self.route_active[route] = self.route_active.get(route, 0) + 1
+
+    def _dequeue(self, priority: Priority, waiter: _Waiter) -> None:
+        self._queues[priority].remove(waiter)
+        waiter.queued = False
+        self._queued -= 1
+        QUEUED.dec()
+
+        if not self._queued:
+            self._last_empty = self.clock()
+
+    def _dispatch(self) -> None:
+        for priority, queue in zip(Priority, self._queues, strict=True):
+            if self.active >= self.limit:
+                return
+
+            # A waiter held back by its route limit does not block the others
+            for waiter in list(queue):
+                if self.active >= self.limit:
+                    return
+
+                if self._has_room(waiter.route, waiter.route_limit):
+                    self._dequeue(priority, waiter)
+                    self._take(waiter.route)
+                    waiter.future.set_result(None)
+
+
+class AdmissionControlMiddleware:
+    """
+    Admit requests through an `AdmissionController`, answering those it sheds
+    with 503 and a `Retry-After` header before anything else handles them.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        limit: int,
+        queue_size: int,
+        target: float = 0.05,
+        interval: float = 0.5,
+        retry_after: int = 1,
+        routes: Iterable[tuple[str, str, Priority, Optional[int]]] = ROUTE_POLICIES,
+    ) -> None:
+        self.app = app
+        self.controller = AdmissionController(limit, queue_size, target, interval)
+        self.retry_after = retry_after
+        self._routes = [
+            (method, compile_path(template)[0], template, priority, route_limit)
+            for method, template, priority, route_limit in routes
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route, priority, route_limit = self.policy(scope["method"], scope["path"])
+        shed = await self.controller.acquire(route, route_limit, priority)
+
+        if shed is not None:
+            SHED.inc(labels=(priority.name.lower(), shed))
+            response = JSONResponse(
+                {"detail": "Server overloaded, retry later"},
+                status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route)
+
+    def policy(
+        self, method: str, path: str
+    ) -> tuple[Optional[str], Priority, Optional[int]]:
+        """The route template, priority and route limit that apply to a request."""
+        for route_method, path_regex, template, priority, route_limit in self._routes:
+            if method == route_method and path_regex.match(path):
+                return template, priority, route_limit
+
+        return None, Priority.NORMAL, None
@@ -0,0 +1,56 @@
+"""Minimal in-process ASGI driver shared by the benchmarks"""
+
+import sys
+from pathlib import Path
+
+from starlette.types import ASGIApp
+
+# Make the app modules importable when a benchmark is run as a script
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+async def call(
+    app: ASGIApp,
+    method: str,
+    path: str,
+    headers: list[tuple[bytes, bytes]] = (),
+    body: bytes = b"",
+    query_string: bytes = b"",
+) -> tuple[int, bytes]:
+    """Send one HTTP request straight to `app`, returning status and body."""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = 0
+    chunks: list[bytes] = []
+
+    async def receive() -> dict:
+        if messages:
+            return messages.pop()
+
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        nonlocal status
+
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query_string,
+        "headers": [(b"host", b"bench"), *headers],
+        "client": ("127.0.0.1", 12345),
+        "server": ("bench", 80),
+        "state": {},
+    }
+    await app(scope, receive, send)
+
+    return status, b"".join(chunks)
@@ -0,0 +1,129 @@
+"""
+Latency of an overloaded server, with and without admission control.
+
+A stand-in ASGI app serves each request in `--service-ms`, at most
+`--capacity` at a time like a pool of workers. Requests arrive open-loop, at
+random (Poisson) times, at `--overload` times what that capacity can serve
+for `--seconds`, and are sent straight to the app. Without admission control
+every request queues and latency keeps growing for as long as the overload
+lasts; with it, the excess is shed with 503 and the requests that are served
+keep a steady latency.
+
+    python benchmarks/bench_admission.py [--overload 1.5] [--seconds 5]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from admission import AdmissionControlMiddleware  # noqa: E402
+
+SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/work",
+    "raw_path": b"/work",
+    "root_path": "",
+    "query_string": b"",
+    "headers": [(b"host", b"bench")],
+    "client": ("127.0.0.1", 12345),
+    "server": ("bench", 80),
+}
+
+
+def service_app(capacity: int, service_time: float):
+    workers = asyncio.Semaphore(capacity)
+
+    async def app(scope, receive, send) -> None:
+        async with workers:
+            await asyncio.sleep(service_time)
+
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    return app
+
+
+async def request(app) -> tuple[int, float]:
+    started = time.perf_counter()
+    status = 0
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict) -> None:
+        nonlocal status
+
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(dict(SCOPE), receive, send)
+
+    return status, time.perf_counter() - started
+
+
+async def run(admission: bool, args: argparse.Namespace) -> list[tuple[int, float]]:
+    app = service_app(args.capacity, args.service_ms / 1000)
+
+    if admission:
+        app = AdmissionControlMiddleware(
+            app,
+            limit=args.capacity,
+            queue_size=args.queue_size,
+            target=args.target_ms / 1000,
+            interval=args.interval_ms / 1000,
+        )
+
+    rate = args.overload * args.capacity / (args.service_ms / 1000)
+    arrivals = random.Random(0)  # noqa: S311
+    tasks = []
+    started = time.perf_counter()
+    arrival = 0.0
+
+    while arrival < args.seconds:
+        arrival += arrivals.expovariate(rate)
+        await asyncio.sleep(max(0.0, started + arrival - time.perf_counter()))
+        tasks.append(asyncio.create_task(request(app)))
+
+    return await asyncio.gather(*tasks)
+
+
+def percentile(latencies: list[float], percent: int) -> float:
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--service-ms", type=float, default=10.0)
+    parser.add_argument("--overload", type=float, default=1.5)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--target-ms", type=float, default=50.0)
+    parser.add_argument("--interval-ms", type=float, default=500.0)
+    args = parser.parse_args()
+
+    print(f"{'admission':>9} {'served':>7} {'shed':>6} {'p50 ms':>9} {'p99 ms':>9}")
+
+    for admission in (False, True):
+        results = asyncio.run(run(admission, args))
+        served = [latency for status, latency in results if status == 200]
+        shed = len(results) - len(served)
+        print(
+            f"{'on' if admission else 'off':>9} {len(served):7} "
+            f"{shed / len(results):6.1%} {percentile(served, 50) * 1000:9.1f} "
+            f"{percentile(served, 99) * 1000:9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
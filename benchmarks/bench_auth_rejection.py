@@ -0,0 +1,89 @@
+"""
+CPU time spent rejecting a POST /item request that carries a bad X-Token.
+
+"before" is an app shaped like the original route, which checked the token
+inside the handler, after the `Item` body (with its `Image` URLs) had been
+parsed and validated. "after" is `main.app`, whose TokenGuardMiddleware
+answers before the body is read.
+
+    python benchmarks/bench_auth_rejection.py [--requests 5000] [--images 200]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from decimal import Decimal
+from http import HTTPStatus
+
+from _asgi import call
+from fastapi import Body, FastAPI, Header, HTTPException
+
+from main import FAKE_SECRET_TOKEN, Item, app
+
+
+def build_legacy_app() -> FastAPI:
+    legacy_app = FastAPI()
+
+    @legacy_app.post("/item", status_code=HTTPStatus.CREATED)
+    async def create_item(item: Item = Body(...), x_token: str = Header(...)):
+        if x_token != FAKE_SECRET_TOKEN:
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST,
+                detail="Invalid X-Token header",
+                headers={"X-Error": "token"},
+            )
+
+        return item.model_dump()
+
+    return legacy_app
+
+
+def make_body(images: int) -> bytes:
+    return json.dumps(
+        {
+            "name": "Foo",
+            "description": "A very nice item",
+            "price": str(Decimal("0.86")),
+            "tax": str(Decimal("0.12")),
+            "tags": ["test", "mock"] * 10,
+            "images": [
+                {"url": f"https://cdn.example.org/img/{n}.png", "name": f"img {n}"}
+                for n in range(images)
+            ],
+        }
+    ).encode()
+
+
+async def cpu_per_request(app, body: bytes, requests: int) -> float:
+    headers = [
+        (b"x-token", b"hailhydra"),
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    started = time.process_time()
+
+    for _ in range(requests):
+        status, _ = await call(app, "POST", "/item", headers, body)
+        assert status == HTTPStatus.BAD_REQUEST
+
+    return (time.process_time() - started) / requests * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5_000)
+    parser.add_argument("--images", type=int, default=200)
+    args = parser.parse_args()
+    body = make_body(args.images)
+
+    before = asyncio.run(cpu_per_request(build_legacy_app(), body, args.requests))
+    after = asyncio.run(cpu_per_request(app, body, args.requests))
+
+    print(f"body size: {len(body)} bytes, {args.images} images")
+    print(f"before: {before:8.1f} µs CPU per rejected request")
+    print(f"after:  {after:8.1f} µs CPU per rejected request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,518 @@
+"""
+Throughput and latency of every route in main.py, with a regression gate.
+
+Each scenario sends a realistic request (large `Item` bodies with images,
+multi-file uploads, big `/index-weights/` maps, ...) through httpx's ASGI
+transport from `--concurrency` concurrent clients, checks the status code and
+reports requests per second and p50/p95/p99 latency. Nothing touches the
+network; uploads go to a temporary blob store.
+
+`--save` writes the results as a JSON baseline. `--compare` reruns the
+scenarios of a saved baseline with its `--requests` and `--concurrency`, and
+exits with status 1 when any scenario's p50 latency rose, or its throughput
+fell, by more than `--threshold`. Baselines only compare runs on the same
+machine. Routes of the app that no scenario requests are listed at the end.
+
+    python benchmarks/bench_endpoints.py [--save benchmarks/baseline.json]
+    python benchmarks/bench_endpoints.py --compare benchmarks/baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.pop("ITEM_DB_PATH", None)
+# Routes are measured on their own, without admission control shedding the
+# heavy ones under concurrency; bench_admission.py measures that
+os.environ["ADMISSION_LIMIT"] = "0"
+os.environ.setdefault("BLOB_STORE_DIR", tempfile.mkdtemp(prefix="bench-blobs-"))
+
+from fastapi.routing import APIRoute  # noqa: E402
+from starlette.routing import Match  # noqa: E402
+
+from main import FAKE_SECRET_TOKEN, app, item_snapshots  # noqa: E402
+from streaming import NDJSON_MEDIA_TYPE  # noqa: E402
+
+TOKEN = {"X-Token": FAKE_SECRET_TOKEN}
+SEEDED_ITEMS = 10_000
+UPLOAD = os.urandom(256 * 1024)
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    path: str
+    status: int
+    # Keyword arguments for `httpx.AsyncClient.request`, built once per run
+    request: Callable[[], dict[str, Any]] = dict
+
+
+def big_item(images: int = 50) -> dict[str, Any]:
+    return {
+        "name": "Bench item",
+        "description": "An item with many tags and images",
+        "price": "1234.56",
+        "tax": "12.34",
+        "tags": [f"tag{tag}" for tag in range(50)],
+        "images": [
+            {"url": f"https://example.org/images/{image}.png", "name": f"img {image}"}
+            for image in range(images)
+        ],
+    }
+
+
+def bulk_body(rows: int = 500) -> bytes:
+    return b"".join(
+        json.dumps({"name": f"bulk{row}", "price": "1.50"}).encode() + b"\n"
+        for row in range(rows)
+    )
+
+
+SCENARIOS = [
+    Scenario("home", "GET", "/", 200),
+    Scenario("read_items", "GET", "/items", 200, lambda: {"params": {"limit": 100}}),
+    Scenario(
+        "read_items_search",
+        "GET",
+        "/items",
+        200,
+        lambda: {"params": {"tags": "tag7", "price_min": "10", "price_max": "500"}},
+    ),
+    Scenario(
+        "read_items_ndjson",
+        "GET",
+        "/items",
+        200,
+        lambda: {
+            "params": {"limit": 1000},
+            "headers": {"Accept": NDJSON_MEDIA_TYPE},
+        },
+    ),
+    Scenario(
+        "read_items_batch_get",
+        "GET",
+        "/items/batch",
+        200,
+        lambda: {
+            "params": {"ids": ",".join(map(str, range(1, 201))), "needy": "n"},
+            "headers": TOKEN,
+        },
+    ),
+    Scenario(
+        "read_items_batch_post",
+        "POST",
+        "/items/batch",
+        200,
+        lambda: {
+            "params": {"needy": "n"},
+            "json": {"ids": list(range(1, 2001))},
+            "headers": TOKEN,
+        },
+    ),
+    Scenario(
+        "read_item",
+        "GET",
+        "/items/3",
+        200,
+        lambda: {"params": {"needy": "n"}, "headers": TOKEN},
+    ),
+    Scenario(
+        "read_item_alias",
+        "GET",
+        "/item/4",
+        200,
+        lambda: {"params": {"needy": "n", "short": "true"}, "headers": TOKEN},
+    ),
+    Scenario(
+        "create_item",
+        "POST",
+        "/item",
+        201,
+        lambda: {"json": big_item(), "headers": TOKEN},
+    ),
+    Scenario(
+        "create_items_bulk",
+        "POST",
+        "/items/bulk",
+        200,
+        lambda: {"content": bulk_body(), "headers": TOKEN},
+    ),
+    Scenario(
+        "update_item",
+        "PUT",
+        "/item/5",
+        200,
+        lambda: {
+            "json": {
+                "item": big_item(),
+                "user": {"username": "joebloggs", "full_name": "Joe Bloggs"},
+                "importance": 5,
+            }
+        },
+    ),
+    Scenario("item_cache_stats", "GET", "/stats/item-cache", 200),
+    Scenario("threadpool_stats", "GET", "/stats/threadpool", 200),
+    Scenario("password_hasher_stats", "GET", "/stats/password-hasher", 200),
+    Scenario("metrics", "GET", "/metrics", 200),
+    Scenario("get_model", "GET", "/model/resnet", 200),
+    Scenario(
+        "create_multiple_images",
+        "POST",
+        "/images/multiple/",
+        201,
+        lambda: {"json": big_item(images=1000)["images"]},
+    ),
+    Scenario(
+        "create_index_weights",
+        "POST",
+        "/index-weights/",
+        201,
+        lambda: {"json": {str(i): f"{i}.{i % 100:02d}" for i in range(10_000)}},
+    ),
+    # The weights stored by `create_index_weights`, which runs first
+    Scenario(
+        "sum_index_weights",
+        "GET",
+        "/index-weights/sum",
+        200,
+        lambda: {"params": {"start": 1000, "stop": 9000}},
+    ),
+    Scenario(
+        "normalize_index_weights",
+        "GET",
+        "/index-weights/normalized",
+        200,
+        lambda: {"params": {"start": 1000, "stop": 2000}},
+    ),
+    Scenario(
+        "read_index_weights",
+        "GET",
+        "/index-weights/range",
+        200,
+        lambda: {"params": {"start": 1000, "stop": 2000}},
+    ),
+    Scenario(
+        "top_index_weights",
+        "GET",
+        "/index-weights/top",
+        200,
+        lambda: {"params": {"k": 100}},
+    ),
+    # Far enough ahead to still be pending when read_event looks it up
+    Scenario(
+        "create_event",
+        "POST",
+        "/event/6ba7b810-9dad-11d1-80b4-00c04fd430c8",
+        201,
+        lambda: {
+            "json": {
+                "start_datetime": "2999-01-01T00:00:00",
+                "end_datetime": "2999-01-02T00:00:00",
+                "repeat_at": "12:00:00",
+                "process_after": 3600,
+            }
+        },
+    ),
+    Scenario("read_event", "GET", "/event/6ba7b810-9dad-11d1-80b4-00c04fd430c8", 200),
+    # An event can only be cancelled once, so every request but the first would
+    # miss anyway; all of them look up an event that was never scheduled
+    Scenario(
+        "cancel_event", "DELETE", "/event/6ba7b811-9dad-11d1-80b4-00c04fd430c8", 404
+    ),
+    Scenario(
+        "create_user",
+        "POST",
+        "/user/",
+        201,
+        lambda: {
+            "json": {
+                "username": "joebloggs",
+                "email": "joe@example.org",
+                "password": "correct horse battery staple",
+            }
+        },
+    ),
+    Scenario(
+        "login",
+        "POST",
+        "/login/",
+        200,
+        lambda: {"data": {"username": "joebloggs", "password": "secret"}},
+    ),
+    Scenario(
+        "create_file",
+        "POST",
+        "/file/",
+        200,
+        lambda: {"files": {"file": ("a.bin", UPLOAD)}, "data": {"token": "t"}},
+    ),
+    Scenario(
+        "create_files",
+        "POST",
+        "/files/",
+        200,
+        lambda: {"files": [("files", (f"{n}.bin", UPLOAD)) for n in range(4)]},
+    ),
+    Scenario(
+        "create_upload_file",
+        "POST",
+        "/uploadfile/",
+        200,
+        lambda: {"files": {"file": ("a.bin", UPLOAD)}},
+    ),
+    Scenario(
+        "create_upload_files",
+        "POST",
+        "/uploadfiles/",
+        200,
+        lambda: {"files": [("files", (f"{n}.bin", UPLOAD)) for n in range(4)]},
+    ),
+    Scenario("read_blob", "GET", "/blobs/{sha256}", 200),
+    Scenario("read_blob_head", "HEAD", "/blobs/{sha256}", 200),
+    Scenario(
+        "read_blob_range",
+        "GET",
+        "/blobs/{sha256}",
+        206,
+        lambda: {"headers": {"Range": "bytes=1000-65535"}},
+    ),
+    Scenario("read_unicorn", "GET", "/unicorns/sparkle", 200),
+    Scenario("read_unicorn_error", "GET", "/unicorns/yolo", 418),
+]
+
+
+def seed_items() -> None:
+    item_snapshots.publish(
+        {
+            item_id: {
+                "id": item_id,
+                "name": f"item{item_id}",
+                "description": "a perfectly ordinary catalogue entry",
+                "price": Decimal(item_id) / 100,
+                "tax": None,
+                "tags": [f"tag{item_id % 100}"],
+                "images": None,
+            }
+            for item_id in range(1, SEEDED_ITEMS + 1)
+        }
+    )
+
+
+def percentile(latencies: list[float], percent: int) -> float:
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int
+) -> dict[str, float]:
+    kwargs = scenario.request()
+    latencies: list[float] = []
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await client.request(scenario.method, scenario.path, **kwargs)
+            latencies.append(time.perf_counter() - started)
+
+            if response.status_code != scenario.status:
+                raise RuntimeError(
+                    f"{scenario.name}: expected {scenario.status}, "
+                    f"got {response.status_code}: {response.text[:200]}"
+                )
+
+    for _ in range(max(requests // 10, 1)):
+        await client.request(scenario.method, scenario.path, **kwargs)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests_per_second": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run(
+    scenarios: list[Scenario], requests: int, concurrency: int
+) -> dict[str, dict[str, float]]:
+    seed_items()
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+
+    async with (
+        app.router.lifespan_context(app),
+        httpx.AsyncClient(transport=transport, base_url="http://bench") as client,
+    ):
+        upload = await client.post("/uploadfile/", files={"file": ("a", UPLOAD)})
+        sha256 = upload.json()["sha256"]
+
+        for scenario in scenarios:
+            scenario = scenario._replace(path=scenario.path.format(sha256=sha256))
+            results[scenario.name] = await run_scenario(
+                client, scenario, requests, concurrency
+            )
+            print_row(scenario.name, results[scenario.name])
+
+    return results
+
+
+def print_row(name: str, result: dict[str, float]) -> None:
+    print(
+        f"{name:24} {result['requests_per_second']:10.1f} "
+        f"{result['p50_ms']:9.3f} {result['p95_ms']:9.3f} {result['p99_ms']:9.3f}"
+    )
+
+
+def uncovered_routes(scenarios: list[Scenario]) -> list[str]:
+    """`METHOD /path` of each route of the app that no scenario requests."""
+    found = []
+
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+
+        for method in sorted(route.methods):
+            if not any(
+                route.matches(
+                    {
+                        "type": "http",
+                        "method": scenario.method,
+                        "path": scenario.path.format(sha256="0" * 64),
+                    }
+                )[0]
+                is Match.FULL
+                for scenario in scenarios
+                if scenario.method == method
+            ):
+                found.append(f"{method} {route.path}")
+
+    return found
+
+
+def regressions(
+    baseline: dict[str, dict[str, float]],
+    results: dict[str, dict[str, float]],
+    threshold: float,
+) -> list[str]:
+    found = []
+
+    for name, result in results.items():
+        before = baseline.get(name)
+
+        if before is None:
+            continue
+
+        if result["p50_ms"] > before["p50_ms"] * (1 + threshold):
+            found.append(
+                f"{name}: p50 {before['p50_ms']:.3f} -> {result['p50_ms']:.3f} ms"
+            )
+
+        if result["requests_per_second"] < before["requests_per_second"] * (
+            1 - threshold
+        ):
+            found.append(
+                f"{name}: {before['requests_per_second']:.1f} -> "
+                f"{result['requests_per_second']:.1f} requests/s"
+            )
+
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=None,
+        help="Requests per scenario (default: the baseline's, else 200)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="Concurrent clients (default: the baseline's, else 8)",
+    )
+    parser.add_argument(
+        "--only", nargs="*", default=None, help="Only run these scenarios"
+    )
+    parser.add_argument("--save", type=Path, help="Write the results to this file")
+    parser.add_argument("--compare", type=Path, help="Baseline file to check against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Largest tolerated slowdown as a fraction (default: 0.2, i.e. 20%%)",
+    )
+    args = parser.parse_args()
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    defaults = {"requests": 200, "concurrency": 8} if baseline is None else baseline
+
+    # Latencies under other loads would not compare
+    for setting in ("requests", "concurrency"):
+        if getattr(args, setting) is None:
+            setattr(args, setting, defaults[setting])
+        elif baseline is not None and getattr(args, setting) != defaults[setting]:
+            parser.error(
+                f"--{setting} {getattr(args, setting)} differs from the "
+                f"baseline's {defaults[setting]}"
+            )
+
+    scenarios = [
+        scenario
+        for scenario in SCENARIOS
+        if (args.only is None or scenario.name in args.only)
+        and (baseline is None or scenario.name in baseline["results"])
+    ]
+
+    print(
+        f"{'scenario':24} {'requests/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    )
+    results = asyncio.run(run(scenarios, args.requests, args.concurrency))
+
+    for route in uncovered_routes(SCENARIOS):
+        print(f"NOT COVERED {route}")
+
+    if args.save:
+        args.save.write_text(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "requests": args.requests,
+                    "concurrency": args.concurrency,
+                    "results": results,
+                },
+                indent=2,
+            )
+        )
+
+    if baseline is None:
+        return 0
+
+    found = regressions(baseline["results"], results, args.threshold)
+
+    for regression in found:
+        print(f"REGRESSION {regression}")
+
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
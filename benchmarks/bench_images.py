@@ -0,0 +1,99 @@
+"""
+Images echo: whole-list validation vs streamed batches with cached URLs.
+
+For `--images` images whose URLs take `--distinct` values, times and measures
+the peak memory of validating a JSON array body the way `/images/multiple/`
+used to (the whole `list[Image]` at once, every URL parsed) and the way it
+does now (the array parsed as it arrives and validated a batch at a time,
+with URLs already seen taken from the cache).
+
+    python benchmarks/bench_images.py [--images 100000] [--distinct 1 100 100000]
+"""
+
+import argparse
+import codecs
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from pydantic import BaseModel, HttpUrl, TypeAdapter
+from pydantic_core import to_json
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import BULK_BATCH_SIZE, image_urls, validate_image_rows  # noqa: E402
+from streaming import JSONArrayParser  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UncachedImage(BaseModel):
+    url: HttpUrl
+    name: str
+
+
+ADAPTER = TypeAdapter(list[UncachedImage])
+
+
+def whole_list(body: bytes) -> None:
+    to_json(ADAPTER.validate_json(body))
+
+
+def streamed(body: bytes) -> None:
+    image_urls.clear()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = JSONArrayParser()
+    batch: list = []
+    count = 0
+
+    for offset in range(0, len(body), CHUNK_SIZE):
+        batch.extend(parser.feed(decoder.decode(body[offset : offset + CHUNK_SIZE])))
+
+        if len(batch) >= BULK_BATCH_SIZE:
+            validate_image_rows(batch, count)
+            count += len(batch)
+            batch = []
+
+    validate_image_rows(batch, count)
+
+
+def measure(func, *args) -> tuple[float, int]:
+    started = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=100_000)
+    parser.add_argument("--distinct", type=int, nargs="+", default=[1, 100, 100_000])
+    args = parser.parse_args()
+
+    print(f"{'distinct':>9} {'path':>9} {'ms':>9} {'bytes/image':>12}")
+
+    for distinct in args.distinct:
+        body = json.dumps(
+            [
+                {"url": f"https://cdn.example.org/{n % distinct}.png", "name": str(n)}
+                for n in range(args.images)
+            ]
+        ).encode()
+
+        for name, func in (("list", whole_list), ("streamed", streamed)):
+            elapsed, peak = measure(func, body)
+            print(
+                f"{distinct:9} {name:>9} {elapsed * 1000:9.1f} "
+                f"{peak / args.images:12.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Inference throughput with and without micro-batching, under concurrency.
+
+Runs the stand-in models of `inference.STAND_IN_MODELS` in `--workers`
+processes and keeps `--concurrency` predictions in flight against each
+`--model`, once for each `--max-batch-size` (1 sends every request on its
+own). Reports requests per second, p50/p99 latency and the mean batch size,
+then the time a forward pass takes per row at each batch size, in process.
+
+Forward passes are plain Python, so a row costs the same in any batch; batches
+pay off by sending fewer round trips to the workers. That is most of the cost
+of a small model such as lenet, and little of a deeper one such as resnet.
+
+    python benchmarks/bench_inference.py [--model lenet resnet] [--concurrency 1 16 64]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from inference import BATCH_SIZE, STAND_IN_MODELS, InferenceEngine  # noqa: E402
+
+
+def percentile(latencies: list[float], percent: int) -> float:
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+def batches(model: str) -> tuple[float, float]:
+    counts = BATCH_SIZE.values.get((model,), [0.0, 0.0])
+
+    return sum(counts[:-1]), counts[-1]
+
+
+async def measure(
+    engine: InferenceEngine, model: str, requests: int, concurrency: int
+) -> tuple[float, float, float, float]:
+    rng = random.Random(0)  # noqa: S311
+    size = engine.input_size(model)
+    inputs = [[rng.uniform(-1, 1) for _ in range(size)] for _ in range(64)]
+    latencies: list[float] = []
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        for n in remaining:
+            started = time.perf_counter()
+            await engine.predict(model, inputs[n % len(inputs)])
+            latencies.append(time.perf_counter() - started)
+
+    batches_before, rows_before = batches(model)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    count, rows = batches(model)
+
+    return (
+        requests / elapsed,
+        percentile(latencies, 50),
+        percentile(latencies, 99),
+        (rows - rows_before) / (count - batches_before),
+    )
+
+
+async def run(args: argparse.Namespace) -> None:
+    for model in args.model:
+        for max_batch_size in args.max_batch_size:
+            engine = InferenceEngine(
+                STAND_IN_MODELS,
+                workers=args.workers,
+                max_batch_size=max_batch_size,
+                max_wait=args.max_wait_ms / 1000,
+            )
+
+            try:
+                # Starts the workers, which load the models
+                await measure(engine, model, args.workers * 4, args.workers)
+
+                for concurrency in args.concurrency:
+                    rate, p50, p99, mean_batch = await measure(
+                        engine, model, args.requests, concurrency
+                    )
+                    print(
+                        f"{model:>7} {max_batch_size:9} {concurrency:11} "
+                        f"{rate:10.0f} {p50 * 1000:8.2f} {p99 * 1000:8.2f} "
+                        f"{mean_batch:10.1f}"
+                    )
+            finally:
+                engine.close()
+
+
+def forward_per_row(model: str, batch_size: int, rows: int) -> float:
+    dense = STAND_IN_MODELS[model].load()
+    rng = random.Random(0)  # noqa: S311
+    size = STAND_IN_MODELS[model].input_size
+    batch = [[rng.uniform(-1, 1) for _ in range(size)] for _ in range(batch_size)]
+    passes = max(1, rows // batch_size)
+    started = time.perf_counter()
+
+    for _ in range(passes):
+        dense.forward(batch)
+
+    return (time.perf_counter() - started) / (passes * batch_size)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--model",
+        choices=sorted(STAND_IN_MODELS),
+        nargs="+",
+        default=["lenet", "resnet"],
+    )
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--max-batch-size", type=int, nargs="+", default=[1, 32])
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(
+        f"{'model':>7} {'max batch':>9} {'concurrency':>11} {'requests/s':>10} "
+        f"{'p50 ms':>8} {'p99 ms':>8} {'mean batch':>10}"
+    )
+    asyncio.run(run(args))
+
+    print(f"\n{'model':>7} {'batch':>9} {'forward us/row':>14}")
+
+    for model in args.model:
+        for batch_size in args.max_batch_size:
+            per_row = forward_per_row(model, batch_size, args.requests)
+            print(f"{model:>7} {batch_size:9} {per_row * 1e6:14.1f}")
+
+
+if __name__ == "__main__":
+    main()
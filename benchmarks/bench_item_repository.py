@@ -0,0 +1,58 @@
+"""
+Write throughput of `SQLiteItemRepository` against the number of concurrent writers.
+
+With group commit, every transaction carries the writes that queued up while the
+previous one was being flushed, so rows per second should grow with concurrency.
+
+    python benchmarks/bench_item_repository.py [--writes 2000]
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from item_repository import SQLiteItemRepository  # noqa: E402
+
+
+async def run(concurrency: int, writes: int) -> tuple[float, float]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repository = SQLiteItemRepository(str(Path(tmp_dir) / "items.db"))
+        await repository.open()
+        next_id = iter(range(1, writes + 1))
+
+        async def writer() -> None:
+            for item_id in next_id:
+                await repository.save(
+                    {"id": item_id, "name": "bench", "price": Decimal("9.99")}
+                )
+
+        started = time.perf_counter()
+        await asyncio.gather(*(writer() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        rows_per_batch = repository.rows_committed / repository.batches_committed
+        await repository.close()
+
+    return writes / elapsed, rows_per_batch
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writes", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64, 256])
+    args = parser.parse_args()
+
+    print(f"{'writers':>8} {'rows/s':>10} {'rows/commit':>12}")
+
+    for concurrency in args.concurrency:
+        throughput, rows_per_batch = asyncio.run(run(concurrency, args.writes))
+        print(f"{concurrency:>8} {throughput:>10.0f} {rows_per_batch:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Lookup and single-item publish latency of item snapshots as the number of items grows.
+
+Every synthetic item has a unique name token, shares its tag with 9 other items
+and sits in a price range of 10 items, so each query returns the same number of
+rows at every size and any growth in latency comes from the snapshot itself.
+Publishes add one item at a time, so most write a delta segment and a few fold
+it into a new base; their mean and worst latencies are reported.
+
+    python benchmarks/bench_item_snapshot.py [--sizes 1000 10000 100000 1000000]
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from item_snapshot import SnapshotStore  # noqa: E402
+
+LOOKUPS = 2_000
+PUBLISHES = 2_000
+
+
+def make_item(item_id: int) -> dict:
+    return {
+        "id": item_id,
+        "name": f"item{item_id}",
+        "description": "a perfectly ordinary catalogue entry",
+        "price": Decimal(item_id) / 100,
+        "tax": None,
+        "tags": [f"tag{item_id // 10}"],
+        "images": None,
+    }
+
+
+def time_per_call(func, args_list) -> float:
+    started = time.perf_counter()
+
+    for args in args_list:
+        func(*args)
+
+    return (time.perf_counter() - started) / len(args_list) * 1e6
+
+
+def time_publishes(store: SnapshotStore, size: int) -> tuple[float, float]:
+    latencies = []
+
+    for item_id in range(size + 1, size + PUBLISHES + 1):
+        started = time.perf_counter()
+        store.publish({item_id: make_item(item_id)})
+        latencies.append(time.perf_counter() - started)
+
+    return sum(latencies) / len(latencies) * 1e3, max(latencies) * 1e3
+
+
+def run(size: int, directory: str) -> dict[str, float]:
+    store = SnapshotStore(directory)
+    store.seed({item_id: make_item(item_id) for item_id in range(1, size + 1)})
+    snapshot = store.current()
+    ids = [random.randint(1, size) for _ in range(LOOKUPS)]  # noqa: S311
+
+    def search(**kwargs) -> list[int]:
+        return list(snapshot.iter_search(**kwargs))
+
+    result = {
+        "get": time_per_call(snapshot.get, [(item_id,) for item_id in ids]),
+        "q": time_per_call(
+            lambda item_id: search(q=f"item{item_id}"),
+            [(item_id,) for item_id in ids],
+        ),
+        "tag": time_per_call(
+            lambda item_id: search(tags=[f"tag{item_id // 10}"]),
+            [(item_id,) for item_id in ids],
+        ),
+        "price": time_per_call(
+            lambda item_id: search(
+                price_min=Decimal(item_id) / 100,
+                price_max=Decimal(item_id + 9) / 100,
+            ),
+            [(item_id,) for item_id in ids],
+        ),
+    }
+    result["publish"], result["worst"] = time_publishes(store, size)
+
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10**3, 10**4, 10**5, 10**6]
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'items':>10} {'get µs':>8} {'q µs':>8} {'tag µs':>8} {'price µs':>9}"
+        f" {'publish ms':>10} {'worst ms':>9}"
+    )
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            result = run(size, directory)
+
+        print(
+            f"{size:>10} {result['get']:>8.2f} {result['q']:>8.2f}"
+            f" {result['tag']:>8.2f} {result['price']:>9.2f}"
+            f" {result['publish']:>10.2f} {result['worst']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Added cost per request of MetricsMiddleware.
+
+Drives a bare ASGI app that answers every request with a fixed body, with
+and without the middleware, so that the difference in wall time per request
+is the cost of the instrumentation alone.
+
+    python benchmarks/bench_metrics.py [--requests 20000]
+"""
+
+import argparse
+import asyncio
+import time
+
+from _asgi import call
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from metrics import MetricsMiddleware
+
+
+class Route:
+    path = "/items/{item_id}"
+
+
+async def bare_app(scope: Scope, receive: Receive, send: Send) -> None:
+    scope["route"] = Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b'{"item_id":1}'})
+
+
+def build_app(with_metrics: bool) -> ASGIApp:
+    return MetricsMiddleware(bare_app) if with_metrics else bare_app
+
+
+async def time_per_request(app: ASGIApp, requests: int) -> float:
+    for _ in range(1_000):
+        await call(app, "GET", "/items/1")
+
+    started = time.perf_counter()
+
+    for item_id in range(requests):
+        await call(app, "GET", f"/items/{item_id}")
+
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    plain, instrumented = build_app(False), build_app(True)
+    without, with_ = [], []
+
+    for _ in range(args.rounds):
+        without.append(asyncio.run(time_per_request(plain, args.requests)))
+        with_.append(asyncio.run(time_per_request(instrumented, args.requests)))
+
+    print(f"without metrics: {min(without):6.2f} µs/request")
+    print(f"with metrics:    {min(with_):6.2f} µs/request")
+    print(f"added cost:      {min(with_) - min(without):6.2f} µs/request")
+
+
+if __name__ == "__main__":
+    main()
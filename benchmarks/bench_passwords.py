@@ -0,0 +1,136 @@
+"""
+Latency of other routes during a login burst, hashing in the threadpool vs the hasher.
+
+Serves a login that hashes its password with scrypt two ways: as a plain
+`def`, which FastAPI runs in the threadpool shared with every other sync
+handler, and as an `async def` awaiting a `PasswordHasher` with threads of
+its own. While `--logins` concurrent clients keep logging in, other clients
+call a trivial sync route; reports logins per second, logins refused with
+503, and p50/p99 latency of the trivial route.
+
+    python benchmarks/bench_passwords.py [--logins 64] [--workers 2] [--n 16384]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from http import HTTPStatus
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI, Form
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from passwords import (  # noqa: E402
+    HasherBusy,
+    PasswordHasher,
+    ScryptParams,
+    hash_password,
+)
+
+
+def make_app(hasher: PasswordHasher) -> FastAPI:
+    app = FastAPI()
+
+    @app.exception_handler(HasherBusy)
+    async def busy(request, exc: HasherBusy) -> JSONResponse:
+        return JSONResponse(
+            {}, status_code=HTTPStatus.SERVICE_UNAVAILABLE, headers={"Retry-After": "1"}
+        )
+
+    @app.post("/threaded")
+    def threaded(password: str = Form()) -> dict:
+        return {"password_hash": hash_password(password, hasher.params)}
+
+    @app.post("/hasher")
+    async def offloaded(password: str = Form()) -> dict:
+        return {"password_hash": await hasher.hash(password)}
+
+    @app.get("/other")
+    def other() -> dict:
+        return {"message": "hello, world!"}
+
+    return app
+
+
+def percentile(latencies: list[float], percent: int) -> float:
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+async def measure(
+    client: httpx.AsyncClient, path: str, args: argparse.Namespace
+) -> tuple[float, int, float, float]:
+    deadline = time.perf_counter() + args.seconds
+    statuses: list[int] = []
+    latencies: list[float] = []
+
+    async def log_in() -> None:
+        while time.perf_counter() < deadline:
+            resp = await client.post(path, data={"password": "P@ssw0rd"})
+            statuses.append(resp.status_code)
+
+            if resp.status_code == HTTPStatus.SERVICE_UNAVAILABLE:
+                # Standing in for the `Retry-After` the app sends
+                await asyncio.sleep(args.retry_after)
+
+    async def call_other() -> None:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await client.get("/other")
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(
+        *(log_in() for _ in range(args.logins)),
+        *(call_other() for _ in range(args.others)),
+    )
+    logged_in = statuses.count(HTTPStatus.OK)
+
+    return (
+        logged_in / args.seconds,
+        len(statuses) - logged_in,
+        percentile(latencies, 50),
+        percentile(latencies, 99),
+    )
+
+
+async def run(args: argparse.Namespace) -> None:
+    hasher = PasswordHasher(
+        ScryptParams(n=args.n), workers=args.workers, max_queue=args.queue
+    )
+    transport = httpx.ASGITransport(app=make_app(hasher))
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=60
+    ) as client:
+        for path in ("/threaded", "/hasher"):
+            rate, refused, p50, p99 = await measure(client, path, args)
+            print(
+                f"{path[1:]:>8} {rate:10.0f} {refused:7} "
+                f"{p50 * 1000:8.2f} {p99 * 1000:8.2f}"
+            )
+
+    hasher.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--others", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue", type=int, default=16)
+    parser.add_argument("--n", type=int, default=2**14)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"{'login':>8} {'logins/s':>10} {'refused':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
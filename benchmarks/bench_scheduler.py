@@ -0,0 +1,96 @@
+"""
+Memory per pending event and scheduling jitter of the event scheduler.
+
+Schedules `--pending` events due days ahead, as `POST /event/{event_id}`
+does, and reports the time and memory each took. Then, with those still
+pending, schedules `--due` events at random times over the next `--seconds`
+and reports how late they ran: p50, p99 and the worst.
+
+    python benchmarks/bench_scheduler.py [--pending 1000000] [--resolution 0.01]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from scheduler import EventScheduler, ScheduledEvent  # noqa: E402
+
+
+def percentile(latencies: list[float], percent: int) -> float:
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+async def run(args: argparse.Namespace) -> None:
+    lateness: list[float] = []
+
+    async def action(event: ScheduledEvent) -> None:
+        lateness.append((datetime.now(timezone.utc) - event.next_run).total_seconds())
+
+    rng = random.Random(0)  # noqa: S311
+    now = datetime.now(timezone.utc)
+    ids = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(args.pending)]
+    due = [now + timedelta(days=rng.uniform(1, 30)) for _ in range(args.pending)]
+
+    # Memory is measured on a scheduler of its own, as tracing allocations
+    # slows everything down
+    tracemalloc.start()
+    scheduler = EventScheduler(action, resolution=args.resolution)
+
+    for event_id, next_run in zip(ids, due, strict=True):
+        scheduler.schedule(ScheduledEvent(event_id, next_run))
+
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await scheduler.close()
+
+    scheduler = EventScheduler(action, resolution=args.resolution)
+    started = time.perf_counter()
+
+    for event_id, next_run in zip(ids, due, strict=True):
+        scheduler.schedule(ScheduledEvent(event_id, next_run))
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"{args.pending} pending events: {elapsed / args.pending * 1e6:.2f} us and "
+        f"{used / args.pending:.0f} bytes each (besides the id)"
+    )
+
+    now = datetime.now(timezone.utc)
+
+    for n in range(args.due):
+        delay = timedelta(seconds=rng.uniform(0.1, args.seconds))
+        scheduler.schedule(ScheduledEvent(f"due-{n}", now + delay))
+
+    await asyncio.sleep(args.seconds + 4 * args.resolution + 0.1)
+    await scheduler.close()
+
+    print(
+        f"{len(lateness)} of {args.due} due events ran, late by p50 "
+        f"{percentile(lateness, 50) * 1000:.2f} ms, p99 "
+        f"{percentile(lateness, 99) * 1000:.2f} ms, worst "
+        f"{max(lateness) * 1000:.2f} ms (resolution {args.resolution * 1000:g} ms)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pending", type=int, default=1_000_000)
+    parser.add_argument("--due", type=int, default=5000)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--resolution", type=float, default=0.01)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
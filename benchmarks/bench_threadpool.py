@@ -0,0 +1,128 @@
+"""
+Sync handlers in the threadpool vs inline on the event loop, under concurrency.
+
+Serves the same trivial dict-building handler two ways: as a plain `def`,
+which FastAPI runs in the threadpool, and wrapped with `run_inline`, which
+runs it on the event loop. Each is loaded through httpx's ASGI transport at
+several concurrency levels, and for each threadpool size in `--threads`;
+reports requests per second, p50/p99 latency and the mean time calls waited
+for a thread.
+
+    python benchmarks/bench_threadpool.py [--concurrency 1 16 64 256] [--threads 40]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import httpx
+from fastapi import FastAPI, Header
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from threadpool import (  # noqa: E402
+    WAIT,
+    configure_threadpool,
+    install_wait_timer,
+    run_inline,
+)
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+
+    def home(x_dummy: Optional[str] = Header(None)) -> dict:
+        result = {"message": "hello, world!"}
+
+        if x_dummy:
+            result["dummy"] = x_dummy
+
+        return result
+
+    app.get("/threaded")(home)
+    app.get("/inline")(run_inline(home))
+
+    return app
+
+
+def percentile(latencies: list[float], percent: int) -> float:
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+def waited() -> tuple[float, float]:
+    counts = WAIT.values.get((), [0.0, 0.0])
+
+    return sum(counts[:-1]), counts[-1]
+
+
+async def measure(
+    client: httpx.AsyncClient, path: str, requests: int, concurrency: int
+) -> tuple[float, float, float, float]:
+    latencies: list[float] = []
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        for _ in remaining:
+            started = time.perf_counter()
+            await client.get(path)
+            latencies.append(time.perf_counter() - started)
+
+    calls_before, waited_before = waited()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    calls, total_wait = waited()
+    calls -= calls_before
+    mean_wait = (total_wait - waited_before) / calls if calls else 0.0
+
+    return (
+        requests / elapsed,
+        percentile(latencies, 50),
+        percentile(latencies, 99),
+        mean_wait,
+    )
+
+
+async def run(args: argparse.Namespace) -> None:
+    app = make_app()
+    install_wait_timer()
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        for threads in args.threads:
+            configure_threadpool(threads)
+
+            for concurrency in args.concurrency:
+                for path in ("/threaded", "/inline"):
+                    await measure(client, path, args.requests // 10, concurrency)
+                    rate, p50, p99, wait = await measure(
+                        client, path, args.requests, concurrency
+                    )
+                    print(
+                        f"{path[1:]:>8} {threads:7} {concurrency:11} {rate:10.0f} "
+                        f"{p50 * 1000:8.3f} {p99 * 1000:8.3f} {wait * 1000:9.3f}"
+                    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256])
+    parser.add_argument("--threads", type=int, nargs="+", default=[40])
+    args = parser.parse_args()
+
+    print(
+        f"{'path':>8} {'threads':>7} {'concurrency':>11} {'requests/s':>10} "
+        f"{'p50 ms':>8} {'p99 ms':>8} {'wait ms':>9}"
+    )
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Weight maps: boxed Decimal dicts vs fixed-point arrays, and index query costs.
+
+For each `--sizes` count of weights, times and measures the peak memory of
+echoing a JSON body of weights the way `/index-weights/` used to (validated
+into a `dict[int, Decimal]` and serialized back) and the way it does now
+(read into int64 arrays, with the body itself as the echo). Then times the queries of
+a `WeightStore` holding the largest size, and an upsert of `--upsert` weights
+into it.
+
+    python benchmarks/bench_weight_index.py [--sizes 10000 100000 1000000]
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from decimal import Decimal
+from pathlib import Path
+
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from weight_index import WeightStore, parse_weights, render_weights  # noqa: E402
+
+ADAPTER = TypeAdapter(dict[int, Decimal])
+
+
+def through_dicts(body: bytes) -> bytes:
+    return to_json(ADAPTER.validate_json(body))
+
+
+def through_arrays(body: bytes) -> bytes:
+    parse_weights(body)
+
+    return body
+
+
+def measure(func, *args) -> tuple[float, int]:
+    started = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--upsert", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'weights':>9} {'path':>7} {'ms':>9} {'bytes/weight':>12}")
+
+    for size in args.sizes:
+        body = json.dumps({str(n): f"{n}.{n % 100:02d}" for n in range(size)})
+
+        for name, func in (("dicts", through_dicts), ("arrays", through_arrays)):
+            elapsed, peak = measure(func, body.encode())
+            print(f"{size:9} {name:>7} {elapsed * 1000:9.1f} {peak / size:12.0f}")
+
+    size = max(args.sizes)
+    keys = array("q", range(0, 2 * size, 2))
+    values = array("q", (n * 7919 % 1_000_003 for n in range(size)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = WeightStore(str(Path(directory) / "weights.idx"))
+        store.upsert(keys, values)
+        index = store.current()
+        upsert_keys = array("q", range(1, 2 * size, 2 * size // args.upsert))
+        queries = [
+            ("sum", lambda: index.total()),
+            ("sum of 1%", lambda: index.total(size // 2, size // 2 + size // 50)),
+            ("top 10", lambda: index.top(10)),
+            ("normalized 1%", lambda: index.normalized(0, size // 50)),
+            ("range 1%", lambda: render_weights(*index.span(0, size // 50))),
+            (
+                f"upsert {len(upsert_keys)}",
+                lambda: store.upsert(upsert_keys, array("q", upsert_keys)),
+            ),
+        ]
+
+        print(f"\n{size} weights in the index")
+
+        for name, query in queries:
+            started = time.perf_counter()
+            query()
+            print(f"{name:>14} {(time.perf_counter() - started) * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
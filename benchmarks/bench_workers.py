@@ -0,0 +1,155 @@
+"""
+Throughput of serve.py as the number of worker processes grows.
+
+For each worker count, starts `serve.py` on a local port, waits until it
+answers, and loads it from `--clients` client processes, each holding
+`--connections` keep-alive connections that send requests back to back. The
+client is a minimal HTTP/1.1 loop over asyncio streams so that the load
+generator costs as little CPU as possible; the client processes still share
+the machine with the server, so leave CPUs for them when reading the results.
+
+    python benchmarks/bench_workers.py [--workers 1 2 4] [--path /items/1?needy=x]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+
+    await reader.readexactly(length)
+
+    return status
+
+
+async def connection(port: int, request: bytes, deadline: float) -> tuple[int, int]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    ok = failed = 0
+
+    try:
+        while time.monotonic() < deadline:
+            writer.write(request)
+            status = await read_response(reader)
+
+            if status == 200:
+                ok += 1
+            else:
+                failed += 1
+    finally:
+        writer.close()
+
+    return ok, failed
+
+
+def client(port: int, request: bytes, connections: int, seconds: float):
+    async def run() -> list[tuple[int, int]]:
+        deadline = time.monotonic() + seconds
+
+        return await asyncio.gather(
+            *(connection(port, request, deadline) for _ in range(connections))
+        )
+
+    results = asyncio.run(run())
+
+    return sum(ok for ok, _ in results), sum(failed for _, failed in results)
+
+
+def wait_until_serving(port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError(f"serve.py did not start on port {port}")
+
+
+def measure(workers: int, args: argparse.Namespace) -> tuple[float, int]:
+    port = free_port()
+    server = subprocess.Popen(  # noqa: S603
+        [
+            sys.executable,
+            str(ROOT / "serve.py"),
+            "--workers",
+            str(workers),
+            "--port",
+            str(port),
+            "--no-access-log",
+        ],
+        cwd=ROOT,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        wait_until_serving(port)
+        # Give every worker time to finish its startup
+        time.sleep(1 + workers * 0.2)
+        request = (
+            f"GET {args.path} HTTP/1.1\r\nHost: bench\r\nX-Token: {args.token}\r\n\r\n"
+        ).encode()
+
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.starmap(
+                client,
+                [(port, request, args.connections, args.seconds)] * args.clients,
+            )
+    finally:
+        server.terminate()
+        server.wait()
+
+    ok = sum(ok for ok, _ in results)
+    failed = sum(failed for _, failed in results)
+
+    return ok / args.seconds, failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=max(os.cpu_count() // 2, 1))
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--path", default="/items/1?needy=bench")
+    parser.add_argument("--token", default="coneofsilence")
+    args = parser.parse_args()
+    baseline = None
+
+    print(f"{'workers':>7} {'requests/s':>11} {'speedup':>8} {'failed':>7}")
+
+    for workers in args.workers:
+        throughput, failed = measure(workers, args)
+        baseline = baseline or throughput
+        print(
+            f"{workers:7} {throughput:11.0f} {throughput / baseline:7.2f}x {failed:7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
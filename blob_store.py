@@ -0,0 +1,146 @@
+"""Content-addressed storage for uploaded files"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from fastapi import UploadFile
+
+from uploads import UPLOAD_CHUNK_SIZE, digest_file
+
+
+@dataclass(frozen=True)
+class StoredBlob:
+    sha256: str
+    size: int
+    deduplicated: bool
+
+
+def copy_file_contents(src: BinaryIO, dst: BinaryIO, size: int) -> None:
+    """
+    Copy the first `size` bytes of `src` into `dst`.
+
+    Files that live on disk are copied inside the kernel with `copy_file_range`
+    (or `sendfile`) where the OS provides it. Spooled uploads still held in
+    memory have no file descriptor and are copied chunk by chunk.
+    """
+    if getattr(src, "_rolled", True):
+        try:
+            src_fd, dst_fd = src.fileno(), dst.fileno()
+        except (AttributeError, OSError):
+            pass
+        else:
+            if _copy_fd_range(src_fd, dst_fd, size):
+                return
+
+    src.seek(0)
+    shutil.copyfileobj(src, dst, UPLOAD_CHUNK_SIZE)
+    src.seek(0)
+
+
+def _copy_fd_range(src_fd: int, dst_fd: int, size: int) -> bool:
+    copy = getattr(os, "copy_file_range", None) or getattr(os, "sendfile", None)
+
+    if copy is None:
+        return False
+
+    offset = 0
+
+    try:
+        while offset < size:
+            if copy is os.sendfile:
+                copied = os.sendfile(dst_fd, src_fd, offset, size - offset)
+            else:
+                copied = os.copy_file_range(src_fd, dst_fd, size - offset, offset)
+
+            if copied == 0:
+                break
+
+            offset += copied
+    except OSError:
+        # e.g. copying across filesystems on older kernels
+        pass
+
+    if offset == size:
+        return True
+
+    # Fall back to a userspace copy from the start, over whatever part was
+    # copied already
+    os.ftruncate(dst_fd, 0)
+    os.lseek(dst_fd, 0, os.SEEK_SET)
+
+    return False
+
+
+class BlobStore:
+    """
+    Files stored on local disk under the SHA-256 of their content, so identical
+    uploads are kept only once.
+
+    Hashing and copying run in a bounded pool of worker threads, started on
+    first use and again after `close`. A blob is first written to a temporary
+    file next to its final path and then linked into place, so readers never
+    observe a partially written blob.
+    """
+
+    def __init__(self, root: str, max_workers: int = 4) -> None:
+        self.root = Path(root)
+        self.max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+    def exists(self, sha256: str) -> bool:
+        return self.path_for(sha256).is_file()
+
+    async def ingest(self, upload: UploadFile) -> StoredBlob:
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(
+            self._executor(), self.ingest_file, upload.file
+        )
+
+    async def ingest_many(self, uploads: list[UploadFile]) -> list[StoredBlob]:
+        return list(await asyncio.gather(*(self.ingest(upload) for upload in uploads)))
+
+    def ingest_file(self, file: BinaryIO) -> StoredBlob:
+        digest = digest_file(file)
+        target = self.path_for(digest.sha256)
+
+        if target.is_file():
+            return StoredBlob(digest.sha256, digest.size, deduplicated=True)
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(dir=target.parent, delete=False) as tmp:
+            copy_file_contents(file, tmp, digest.size)
+
+        try:
+            os.chmod(tmp.name, 0o444)
+            os.link(tmp.name, target)
+        except FileExistsError:
+            # Another request stored the same content in the meantime.
+            return StoredBlob(digest.sha256, digest.size, deduplicated=True)
+        finally:
+            os.unlink(tmp.name)
+
+        return StoredBlob(digest.sha256, digest.size, deduplicated=False)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="blob-store"
+            )
+
+        return self._pool
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
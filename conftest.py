@@ -1,11 +1,14 @@
 import httpx
 import pytest
 
+import main
+from blob_store import BlobStore
+
 
 @pytest.fixture
 def data_for_read_items():
     return {
-        "q": "abcdefg",
+        "q": "hero",
         "q-2": ["1", "2", "3"],
         "q3": "im deprecated",
     }
@@ -17,3 +20,11 @@ def disable_network_calls(monkeypatch):
         raise RuntimeError("Network access not allowed during testing!")
 
     monkeypatch.setattr(httpx, "get", lambda *args, **kwargs: stunted_get())
+
+
+@pytest.fixture
+def blob_store(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path / "blobs"), max_workers=2)
+    monkeypatch.setattr(main, "blob_store", store)
+    yield store
+    store.close()
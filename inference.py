@@ -0,0 +1,318 @@
+"""Model serving: micro-batched inference in a pool of worker processes"""
+
+import asyncio
+import math
+import multiprocessing
+import random
+import time
+from collections.abc import Awaitable, Callable, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from itertools import pairwise
+from operator import mul
+from typing import Generic, Optional, TypeVar
+
+from metrics import REGISTRY
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BATCH_SIZE = REGISTRY.histogram(
+    "inference_batch_size",
+    "Requests run together in one forward pass, by model.",
+    ("model",),
+    buckets=tuple(float(2**exponent) for exponent in range(8)),
+)
+QUEUE_DELAY = REGISTRY.histogram(
+    "inference_queue_delay_seconds",
+    "Time requests waited to be sent to a worker in a batch, by model.",
+    ("model",),
+)
+BATCH_DURATION = REGISTRY.histogram(
+    "inference_batch_seconds",
+    "Time from sending a batch to a worker to its results, by model.",
+    ("model",),
+)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """
+    A fully connected network with ReLU activations and a softmax output,
+    given by the width of each layer. Its weights are drawn from `seed`, so
+    every worker process loads the same model.
+    """
+
+    layer_sizes: tuple[int, ...]
+    seed: int
+
+    @property
+    def input_size(self) -> int:
+        return self.layer_sizes[0]
+
+    def load(self) -> "DenseModel":
+        rng = random.Random(self.seed)  # noqa: S311
+        layers = []
+
+        for inputs, outputs in pairwise(self.layer_sizes):
+            scale = math.sqrt(2 / inputs)
+            columns = [
+                [rng.gauss(0, scale) for _ in range(inputs)] for _ in range(outputs)
+            ]
+            biases = [rng.gauss(0, 0.01) for _ in range(outputs)]
+            layers.append((columns, biases))
+
+        return DenseModel(layers)
+
+
+class DenseModel:
+    def __init__(self, layers: list[tuple[list[list[float]], list[float]]]) -> None:
+        # Per layer, the weights of each output unit and its bias
+        self.layers = layers
+
+    def forward(self, batch: list[list[float]]) -> list[list[float]]:
+        """
+        Class probabilities for each row of `batch`, all rows one layer at a time.
+
+        The arithmetic is plain Python, so a row costs as much in a batch as on
+        its own: what a batch saves is the round trip to a worker process for
+        each row, which dominates for small models (see bench_inference.py).
+        """
+        last = len(self.layers) - 1
+
+        for index, (columns, biases) in enumerate(self.layers):
+            batch = [
+                [
+                    sum(map(mul, row, column), bias)
+                    for column, bias in zip(columns, biases, strict=True)
+                ]
+                for row in batch
+            ]
+
+            if index < last:
+                batch = [
+                    [value if value > 0 else 0.0 for value in row] for row in batch
+                ]
+
+        return [softmax(row) for row in batch]
+
+
+def softmax(row: list[float]) -> list[float]:
+    top = max(row)
+    exps = [math.exp(value - top) for value in row]
+    total = sum(exps)
+
+    return [value / total for value in exps]
+
+
+# Small stand-ins for the models named by `main.ModelName`
+STAND_IN_MODELS = {
+    "alexnet": ModelSpec((128, 256, 10), seed=1),
+    "resnet": ModelSpec((128, 128, 128, 10), seed=2),
+    "lenet": ModelSpec((32, 64, 10), seed=3),
+}
+
+# The models of a worker process, loaded once when it starts
+_worker_models: dict[str, DenseModel] = {}
+
+
+def _load_models(specs: Mapping[str, ModelSpec]) -> None:
+    for name, spec in specs.items():
+        _worker_models[name] = spec.load()
+
+
+def _predict_batch(name: str, batch: list[list[float]]) -> list[tuple[int, float]]:
+    """The most likely class of each row and its probability."""
+    return [
+        max(enumerate(probabilities), key=lambda pair: pair[1])
+        for probabilities in _worker_models[name].forward(batch)
+    ]
+
+
+class _Request(Generic[T]):
+    __slots__ = ("value", "future", "queued")
+
+    def __init__(self, value: T, future: asyncio.Future, queued: float) -> None:
+        self.value = value
+        self.future = future
+        self.queued = queued
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Collects concurrent calls into batches for `run_batch`.
+
+    When no batch is running, calls are sent right away. Otherwise a batch is
+    sent once it holds `max_batch_size` calls or its oldest call has waited
+    `max_wait`, and at most `max_in_flight` batches run at once; while they
+    all run, calls keep collecting. Batches so grow with the load: an idle
+    server adds no delay, and under load each batch amortizes the cost of a
+    round trip to a worker.
+
+    The calls waiting for a batch, the task collecting them and the batches
+    running belong to the event loop that submitted them. Once every call has
+    its result, the collector has finished, and the batcher may serve another
+    event loop.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[list[T]], Awaitable[list[R]]],
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+        max_in_flight: int = 1,
+        name: str = "",
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        self.name = name
+        self.clock = clock
+        self.in_flight = 0
+        self._pending: list[_Request[T]] = []
+        self._collector: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Future] = None
+        self._batches: set[asyncio.Task] = set()
+
+    async def submit(self, value: T) -> R:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_Request(value, future, self.clock()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._wake()
+
+        if self._collector is None or self._collector.done():
+            self._collector = asyncio.create_task(self._collect())
+
+        return await future
+
+    def _wake(self) -> None:
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    async def _sleep(self, timeout: Optional[float]) -> None:
+        """Wait up to `timeout` for `_wake`."""
+        self._wakeup = asyncio.get_running_loop().create_future()
+
+        try:
+            await asyncio.wait_for(self._wakeup, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._wakeup = None
+
+    async def _collect(self) -> None:
+        while self._pending:
+            while self.in_flight and len(self._pending) < self.max_batch_size:
+                remaining = self._pending[0].queued + self.max_wait - self.clock()
+
+                if remaining <= 0:
+                    break
+
+                await self._sleep(remaining)
+
+            while self.in_flight >= self.max_in_flight:
+                await self._sleep(None)
+
+            batch = [
+                request
+                for request in self._pending[: self.max_batch_size]
+                if not request.future.done()
+            ]
+            del self._pending[: self.max_batch_size]
+
+            if batch:
+                self.in_flight += 1
+                task = asyncio.create_task(self._run(batch))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+
+    async def _run(self, batch: list[_Request[T]]) -> None:
+        labels = (self.name,)
+        sent = self.clock()
+        BATCH_SIZE.observe(len(batch), labels)
+
+        for request in batch:
+            QUEUE_DELAY.observe(sent - request.queued, labels)
+
+        try:
+            results = await self.run_batch([request.value for request in batch])
+        except Exception as exc:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(exc)
+        else:
+            for request, result in zip(batch, results, strict=True):
+                if not request.future.done():
+                    request.future.set_result(result)
+        finally:
+            BATCH_DURATION.observe(self.clock() - sent, labels)
+            self.in_flight -= 1
+            self._wake()
+
+
+class InferenceEngine:
+    """
+    Serves predictions of the models in `specs`, keyed by model name.
+
+    Forward passes run in `workers` processes, so they hold neither the event
+    loop nor the GIL of the serving process; each worker loads every model
+    once when it starts. The requests for each model are micro-batched, with
+    one batch per model in flight per worker. The pool is started on first
+    use and again after `close`.
+    """
+
+    def __init__(
+        self,
+        specs: Mapping[str, ModelSpec],
+        workers: int = 2,
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+    ) -> None:
+        self.specs = dict(specs)
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.batchers = {
+            name: MicroBatcher(
+                partial(self._run_batch, name),
+                max_batch_size=max_batch_size,
+                max_wait=max_wait,
+                max_in_flight=workers,
+                name=name,
+            )
+            for name in self.specs
+        }
+
+    def input_size(self, name: str) -> int:
+        return self.specs[name].input_size
+
+    async def predict(self, name: str, features: Sequence[float]) -> tuple[int, float]:
+        """The most likely class for `features` and its probability."""
+        return await self.batchers[name].submit(list(features))
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # Forking a process that runs threads can deadlock the child
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_load_models,
+                initargs=(self.specs,),
+            )
+
+        return self._pool
+
+    async def _run_batch(
+        self, name: str, batch: list[list[float]]
+    ) -> list[tuple[int, float]]:
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self._executor(), _predict_batch, name, batch)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
@@ -0,0 +1,227 @@
+"""Durable SQLite storage for items"""
+
+import asyncio
+import json
+import queue
+import sqlite3
+from collections.abc import Iterator
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Any, Optional
+
+from anyio import CapacityLimiter, to_thread
+
+# Statements are kept as module constants: sqlite3 caches the compiled form of
+# each distinct SQL text per connection, so every call after the first reuses a
+# prepared statement.
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    price TEXT NOT NULL,
+    tax TEXT,
+    tags TEXT NOT NULL,
+    images TEXT
+)
+"""
+UPSERT_SQL = """
+INSERT INTO items (id, name, description, price, tax, tags, images)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    name = excluded.name,
+    description = excluded.description,
+    price = excluded.price,
+    tax = excluded.tax,
+    tags = excluded.tags,
+    images = excluded.images
+"""
+SELECT_ONE_SQL = "SELECT * FROM items WHERE id = ?"
+SELECT_ALL_SQL = "SELECT * FROM items ORDER BY id"
+
+
+def item_to_row(item: dict[str, Any]) -> tuple:
+    """Flatten an item dict into the column order of `UPSERT_SQL`."""
+    images = item.get("images")
+
+    return (
+        int(item["id"]),
+        item["name"],
+        item.get("description"),
+        str(item["price"]),
+        None if item.get("tax") is None else str(item["tax"]),
+        json.dumps(list(item.get("tags") or [])),
+        None if images is None else json.dumps(images, default=str),
+    )
+
+
+def row_to_item(row: sqlite3.Row) -> dict[str, Any]:
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "description": row["description"],
+        "price": Decimal(row["price"]),
+        "tax": None if row["tax"] is None else Decimal(row["tax"]),
+        "tags": json.loads(row["tags"]),
+        "images": None if row["images"] is None else json.loads(row["images"]),
+    }
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # Connections are handed between worker threads, but each one is only ever
+    # used by a single thread at a time.
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class ConnectionPool:
+    """A fixed upper bound of reusable read connections to one database file."""
+
+    def __init__(self, path: str, size: int) -> None:
+        self.path = path
+        self.size = size
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._all: list[sqlite3.Connection] = []
+
+    @contextmanager
+    def acquire(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            if len(self._all) < self.size:
+                conn = connect(self.path)
+                self._all.append(conn)
+            else:
+                conn = self._idle.get()
+
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        for conn in self._all:
+            conn.close()
+
+        self._all.clear()
+
+
+class SQLiteItemRepository:
+    """
+    Items persisted in a SQLite database running in WAL mode.
+
+    Reads borrow a connection from a bounded pool. Writes are queued and a
+    single writer task commits everything that queued up while the previous
+    transaction was being flushed, so concurrent writers share one fsync.
+    All blocking sqlite3 calls run in worker threads, never on the event loop.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4, max_batch: int = 512) -> None:
+        self.path = path
+        self.max_batch = max_batch
+        self.batches_committed = 0
+        self.rows_committed = 0
+        self._pool = ConnectionPool(path, pool_size)
+        self._limiter = CapacityLimiter(pool_size)
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._pending: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+
+    async def open(self) -> None:
+        self._writer_conn = await to_thread.run_sync(connect, self.path)
+        await to_thread.run_sync(self._writer_conn.execute, CREATE_TABLE_SQL)
+        self._pending = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._write_loop())
+
+    async def close(self) -> None:
+        if self._writer_task is not None:
+            await self._pending.join()
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+            self._pending = None
+
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+            self._writer_conn = None
+
+        self._pool.close()
+
+    async def get(self, item_id: int) -> Optional[dict[str, Any]]:
+        return await to_thread.run_sync(self._get, item_id, limiter=self._limiter)
+
+    async def load_all(self) -> dict[int, dict[str, Any]]:
+        return await to_thread.run_sync(self._load_all, limiter=self._limiter)
+
+    async def save(self, item: dict[str, Any]) -> None:
+        """Insert or update `item`, returning once its transaction has committed."""
+        if self._pending is None:
+            raise RuntimeError("Repository is not open")
+
+        done = asyncio.get_running_loop().create_future()
+        await self._pending.put((item_to_row(item), done))
+        await done
+
+    async def save_many(self, items: list[dict[str, Any]]) -> None:
+        """Queue several writes at once so they land in as few commits as possible."""
+        await asyncio.gather(*(self.save(item) for item in items))
+
+    def _get(self, item_id: int) -> Optional[dict[str, Any]]:
+        with self._pool.acquire() as conn:
+            row = conn.execute(SELECT_ONE_SQL, (item_id,)).fetchone()
+
+        return None if row is None else row_to_item(row)
+
+    def _load_all(self) -> dict[int, dict[str, Any]]:
+        with self._pool.acquire() as conn:
+            return {row["id"]: row_to_item(row) for row in conn.execute(SELECT_ALL_SQL)}
+
+    def _commit_batch(self, rows: list[tuple]) -> None:
+        conn = self._writer_conn
+        conn.execute("BEGIN IMMEDIATE")
+
+        try:
+            conn.executemany(UPSERT_SQL, rows)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        conn.execute("COMMIT")
+
+    async def _next_batch(self) -> list[tuple[tuple, asyncio.Future]]:
+        """Wait for one pending write, then take whatever else queued up meanwhile."""
+        batch = [await self._pending.get()]
+
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._pending.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        return batch
+
+    async def _write_loop(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            error: Optional[Exception] = None
+
+            try:
+                await to_thread.run_sync(self._commit_batch, [row for row, _ in batch])
+            except Exception as exc:
+                error = exc
+            else:
+                self.batches_committed += 1
+                self.rows_committed += len(batch)
+
+            for _, done in batch:
+                if not done.done():
+                    if error is None:
+                        done.set_result(None)
+                    else:
+                        done.set_exception(error)
+
+                self._pending.task_done()
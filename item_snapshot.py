@@ -0,0 +1,856 @@
+"""Read-mostly item snapshots shared by worker processes through mmap'd files"""
+
+import heapq
+import io
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable, Iterator, Mapping
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import cached_property
+from pathlib import Path
+from typing import Any, BinaryIO, Optional
+
+from pydantic_core import from_json, to_json
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: a single process writes
+    fcntl = None
+
+MAGIC = b"ITEMSNP2"
+SECTIONS = (
+    "ids",  # int64, sorted
+    "deleted",  # int64, sorted ids a delta segment deletes from its base
+    "revisions",  # uint64, the version that last wrote each item
+    "item_offsets",  # uint64, count + 1 offsets into "data"
+    "data",  # the JSON of each item, in id order
+    "price_ids",  # int64, ids ordered by (price, id)
+    "price_offsets",  # uint64, offsets into "prices"
+    "prices",  # the price of each of "price_ids", as decimal text
+    "tag_offsets",  # uint64, offsets into "tags"
+    "tags",  # sorted tags, UTF-8
+    "tag_posting_offsets",  # uint64, offsets into "tag_postings"
+    "tag_postings",  # int64, sorted ids carrying each tag
+    "token_offsets",
+    "tokens",  # sorted word tokens of item names and descriptions
+    "token_posting_offsets",
+    "token_postings",
+)
+# Magic, version, version of the base segment, then the offsets of the sections
+_HEADER = struct.Struct(f"<8sQQ{len(SECTIONS) + 1}Q")
+_VERSION = struct.Struct("<Q")
+_ALIGNMENT = 8
+_SCAN_CHUNK = 1024
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: Optional[str]) -> set[str]:
+    """Split free text into the lower-cased word tokens used by the text index."""
+    if not text:
+        return set()
+
+    return set(_TOKEN_RE.findall(text.lower()))
+
+
+class _Texts:
+    """A sorted table of UTF-8 strings, stored as offsets into a blob."""
+
+    def __init__(self, offsets: memoryview, blob: memoryview) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> bytes:
+        return bytes(self.blob[self.offsets[index] : self.offsets[index + 1]])
+
+    def find(self, text: str) -> int:
+        # UTF-8 byte order is code point order, so the encoded keys stay sorted
+        key = text.encode()
+        index = bisect_left(self, key)
+
+        return index if index < len(self) and self[index] == key else -1
+
+
+class _Postings:
+    """Sorted id lists keyed by text, e.g. the ids carrying each tag."""
+
+    def __init__(self, keys: _Texts, offsets: memoryview, ids: memoryview) -> None:
+        self.keys = keys
+        self.offsets = offsets
+        self.ids = ids
+
+    def get(self, key: str) -> memoryview:
+        index = self.keys.find(key)
+
+        if index == -1:
+            return self.ids[0:0]
+
+        return self.ids[self.offsets[index] : self.offsets[index + 1]]
+
+
+class _Prices:
+    """Prices in ascending order, as a sequence `bisect` can search."""
+
+    def __init__(self, texts: _Texts) -> None:
+        self.texts = texts
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, index: int) -> Decimal:
+        return Decimal(self.texts[index].decode())
+
+
+class Segment:
+    """
+    Items mapped read-only from a snapshot file: either a base segment holding
+    every item of one version, or a delta segment holding the items written
+    and the ids deleted since its base.
+
+    Each item is stored as its JSON, next to sorted id, price, tag and word
+    indexes laid out as flat arrays. Lookups binary-search those arrays in
+    place and `get_json` returns a view of the stored bytes, so reading an
+    item neither copies nor deserializes the segment; every process that
+    maps the same file shares its pages.
+    """
+
+    def __init__(self, buffer: Any) -> None:
+        view = memoryview(buffer)
+        magic, self.version, self.base, *offsets = _HEADER.unpack_from(view)
+
+        if magic != MAGIC:
+            raise ValueError("Not an item snapshot")
+
+        sections = {
+            name: view[start:end]
+            for name, start, end in zip(SECTIONS, offsets, offsets[1:], strict=False)
+        }
+        self.ids = sections["ids"].cast("q")
+        self.deleted = sections["deleted"].cast("q")
+        self.revisions = sections["revisions"].cast("Q")
+        self._item_offsets = sections["item_offsets"].cast("Q")
+        self._data = sections["data"]
+        self._price_ids = sections["price_ids"].cast("q")
+        self._prices = _Prices(
+            _Texts(sections["price_offsets"].cast("Q"), sections["prices"])
+        )
+        self._tags = _Postings(
+            _Texts(sections["tag_offsets"].cast("Q"), sections["tags"]),
+            sections["tag_posting_offsets"].cast("Q"),
+            sections["tag_postings"].cast("q"),
+        )
+        self._tokens = _Postings(
+            _Texts(sections["token_offsets"].cast("Q"), sections["tokens"]),
+            sections["token_posting_offsets"].cast("Q"),
+            sections["token_postings"].cast("q"),
+        )
+
+    @classmethod
+    def open(cls, path: Path) -> "Segment":
+        with open(path, "rb") as file:
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, item_id: object) -> bool:
+        return isinstance(item_id, int) and self._position(item_id) != -1
+
+    def revision(self, item_id: int) -> Optional[int]:
+        """The version that last wrote the item, or None if there is no such item."""
+        position = self._position(item_id)
+
+        return None if position == -1 else self.revisions[position]
+
+    def get_json(self, item_id: int) -> Optional[memoryview]:
+        """The stored JSON of an item, as a view into the segment."""
+        position = self._position(item_id)
+
+        if position == -1:
+            return None
+
+        return self._json_at(position)
+
+    def iter_search(
+        self,
+        q: Optional[str] = None,
+        tags: Iterable[str] = (),
+        price_min: Optional[Decimal] = None,
+        price_max: Optional[Decimal] = None,
+        after: Optional[int] = None,
+    ) -> Iterator[int]:
+        """The same search as `ItemSnapshot.iter_search`, over the segment."""
+        candidates: list[Iterable[int]] = [self._tokens.get(t) for t in tokenize(q)]
+        candidates.extend(self._tags.get(tag) for tag in tags)
+
+        if price_min is not None or price_max is not None:
+            low = 0 if price_min is None else bisect_left(self._prices, price_min)
+            high = (
+                len(self._prices)
+                if price_max is None
+                else bisect_right(self._prices, price_max)
+            )
+            candidates.append(self._price_ids[low:high])
+
+        if not candidates:
+            # A query without any word character can never match a token.
+            return iter(()) if q else self._scan(after)
+
+        candidates.sort(key=len)
+        result = set(candidates[0])
+
+        for other in candidates[1:]:
+            if not result:
+                break
+
+            result.intersection_update(other)
+
+        return iter(sorted(i for i in result if after is None or i > after))
+
+    def _scan(self, after: Optional[int]) -> Iterator[int]:
+        position = 0 if after is None else bisect_right(self.ids, after)
+
+        while chunk := self.ids[position : position + _SCAN_CHUNK].tolist():
+            yield from chunk
+            position += len(chunk)
+
+    def _position(self, item_id: int) -> int:
+        position = bisect_left(self.ids, item_id)
+
+        if position < len(self.ids) and self.ids[position] == item_id:
+            return position
+
+        return -1
+
+    def _json_at(self, position: int) -> memoryview:
+        return self._data[
+            self._item_offsets[position] : self._item_offsets[position + 1]
+        ]
+
+
+class ItemSnapshot:
+    """
+    One immutable version of all items: a base segment, overlaid with a delta
+    segment holding the items written and deleted since.
+
+    Keeping recent writes in a small delta means publishing a version only
+    rewrites the delta, rather than every item; `SnapshotStore` folds the
+    delta into a new base once it has grown past a bound.
+    """
+
+    def __init__(self, base: Segment, delta: Segment) -> None:
+        self.base = base
+        self.delta = delta
+        self.version = delta.version
+        # Base items that the delta replaces or deletes
+        self._masked = set(delta.ids.tolist()) | set(delta.deleted.tolist())
+
+    @cached_property
+    def _length(self) -> int:
+        return (
+            len(self.base)
+            - sum(item_id in self.base for item_id in self._masked)
+            + len(self.delta)
+        )
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __contains__(self, item_id: object) -> bool:
+        return item_id in self.delta or (
+            item_id not in self._masked and item_id in self.base
+        )
+
+    def next_id(self) -> int:
+        base_ids = (i for i in reversed(self.base.ids) if i not in self._masked)
+        last = max(next(base_ids, 0), self.delta.ids[-1] if len(self.delta) else 0)
+
+        return last + 1
+
+    def revision(self, item_id: int) -> Optional[int]:
+        """The version that last wrote the item, or None if there is no such item."""
+        return (
+            None
+            if (segment := self._segment(item_id)) is None
+            else segment.revision(item_id)
+        )
+
+    def get_json(self, item_id: int) -> Optional[memoryview]:
+        """The stored JSON of an item, as a view into the snapshot."""
+        return (
+            None
+            if (segment := self._segment(item_id)) is None
+            else segment.get_json(item_id)
+        )
+
+    def get(self, item_id: int) -> Optional[dict[str, Any]]:
+        raw = self.get_json(item_id)
+
+        return None if raw is None else from_json(bytes(raw))
+
+    def items(self) -> Iterator[tuple[int, memoryview]]:
+        for item_id in self.iter_search():
+            yield item_id, self.get_json(item_id)
+
+    def iter_search(
+        self,
+        q: Optional[str] = None,
+        tags: Iterable[str] = (),
+        price_min: Optional[Decimal] = None,
+        price_max: Optional[Decimal] = None,
+        after: Optional[int] = None,
+    ) -> Iterator[int]:
+        """
+        Lazily yield the ids of the items matching every given filter, in
+        ascending order and starting after the id `after`.
+
+        `q` matches items whose name or description contain all of its words,
+        `tags` matches items carrying all of the given tags and the price bounds
+        are inclusive. Without any filter every id is yielded, read from the
+        sorted ids a chunk at a time.
+        """
+        args = (q, tags, price_min, price_max, after)
+        base_ids = (
+            item_id
+            for item_id in self.base.iter_search(*args)
+            if item_id not in self._masked
+        )
+
+        return heapq.merge(base_ids, self.delta.iter_search(*args))
+
+    def _segment(self, item_id: int) -> Optional[Segment]:
+        if item_id in self.delta:
+            return self.delta
+
+        if item_id in self._masked:
+            return None
+
+        return self.base
+
+
+def _item_terms(item: Mapping[str, Any]) -> tuple[set[str], list[str]]:
+    tokens = tokenize(item.get("name")) | tokenize(item.get("description"))
+
+    return tokens, list(item.get("tags") or ())
+
+
+class _Table:
+    """Variable-length entries being written, as offsets into joined parts."""
+
+    def __init__(self) -> None:
+        self.offsets = array("Q", [0])
+        self.parts: list[Any] = []
+
+    def append(self, *parts: Any) -> None:
+        """Append one entry, made of the concatenation of `parts`."""
+        self.parts.extend(parts)
+        self.offsets.append(self.offsets[-1] + sum(map(len, parts)))
+
+    def copy(self, offsets: memoryview, blob: memoryview, start: int, stop: int):
+        """Append entries `start:stop` of an existing table, without copying them."""
+        if start >= stop:
+            return
+
+        first = offsets[start]
+        shift = self.offsets[-1] - first
+        self.offsets.extend(
+            [offset + shift for offset in offsets[start + 1 : stop + 1]]
+        )
+        self.parts.append(blob[first : offsets[stop]])
+
+    def sections(self) -> list[Any]:
+        return [self.offsets, b"".join(self.parts)]
+
+
+class _PostingEdits:
+    """Ids to add to and remove from the postings of some keys."""
+
+    def __init__(self) -> None:
+        self.added: dict[bytes, list[int]] = {}
+        self.removed: dict[bytes, set[int]] = {}
+
+    def add(self, item_id: int, keys: Iterable[str]) -> None:
+        for key in keys:
+            self.added.setdefault(key.encode(), []).append(item_id)
+
+    def remove(self, item_id: int, keys: Iterable[str]) -> None:
+        for key in keys:
+            self.removed.setdefault(key.encode(), set()).add(item_id)
+
+    def merge(self, base: _Postings) -> list[Any]:
+        """The sections of `base` with the edits applied."""
+        keys, postings = _Table(), _Table()
+        position = 0
+
+        for key in sorted(self.added.keys() | self.removed.keys()):
+            stop = bisect_left(base.keys, key, position)
+            keys.copy(base.keys.offsets, base.keys.blob, position, stop)
+            postings.copy(base.offsets, base.ids, position, stop)
+            old = base.ids[0:0]
+
+            if stop < len(base.keys) and base.keys[stop] == key:
+                old = base.ids[base.offsets[stop] : base.offsets[stop + 1]]
+                stop += 1
+
+            parts = _merge_ids(
+                old, self.added.get(key, []), self.removed.get(key, set())
+            )
+
+            if sum(map(len, parts)):
+                keys.append(key)
+                postings.append(*parts)
+
+            position = stop
+
+        keys.copy(base.keys.offsets, base.keys.blob, position, len(base.keys))
+        postings.copy(base.offsets, base.ids, position, len(base.keys))
+
+        return [*keys.sections(), *postings.sections()]
+
+
+def _merge_ids(old: memoryview, added: list[int], removed: set[int]) -> list[Any]:
+    """A sorted id list with edits applied, as parts to concatenate."""
+    added.sort()
+
+    if not removed and (not old or not added or added[0] > old[-1]):
+        # New items get the highest ids, so most edits only append
+        return [old, array("q", added)]
+
+    ids = [item_id for item_id in old.tolist() if item_id not in removed]
+    ids.extend(added)
+    ids.sort()
+
+    return [array("q", ids)]
+
+
+class _PriceKeys:
+    """The (price, id) sort keys of a segment's price index."""
+
+    def __init__(self, snapshot: Segment) -> None:
+        self.snapshot = snapshot
+
+    def __len__(self) -> int:
+        return len(self.snapshot._price_ids)
+
+    def __getitem__(self, index: int) -> tuple[Decimal, int]:
+        return self.snapshot._prices[index], self.snapshot._price_ids[index]
+
+
+class _PriceEdits:
+    """Entries to insert into and remove from a segment's price index."""
+
+    def __init__(self, base: Segment) -> None:
+        self.base = base
+        self.keys = _PriceKeys(base)
+        # (position in the base index, 0 to remove or 1 to insert, price, id)
+        self.edits: list[tuple[int, int, Decimal, int]] = []
+
+    def add(self, item_id: int, price: Any) -> None:
+        price = Decimal(price)
+        position = bisect_left(self.keys, (price, item_id))
+        self.edits.append((position, 1, price, item_id))
+
+    def remove(self, item_id: int, price: Any) -> None:
+        price = Decimal(price)
+        position = bisect_left(self.keys, (price, item_id))
+        self.edits.append((position, 0, price, item_id))
+
+    def merge(self) -> list[Any]:
+        """The price index sections of the base segment with the edits applied."""
+        base = self.base
+        ids, prices = array("q"), _Table()
+        position = 0
+
+        for stop, insert, price, item_id in sorted(self.edits):
+            if stop > position:
+                _extend(ids, base._price_ids[position:stop])
+                prices.copy(
+                    base._prices.texts.offsets, base._prices.texts.blob, position, stop
+                )
+                position = stop
+
+            if insert:
+                ids.append(item_id)
+                prices.append(str(price).encode())
+            else:
+                position += 1
+
+        _extend(ids, base._price_ids[position:])
+        prices.copy(
+            base._prices.texts.offsets,
+            base._prices.texts.blob,
+            position,
+            len(base._prices),
+        )
+
+        return [ids, *prices.sections()]
+
+
+def merge_snapshot(
+    base: Segment,
+    changes: Mapping[int, Optional[Mapping[str, Any]]],
+    written: Optional[Mapping[int, int]] = None,
+    delta: bool = False,
+) -> list[Any]:
+    """
+    The sections of the segment following `base`, with `changes` applied.
+
+    Items mapped to None are deleted; a `delta` segment also records their ids,
+    to mask them in its own base. `written` holds the versions that wrote some
+    of the changed items, when not the one following `base`. Runs of unchanged
+    items, index keys and prices are copied from `base` as slices of its
+    sections, so the cost of a new segment is mostly that of copying the bytes
+    of the previous one.
+    """
+    version = base.version + 1
+    written = written or {}
+    ids, revisions, data = array("q"), array("Q"), _Table()
+    tags, tokens, prices = _PostingEdits(), _PostingEdits(), _PriceEdits(base)
+    position = 0
+
+    for item_id in sorted(changes):
+        stop = bisect_left(base.ids, item_id, position)
+        _extend(ids, base.ids[position:stop])
+        _extend(revisions, base.revisions[position:stop])
+        data.copy(base._item_offsets, base._data, position, stop)
+        position = stop
+
+        if stop < len(base) and base.ids[stop] == item_id:
+            old = from_json(bytes(base._json_at(stop)))
+            _edit_indexes(item_id, old, tags, tokens, prices, add=False)
+            position += 1
+
+        item = changes[item_id]
+
+        if item is not None:
+            ids.append(item_id)
+            revisions.append(written.get(item_id, version))
+            data.append(to_json(item))
+            _edit_indexes(item_id, item, tags, tokens, prices, add=True)
+
+    _extend(ids, base.ids[position:])
+    _extend(revisions, base.revisions[position:])
+    data.copy(base._item_offsets, base._data, position, len(base))
+    deleted = array("q")
+
+    if delta:
+        deleted.extend(
+            sorted(
+                {i for i in base.deleted.tolist() if changes.get(i) is None}
+                | {item_id for item_id, item in changes.items() if item is None}
+            )
+        )
+
+    return [
+        ids,
+        deleted,
+        revisions,
+        *data.sections(),
+        *prices.merge(),
+        *tags.merge(base._tags),
+        *tokens.merge(base._tokens),
+    ]
+
+
+def _extend(target: array, view: memoryview) -> None:
+    target.frombytes(view.cast("B"))
+
+
+def _edit_indexes(
+    item_id: int,
+    item: Mapping[str, Any],
+    tags: _PostingEdits,
+    tokens: _PostingEdits,
+    prices: _PriceEdits,
+    add: bool,
+) -> None:
+    item_tokens, item_tags = _item_terms(item)
+
+    if add:
+        tokens.add(item_id, item_tokens)
+        tags.add(item_id, item_tags)
+    else:
+        tokens.remove(item_id, item_tokens)
+        tags.remove(item_id, item_tags)
+
+    if item.get("price") is not None:
+        (prices.add if add else prices.remove)(item_id, item["price"])
+
+
+def _write_section(file: BinaryIO, data: Any) -> int:
+    file.write(data)
+    file.write(b"\0" * (-file.tell() % _ALIGNMENT))
+
+    return file.tell()
+
+
+def write_snapshot(
+    file: BinaryIO, version: int, sections: list[Any], base: Optional[int] = None
+) -> None:
+    """
+    Write a snapshot file made of `sections`, in the order of `SECTIONS`: a
+    delta segment on top of version `base`, or a base segment without one.
+    """
+    file.seek(_HEADER.size + -_HEADER.size % _ALIGNMENT)
+    offsets = [file.tell()]
+
+    for section in sections:
+        offsets.append(_write_section(file, section))
+
+    file.seek(0)
+    file.write(
+        _HEADER.pack(MAGIC, version, version if base is None else base, *offsets)
+    )
+
+
+def empty_segment(version: int = 0) -> Segment:
+    """A segment without any item, at `version`."""
+    file = io.BytesIO()
+    write_snapshot(
+        file,
+        version,
+        [array("Q", [0]) if name.endswith("offsets") else b"" for name in SECTIONS],
+    )
+
+    return Segment(file.getbuffer())
+
+
+class _Batch:
+    """Changes from concurrent `publish` calls, written as one version."""
+
+    def __init__(self) -> None:
+        self.changes: dict[int, Optional[dict[str, Any]]] = {}
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+
+class SnapshotStore:
+    """
+    The current item snapshot of a directory shared by worker processes.
+
+    The directory holds one segment file per snapshot version and a small
+    control file with the current version. Readers map the control file and
+    only look at the version it holds on each access, switching to a newer
+    snapshot when there is one. `publish` writes a new delta segment, with the
+    changes since the last base segment, renames it into place and only then
+    bumps the version, so a reader sees either the previous snapshot or the new
+    one, never a partial write. Once a delta would hold more than `max_delta`
+    items, it is folded into a new base segment instead, so most versions cost
+    the size of the delta to write rather than that of every item.
+
+    Publishing is serialized across processes by a lock file, and concurrent
+    `publish` calls within a process are grouped into a single new version.
+    """
+
+    def __init__(self, directory: str, keep: int = 2, max_delta: int = 1024) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.keep = keep
+        self.max_delta = max_delta
+        control = self.directory / "CURRENT"
+
+        with open(control, "a+b") as file:
+            if os.fstat(file.fileno()).st_size < _VERSION.size:
+                file.write(b"\0" * _VERSION.size)
+                file.flush()
+
+            self._control = mmap.mmap(file.fileno(), _VERSION.size)
+
+        self._snapshot: Optional[ItemSnapshot] = None
+        self._write_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = _Batch()
+
+    @property
+    def version(self) -> int:
+        return _VERSION.unpack_from(self._control)[0]
+
+    def current(self) -> ItemSnapshot:
+        version = self.version
+        snapshot = self._snapshot
+
+        if snapshot is None or snapshot.version != version:
+            snapshot = self._snapshot = self._open(version)
+
+        return snapshot
+
+    def seed(self, items: Mapping[int, dict[str, Any]]) -> None:
+        """Publish `items` as the first version, unless there is one already."""
+        with self._locked():
+            if self.version == 0:
+                self._write(dict(items))
+
+    def publish(self, changes: Mapping[int, Optional[dict[str, Any]]]) -> None:
+        """
+        Store the given items, or delete those mapped to None, in a new version.
+
+        Blocks until a version including the changes is current; call it from
+        a worker thread. When that version cannot be written, every call whose
+        changes it held raises the error.
+        """
+        with self._pending_lock:
+            batch = self._pending
+            batch.changes.update(changes)
+
+        with self._write_lock:
+            if not batch.done:
+                with self._pending_lock:
+                    self._pending = _Batch()
+
+                with self._writing(batch), self._locked():
+                    self._write(batch.changes)
+
+        if batch.error is not None:
+            raise batch.error
+
+    def insert(self, items: Iterable[dict[str, Any]]) -> list[Optional[dict[str, Any]]]:
+        """
+        Store new items in a new version, returning each as stored, or None
+        when its id is taken already. Items with a None id get the next free one.
+
+        Ids are checked and given out while holding the lock file, so that
+        concurrent inserts, in this process or others, never share an id. Blocks
+        like `publish`; call it from a worker thread.
+        """
+        with self._write_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, _Batch()
+
+            changes = batch.changes
+
+            with self._writing(batch), self._locked():
+                snapshot = self._latest()
+                next_id = max([snapshot.next_id(), *(i + 1 for i in changes)])
+                stored: list[Optional[dict[str, Any]]] = []
+
+                for item in items:
+                    item_id = next_id if item["id"] is None else item["id"]
+
+                    if (
+                        changes[item_id] is not None
+                        if item_id in changes
+                        else item_id in snapshot
+                    ):
+                        stored.append(None)
+                        continue
+
+                    item = changes[item_id] = {**item, "id": item_id}
+                    next_id = max(next_id, item_id + 1)
+                    stored.append(item)
+
+                if changes:
+                    self._write(changes)
+
+        return stored
+
+    @contextmanager
+    def _writing(self, batch: _Batch) -> Iterator[None]:
+        """Mark `batch` as done, with the error its write raised if any."""
+        try:
+            yield
+        except BaseException as exc:
+            batch.error = exc
+            raise
+        finally:
+            batch.done = True
+
+    def _latest(self) -> ItemSnapshot:
+        """The current snapshot, or an empty one before the first version."""
+        if self.version:
+            return self.current()
+
+        empty = empty_segment()
+
+        return ItemSnapshot(empty, empty)
+
+    def _open(self, version: int) -> ItemSnapshot:
+        while True:
+            if version == 0:
+                raise LookupError(f"No item snapshot in {self.directory} yet")
+
+            try:
+                segment = Segment.open(self._path(version))
+
+                if segment.base == segment.version:
+                    return ItemSnapshot(segment, empty_segment(version))
+
+                return ItemSnapshot(self._open_base(segment.base), segment)
+            except FileNotFoundError:
+                # Superseded and cleaned up meanwhile; the control file has moved on
+                version = self.version
+
+    def _open_base(self, version: int) -> Segment:
+        # Successive deltas share their base, which stays mapped
+        if self._snapshot is not None and self._snapshot.base.version == version:
+            return self._snapshot.base
+
+        return Segment.open(self._path(version))
+
+    def _path(self, version: int) -> Path:
+        return self.directory / f"items-{version:012d}.snap"
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+
+        with open(self.directory / "LOCK", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, changes: Mapping[int, Optional[dict[str, Any]]]) -> None:
+        """Build and publish the next version. Must hold the lock file."""
+        current = self._latest()
+        base, delta = current.base, current.delta
+        version = current.version + 1
+
+        if current.version and (
+            len(delta) + len(delta.deleted) + len(changes) <= self.max_delta
+        ):
+            sections = merge_snapshot(delta, changes, delta=True)
+            base_version = base.version
+        else:
+            # Fold the delta into a new base, keeping the revisions it holds
+            folded: dict[int, Optional[dict[str, Any]]] = dict.fromkeys(
+                delta.deleted.tolist()
+            )
+            folded.update(
+                (item_id, from_json(bytes(delta.get_json(item_id))))
+                for item_id in delta.ids.tolist()
+            )
+            folded.update(changes)
+            written = dict(
+                zip(delta.ids.tolist(), delta.revisions.tolist(), strict=True)
+            )
+            written.update(dict.fromkeys(changes, version))
+            sections = merge_snapshot(base, folded, written)
+            base_version = version
+
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".tmp", delete=False
+        ) as tmp:
+            write_snapshot(tmp, version, sections, base_version)
+
+        os.replace(tmp.name, self._path(version))
+        _VERSION.pack_into(self._control, 0, version)
+        self._control.flush()
+        self._snapshot = self._open(version)
+        in_use = self._path(base_version)
+
+        for stale in sorted(self.directory.glob("items-*.snap"))[: -self.keep]:
+            if stale != in_use:
+                stale.unlink(missing_ok=True)
@@ -1,15 +1,26 @@
 """Currently the entry-point of the app"""
 
-from datetime import datetime, time, timedelta
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from datetime import datetime, time, timedelta, timezone
 from decimal import Decimal
 from enum import Enum
+from functools import partial
 from http import HTTPStatus
-from typing import Any, Optional
+from itertools import chain, islice
+from typing import Any, Optional, Union
 from uuid import UUID
 
 from fastapi import (
     Body,
     Cookie,
+    Depends,
     FastAPI,
     File,
     Form,
@@ -18,32 +29,199 @@ from fastapi import (
     Path,
     Query,
     Request,
+    Security,
     UploadFile,
 )
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, ConfigDict, EmailStr, Field, HttpUrl
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    EmailStr,
+    Field,
+    HttpUrl,
+    TypeAdapter,
+    ValidationError,
+    ValidatorFunctionWrapHandler,
+    field_validator,
+)
+from pydantic_core import to_json
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from admission import AdmissionControlMiddleware
+from auth import TokenGuardMiddleware, TokenProtectedRoutes, token_header
+from blob_store import BlobStore
+from http_cache import LRUTTLCache, SingleFlight, etag_matches, make_etag
+from inference import STAND_IN_MODELS, InferenceEngine
+from item_repository import SQLiteItemRepository
+from item_snapshot import ItemSnapshot, SnapshotStore
+from metrics import PROMETHEUS_MEDIA_TYPE, REGISTRY, MetricsMiddleware
+from passwords import HasherBusy, PasswordHasher, ScryptParams
+from profiling import RequestProfilerMiddleware
+from scheduler import EventScheduler, ScheduledEvent, aware
+from server_timing import ServerTimingMiddleware, install_phase_timers
+from streaming import (
+    NDJSON_MEDIA_TYPE,
+    MalformedRow,
+    abatched,
+    accepts_ndjson,
+    aiter_json_array,
+    aiter_lines,
+    iter_file_chunks,
+    iter_ndjson,
+    json_object,
+)
+from threadpool import (
+    configure_threadpool,
+    install_wait_timer,
+    run_inline,
+    threadpool_stats,
+    uninstall_wait_timer,
+)
+from uploads import digest_upload, set_spool_max_size
+from weight_index import (
+    WeightError,
+    WeightStore,
+    format_fixed,
+    parse_weights,
+    render_weights,
+)
+
+logger = logging.getLogger(__name__)
 
 FAKE_SECRET_TOKEN = "coneofsilence"
-fake_db = {
-    1: {
-        "id": "1",
-        "name": "Foo",
-        "description": "There goes my hero",
-        "price": Decimal("1.00"),
-    },
-    2: {
-        "id": "2",
-        "name": "Bar",
-        "description": "The bartenders",
-        "price": Decimal("1.00"),
-    },
-}
+ITEM_DB_POOL_SIZE = int(os.getenv("ITEM_DB_POOL_SIZE", "4"))
+ITEM_CACHE_SIZE = int(os.getenv("ITEM_CACHE_SIZE", "4096"))
+ITEM_CACHE_TTL = float(os.getenv("ITEM_CACHE_TTL", "60"))
+IMAGE_URL_CACHE_SIZE = int(os.getenv("IMAGE_URL_CACHE_SIZE", "4096"))
+UPLOAD_SPOOL_MAX_SIZE = int(os.getenv("UPLOAD_SPOOL_MAX_SIZE", str(1024 * 1024)))
+BLOB_STORE_DIR = os.getenv(
+    "BLOB_STORE_DIR", os.path.join(tempfile.gettempdir(), "fastapi-hello-blobs")
+)
+BLOB_STORE_WORKERS = int(os.getenv("BLOB_STORE_WORKERS", "4"))
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+BULK_RESULTS_SPOOL_SIZE = 1024 * 1024
+EVENTS_ENABLED = os.getenv("EVENTS_ENABLED", "1") not in ("", "0")
+SERVER_TIMING = os.getenv("SERVER_TIMING", "") not in ("", "0")
+SERVER_TIMING_SLOWEST = int(os.getenv("SERVER_TIMING_SLOWEST", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+ADMISSION_LIMIT = int(os.getenv("ADMISSION_LIMIT", "64"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "256"))
+ADMISSION_TARGET = float(os.getenv("ADMISSION_TARGET", "0.05"))
+ADMISSION_INTERVAL = float(os.getenv("ADMISSION_INTERVAL", "0.5"))
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "32"))
+INFERENCE_MAX_WAIT = float(os.getenv("INFERENCE_MAX_WAIT", "0.005"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "64"))
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2**14)))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+# Worker processes started by serve.py share the item snapshots in this directory
+ITEM_SNAPSHOT_DIR = os.getenv("ITEM_SNAPSHOT_DIR")
+ITEM_SNAPSHOT_MAX_DELTA = int(os.getenv("ITEM_SNAPSHOT_MAX_DELTA", "1024"))
+# Worker processes started by serve.py share the weight index in this file
+WEIGHT_INDEX_PATH = os.getenv("WEIGHT_INDEX_PATH")
+WEIGHT_INDEX_MAX_DELTA = int(os.getenv("WEIGHT_INDEX_MAX_DELTA", "4096"))
+# Blobs are addressed by their content, so a given URL never changes
+BLOB_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Without ITEM_SNAPSHOT_DIR, this process keeps its snapshots to itself
+_private_snapshot_dir = (
+    None
+    if ITEM_SNAPSHOT_DIR
+    else tempfile.TemporaryDirectory(prefix="fastapi-hello-items-")
+)
+item_snapshots = SnapshotStore(
+    ITEM_SNAPSHOT_DIR or _private_snapshot_dir.name, max_delta=ITEM_SNAPSHOT_MAX_DELTA
+)
+item_snapshots.seed(
+    {
+        1: {
+            "id": "1",
+            "name": "Foo",
+            "description": "There goes my hero",
+            "price": Decimal("1.00"),
+        },
+        2: {
+            "id": "2",
+            "name": "Bar",
+            "description": "The bartenders",
+            "price": Decimal("1.00"),
+        },
+    }
+)
+_private_weights_dir = (
+    None
+    if WEIGHT_INDEX_PATH
+    else tempfile.TemporaryDirectory(prefix="fastapi-hello-weights-")
+)
+weight_store = WeightStore(
+    WEIGHT_INDEX_PATH or os.path.join(_private_weights_dir.name, "weights.idx"),
+    max_delta=WEIGHT_INDEX_MAX_DELTA,
+)
+# For every multipart parser in the process, not just this app's
+set_spool_max_size(UPLOAD_SPOOL_MAX_SIZE)
+
+blob_store = BlobStore(BLOB_STORE_DIR, max_workers=BLOB_STORE_WORKERS)
+password_hasher = PasswordHasher(
+    ScryptParams(n=PASSWORD_SCRYPT_N, r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P),
+    workers=PASSWORD_HASH_WORKERS,
+    max_queue=PASSWORD_HASH_QUEUE_SIZE,
+)
+# Rendered `read_item` bodies and their ETags, keyed by item id and query params
+item_response_cache = LRUTTLCache(maxsize=ITEM_CACHE_SIZE, ttl=ITEM_CACHE_TTL)
+# Renderings of `read_item` and `read_items` bodies in flight, by request
+read_flights = SingleFlight()
+# Validated `Image.url`s by the string they were sent as, least recently used
+# first: the same few CDN URLs tend to come up over and over
+image_urls: OrderedDict[str, HttpUrl] = OrderedDict()
+image_urls_lock = threading.Lock()
+# Set up by `lifespan` when the ITEM_DB_PATH environment variable is set
+item_repository: Optional[SQLiteItemRepository] = None
 
 
 class Image(BaseModel):
     url: HttpUrl = Field(..., examples=["https://example.org/1.png"])
     name: str = Field(..., examples=["A pretty image"])
 
+    @field_validator("url", mode="wrap")
+    @classmethod
+    def reuse_validated_url(
+        cls, value: Any, handler: ValidatorFunctionWrapHandler
+    ) -> HttpUrl:
+        if not isinstance(value, str) or IMAGE_URL_CACHE_SIZE <= 0:
+            return handler(value)
+
+        # Images are validated in threadpool threads too
+        with image_urls_lock:
+            url = image_urls.get(value)
+
+            if url is not None:
+                image_urls.move_to_end(value)
+
+                return url
+
+        url = handler(value)
+
+        with image_urls_lock:
+            while len(image_urls) >= IMAGE_URL_CACHE_SIZE:
+                image_urls.popitem(last=False)
+
+            image_urls[value] = url
+
+        return url
+
 
 class Item(BaseModel):
     id: Optional[int] = None
@@ -96,13 +274,252 @@ class ModelName(str, Enum):
     lenet = "lenet"
 
 
+MODEL_MESSAGES = {
+    ModelName.alexnet: "Deep Learning FTW!",
+    ModelName.lenet: "LeCNN all the images",
+    ModelName.resnet: "Have some residuals",
+}
+# Keyed by plain names, which worker processes unpickle without importing `main`
+inference = InferenceEngine(
+    {name.value: STAND_IN_MODELS[name.value] for name in ModelName},
+    workers=INFERENCE_WORKERS,
+    max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+    max_wait=INFERENCE_MAX_WAIT,
+)
+
+
 class UnicornException(Exception):
     def __init__(self, name: str) -> None:
         super().__init__()
         self.name = name
 
 
-app = FastAPI()
+item_adapter = TypeAdapter(Item)
+images_adapter = TypeAdapter(list[Image])
+
+
+def validate_image_rows(
+    rows: list[Any], first_index: int
+) -> tuple[bytes, list[dict[str, Any]]]:
+    """
+    Validate a batch of raw `/images/multiple/` elements, returning them as
+    comma-separated JSON, or the errors if any is invalid.
+    """
+    errors: list[dict[str, Any]] = []
+
+    # A malformed body ends the stream of rows
+    if rows and isinstance(rows[-1], MalformedRow):
+        errors.append(
+            {
+                "type": "json_invalid",
+                "loc": ("body",),
+                "msg": "JSON decode error",
+                "input": {},
+                "ctx": {"error": rows[-1].reason},
+            }
+        )
+        rows = rows[:-1]
+
+    try:
+        images = images_adapter.validate_python(rows)
+    except ValidationError as exc:
+        errors[:0] = (
+            {**error, "loc": ("body", first_index + error["loc"][0], *error["loc"][1:])}
+            for error in exc.errors(include_url=False)
+        )
+        return b"", errors
+
+    # Without the brackets, so that batches can be joined
+    return to_json(images)[1:-1], errors
+
+
+async def put_items(item_dicts: list[dict[str, Any]]) -> None:
+    """Publish items in a new snapshot version and drop their cached renderings."""
+    await run_in_threadpool(
+        item_snapshots.publish, {item["id"]: item for item in item_dicts}
+    )
+
+    for item in item_dicts:
+        item_response_cache.invalidate(item["id"])
+
+
+async def insert_items(
+    item_dicts: list[dict[str, Any]],
+) -> list[Optional[dict[str, Any]]]:
+    """
+    Publish new items in a new snapshot version, giving ids to those without
+    one; returns each item as stored, or None when its id is taken already.
+    """
+    stored = await run_in_threadpool(item_snapshots.insert, item_dicts)
+
+    for item_dict in stored:
+        if item_dict is not None:
+            item_response_cache.invalidate(item_dict["id"])
+
+    return stored
+
+
+async def persist_items(item_dicts: list[dict[str, Any]]) -> None:
+    if item_repository is not None:
+        await item_repository.save_many(item_dicts)
+
+
+async def persist_inserted_items(item_dicts: list[dict[str, Any]]) -> None:
+    """
+    `persist_items` for items just published by `insert_items`, which must come
+    first to give them their ids: if they cannot be saved, they are withdrawn
+    from the snapshot again, so no worker serves an item the database lacks.
+    """
+    try:
+        await persist_items(item_dicts)
+    except Exception:
+        await run_in_threadpool(
+            item_snapshots.publish, {item["id"]: None for item in item_dicts}
+        )
+
+        for item in item_dicts:
+            item_response_cache.invalidate(item["id"])
+
+        raise
+
+
+def with_price_with_tax(item_dict: dict[str, Any]) -> dict[str, Any]:
+    if item_dict.get("tax"):
+        return {**item_dict, "price_with_tax": item_dict["price"] + item_dict["tax"]}
+
+    return item_dict
+
+
+def validate_item_rows(rows: list[Any]) -> list[Union[Item, list[dict[str, Any]]]]:
+    """Validate raw bulk rows, returning an `Item` or a list of errors for each."""
+    outcomes: list[Union[Item, list[dict[str, Any]]]] = []
+
+    for row in rows:
+        try:
+            if isinstance(row, MalformedRow):
+                outcomes.append([{"type": "malformed_row", "msg": row.reason}])
+            elif isinstance(row, bytes):
+                outcomes.append(item_adapter.validate_json(row))
+            else:
+                outcomes.append(item_adapter.validate_python(row))
+        except ValidationError as exc:
+            outcomes.append(
+                exc.errors(
+                    include_url=False, include_context=False, include_input=False
+                )
+            )
+
+    return outcomes
+
+
+async def ingest_items(
+    outcomes: list[Union[Item, list[dict[str, Any]]]], first_row: int
+) -> list[dict[str, Any]]:
+    """Store the valid items of one bulk batch, returning a result for every row."""
+    items = [outcome.model_dump() for outcome in outcomes if isinstance(outcome, Item)]
+    stored = iter(await insert_items(items) if items else ())
+    accepted: list[dict[str, Any]] = []
+    results: list[dict[str, Any]] = []
+
+    for row, outcome in enumerate(outcomes, start=first_row):
+        if isinstance(outcome, Item) and (item_dict := next(stored)) is None:
+            outcome = [{"type": "item_exists", "msg": "Item already exists"}]
+
+        if not isinstance(outcome, Item):
+            results.append({"row": row, "status": "rejected", "errors": outcome})
+            continue
+
+        accepted.append(item_dict)
+        results.append(
+            {"row": row, "status": "accepted", "item": with_price_with_tax(item_dict)}
+        )
+
+    if accepted:
+        await persist_inserted_items(accepted)
+
+    return results
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    global item_repository
+
+    # The limiter is this event loop's own; the wait timer wraps anyio for the
+    # whole process, so it is uninstalled however the app stops
+    configure_threadpool(THREADPOOL_SIZE)
+    install_wait_timer()
+    db_path = os.getenv("ITEM_DB_PATH")
+
+    try:
+        if db_path:
+            item_repository = SQLiteItemRepository(db_path, pool_size=ITEM_DB_POOL_SIZE)
+            await item_repository.open()
+
+            items = await item_repository.load_all()
+
+            if items:
+                await run_in_threadpool(item_snapshots.publish, items)
+
+        yield
+    finally:
+        if item_repository is not None:
+            await item_repository.close()
+            item_repository = None
+
+        await event_scheduler.close()
+        await run_in_threadpool(inference.close)
+        await run_in_threadpool(password_hasher.close)
+        await run_in_threadpool(blob_store.close)
+        uninstall_wait_timer()
+
+        if REGISTRY.multiprocess_dir is not None:
+            # Counts since the last periodic flush would be lost otherwise
+            await run_in_threadpool(REGISTRY.flush)
+
+
+app = FastAPI(lifespan=lifespan)
+
+if PROFILE_DIR:
+    app.add_middleware(
+        RequestProfilerMiddleware,
+        directory=PROFILE_DIR,
+        token=PROFILE_TOKEN,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        keep=PROFILE_KEEP,
+    )
+
+# The middleware is built on the first request, after every route is defined,
+# and guards those with the `TOKEN_REQUIRED` dependencies
+app.add_middleware(
+    TokenGuardMiddleware,
+    token=FAKE_SECRET_TOKEN,
+    routes=TokenProtectedRoutes(app.routes),
+)
+TOKEN_REQUIRED = [Security(token_header)]
+
+if SERVER_TIMING:
+    install_phase_timers()
+    app.add_middleware(ServerTimingMiddleware, slowest=SERVER_TIMING_SLOWEST)
+
+if ADMISSION_LIMIT:
+    app.add_middleware(
+        AdmissionControlMiddleware,
+        limit=ADMISSION_LIMIT,
+        queue_size=ADMISSION_QUEUE_SIZE,
+        target=ADMISSION_TARGET,
+        interval=ADMISSION_INTERVAL,
+    )
+
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(HasherBusy)
+async def hasher_busy_handler(request: Request, exc: HasherBusy):
+    return JSONResponse(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        content={"detail": "Too many sign-ups and logins, retry later"},
+        headers={"Retry-After": "1"},
+    )
 
 
 @app.exception_handler(UnicornException)
@@ -116,6 +533,7 @@ async def unicorn_exception_handler(request: Request, exc: UnicornException):
 
 
 @app.get("/")
+@run_inline
 def home(
     x_dummy_header: Optional[list[str]] = Header(
         default=None, convert_underscores=True
@@ -129,8 +547,45 @@ def home(
     return result
 
 
-@app.get("/items")
-def read_items(
+def search_items(
+    snapshot: ItemSnapshot,
+    results: dict[str, Any],
+    q: Optional[str],
+    tags: list[str],
+    price_min: Optional[Decimal],
+    price_max: Optional[Decimal],
+    cursor: Optional[int],
+    limit: Optional[int],
+) -> Iterator[memoryview]:
+    """
+    The stored JSON of the matching items. With `limit`, only one page of them,
+    and `next_cursor` is added to `results`.
+    """
+    item_ids = snapshot.iter_search(
+        q=q, tags=tags, price_min=price_min, price_max=price_max, after=cursor
+    )
+
+    if limit is not None:
+        page = list(islice(item_ids, limit + 1))
+        results["next_cursor"] = page[limit - 1] if len(page) > limit else None
+        item_ids = iter(page[:limit])
+
+    # Items are sent as the JSON stored in the snapshot, never deserialized
+    return (
+        raw for item_id in item_ids if (raw := snapshot.get_json(item_id)) is not None
+    )
+
+
+def render_items(
+    results: dict[str, Any], search: Callable[[], Iterator[memoryview]]
+) -> bytes:
+    items = b"[" + b",".join(search()) + b"]"
+
+    return json_object(**results, items=items)
+
+
+@app.get("/items", response_model=dict[str, Any])
+async def read_items(
     q: Optional[str] = Query(
         None,
         min_length=3,
@@ -141,14 +596,23 @@ def read_items(
     ),
     q2: list[str] = Query(["aa", "bb", "cc"], alias="q-2"),
     q3: Optional[str] = Query(None, deprecated=True),
+    tags: list[str] = Query([], description="Only items carrying all these tags"),
+    price_min: Optional[Decimal] = Query(None, ge=Decimal()),
+    price_max: Optional[Decimal] = Query(None, ge=Decimal()),
+    cursor: Optional[int] = Query(
+        None, ge=0, description="Only return items whose id is greater than this"
+    ),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size"),
     ads_id: Optional[str] = Cookie(None, max_length=128, examples=["70f59c6b"]),
-) -> dict:
-    results: dict[str, Any] = {
-        "items": [
-            {"item_id": "Foo"},
-            {"item_id": "Bar"},
-        ],
-    }
+    accept: Optional[str] = Header(None),
+) -> Any:
+    """
+    With `limit`, the response carries `next_cursor` to pass as `cursor` for the
+    following page. With `Accept: application/x-ndjson` the response is streamed
+    as one JSON object per line: the query echo first, then each item.
+    """
+    snapshot = item_snapshots.current()
+    results: dict[str, Any] = {}
 
     if q:
         results["q"] = q
@@ -158,44 +622,159 @@ def read_items(
     if ads_id:
         results["cookies"] = {"ads_id": ads_id}
 
-    return results
+    search = partial(
+        search_items, snapshot, results, q, tags, price_min, price_max, cursor, limit
+    )
 
+    if accepts_ndjson(accept):
+        return StreamingResponse(
+            iter_ndjson(chain([results], search())), media_type=NDJSON_MEDIA_TYPE
+        )
 
-@app.get("/items/{item_id}")
-@app.get("/item/{item_id}")
-def read_item(
-    item_id: int = Path(..., ge=1, title="The ID of the item"),
+    # Identical concurrent searches of the same snapshot share one rendering
+    flight_key = (
+        "items",
+        snapshot.version,
+        q,
+        tuple(q2),
+        frozenset(tags),
+        price_min,
+        price_max,
+        cursor,
+        limit,
+        ads_id,
+    )
+    body = await read_flights.do(
+        flight_key,
+        partial(run_in_threadpool, render_items, results, search),
+    )
+
+    return Response(body, media_type="application/json")
+
+
+def read_items_batch(
+    item_ids: list[int], needy: str, q: Optional[str], short: bool
+) -> dict[str, Any]:
+    items: list[dict[str, Any]] = []
+    missing: list[int] = []
+
+    snapshot = item_snapshots.current()
+
+    for item_id in dict.fromkeys(item_ids):
+        item = snapshot.get(item_id)
+
+        if item is None:
+            missing.append(item_id)
+        else:
+            items.append(item)
+
+    return {
+        "items": items,
+        "missing": missing,
+        "needy": needy,
+        "q": q,
+        "description": "awesome long description" if not short else "desc",
+    }
+
+
+@app.get("/items/batch", dependencies=TOKEN_REQUIRED)
+def read_items_batch_by_query(
+    ids: str = Query(
+        ...,
+        pattern=r"^\d+(,\d+)*$",
+        max_length=4096,
+        description="Comma-separated item ids",
+        examples=["1,2,3"],
+    ),
     needy: str = Query(...),
     q: Optional[str] = Query(None),
     short: bool = Query(False),
-    x_token: str = Header(..., convert_underscores=True),
 ) -> dict:
+    """Look up several items at once, with the same options as `read_item`."""
+    return read_items_batch(
+        [int(item_id) for item_id in ids.split(",")], needy, q, short
+    )
+
+
+@app.post("/items/batch", dependencies=TOKEN_REQUIRED)
+def read_items_batch_by_body(
+    ids: list[int] = Body(..., embed=True, max_length=10000),
+    needy: str = Query(...),
+    q: Optional[str] = Query(None),
+    short: bool = Query(False),
+) -> dict:
+    """`GET /items/batch` for id lists too long to fit in a URL."""
+    return read_items_batch(ids, needy, q, short)
+
+
+def render_item(
+    snapshot: ItemSnapshot,
+    item_id: int,
+    revision: int,
+    needy: str,
+    q: Optional[str],
+    short: bool,
+) -> tuple[bytes, str]:
+    """Render a `read_item` body and its ETag, and cache them."""
+    raw = snapshot.get_json(item_id)
+
+    if raw is None:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Item not found")
+
+    body = json_object(
+        item=raw,
+        needy=needy,
+        q=q,
+        description="awesome long description" if not short else "desc",
+    )
+    cached = (body, make_etag(body))
+    item_response_cache.set((item_id, revision, needy, q, short), cached, tag=item_id)
+
+    return cached
+
+
+@app.get("/items/{item_id}", dependencies=TOKEN_REQUIRED)
+@app.get("/item/{item_id}", dependencies=TOKEN_REQUIRED)
+async def read_item(
+    item_id: int = Path(..., ge=1, title="The ID of the item"),
+    needy: str = Query(...),
+    q: Optional[str] = Query(None),
+    short: bool = Query(False),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
     """
     :8000/item/321?needy=whoo&short=1
     :8000/item/321?needy=whoo&short=True
     :8000/item/321?needy=whoo&short=on
     :8000/item/321?needy=whoo&short=yes
     """
-    if x_token != FAKE_SECRET_TOKEN:
-        raise HTTPException(
-            status_code=HTTPStatus.BAD_REQUEST,
-            detail="Invalid X-Token header",
-            headers={"X-Error": "token"},
-        )
+    snapshot = item_snapshots.current()
+    revision = snapshot.revision(item_id)
 
-    if item_id not in fake_db:
+    if revision is None:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Item not found")
 
-    return {
-        "item": fake_db[item_id],
-        "needy": needy,
-        "q": q,
-        "description": "awesome long description" if not short else "desc",
-    }
+    # Another worker may have published the item, so the key carries its revision
+    cache_key = (item_id, revision, needy, q, short)
+    cached = item_response_cache.get(cache_key)
+
+    if cached is None:
+        # A burst of identical cache misses renders the item once
+        cached = await read_flights.do(
+            ("item", *cache_key),
+            partial(run_in_threadpool, render_item, snapshot, *cache_key),
+        )
+
+    body, etag = cached
 
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers={"ETag": etag})
 
-@app.post("/item", status_code=HTTPStatus.CREATED)
-def create_item(
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+@app.post("/item", status_code=HTTPStatus.CREATED, dependencies=TOKEN_REQUIRED)
+async def create_item(
     item: Item = Body(
         ...,
         embed=False,
@@ -221,30 +800,61 @@ def create_item(
             },
         ],
     ),
-    x_token: str = Header(...),
 ) -> dict:
-    if x_token != FAKE_SECRET_TOKEN:
-        raise HTTPException(
-            status_code=HTTPStatus.BAD_REQUEST,
-            detail="Invalid X-Token header",
-            headers={"X-Error": "token"},
-        )
+    (item_dict,) = await insert_items([item.model_dump()])
 
-    if item.id in fake_db:
+    if item_dict is None:
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST, detail="Item already exists"
         )
 
-    item_dict = item.model_dump()
+    await persist_inserted_items([item_dict])
 
-    if item.tax:
-        item_dict["price_with_tax"] = item.price + item.tax
+    return with_price_with_tax(item_dict)
 
-    return item_dict
+
+@app.post("/items/bulk", dependencies=TOKEN_REQUIRED)
+async def create_items_bulk(
+    request: Request,
+) -> StreamingResponse:
+    """
+    Create items from a streamed body: NDJSON by default, or a JSON array when
+    sent as `application/json`. Rows are validated and stored a batch at a time,
+    and the response has one NDJSON result line per row, in order.
+    """
+    if request.headers.get("content-type", "").startswith("application/json"):
+        rows = aiter_json_array(request.stream())
+    else:
+        rows = aiter_lines(request.stream())
+
+    # Results go to a spooled file rather than a list, so that memory stays
+    # bounded by the batch size however many rows the body holds.
+    results = tempfile.SpooledTemporaryFile(max_size=BULK_RESULTS_SPOOL_SIZE)
+    counts = {"accepted": 0, "rejected": 0}
+    row_number = 0
+
+    async for batch in abatched(rows, BULK_BATCH_SIZE):
+        outcomes = await run_in_threadpool(validate_item_rows, batch)
+
+        for result in await ingest_items(outcomes, first_row=row_number + 1):
+            counts[result["status"]] += 1
+            results.write(to_json(result) + b"\n")
+
+        row_number += len(batch)
+
+    return StreamingResponse(
+        iter_file_chunks(results),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={
+            "X-Accepted-Count": str(counts["accepted"]),
+            "X-Rejected-Count": str(counts["rejected"]),
+        },
+        background=BackgroundTask(results.close),
+    )
 
 
 @app.put("/item/{item_id}")
-def update_item(
+async def update_item(
     item_id: int = Path(..., ge=1, title="The ID of the item"),
     item: Item = Body(
         ...,
@@ -263,7 +873,11 @@ def update_item(
     importance: int = Body(1, ge=0, le=9),
     q: Optional[str] = None,
 ) -> dict:
+    item.id = item_id
     item_dict = {"id": item_id, "importance": importance, "item": item.model_dump()}
+    # Saved before it is published, so that a failed save changes nothing
+    await persist_items([item_dict["item"]])
+    await put_items([item_dict["item"]])
 
     if user:
         item_dict["user"] = user.model_dump()
@@ -274,43 +888,247 @@ def update_item(
     return item_dict
 
 
-@app.get("/model/{model_name}", response_model=dict[str, str])
-def get_model(model_name: ModelName) -> dict:
-    if model_name == ModelName.alexnet:
-        return {"model_name": model_name, "message": "Deep Learning FTW!"}
+@app.get("/stats/item-cache")
+@run_inline
+def item_cache_stats() -> dict[str, int]:
+    return {**item_response_cache.stats(), "coalesced": read_flights.coalesced}
+
+
+@app.get("/stats/threadpool")
+@run_inline
+def read_threadpool_stats() -> dict[str, int]:
+    return threadpool_stats()
+
+
+@app.get("/stats/password-hasher")
+@run_inline
+def read_password_hasher_stats() -> dict[str, int]:
+    return password_hasher.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    # Rendering locks and reads the files of every worker with METRICS_DIR
+    body = await run_in_threadpool(REGISTRY.render)
+
+    return PlainTextResponse(body, media_type=PROMETHEUS_MEDIA_TYPE)
 
-    if model_name.value == ModelName.lenet.value:
-        return {"model_name": model_name, "message": "LeCNN all the images"}
 
-    return {"model_name": model_name, "message": "Have some residuals"}
+@app.get("/model/{model_name}", response_model=dict[str, Any])
+async def get_model(
+    model_name: ModelName, x: Optional[list[float]] = Query(None)
+) -> dict:
+    input_size = inference.input_size(model_name.value)
+    features = x or [0.0] * input_size
+
+    if len(features) != input_size:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail=f"{model_name.value} takes {input_size} values of x",
+        )
+
+    label, score = await inference.predict(model_name.value, features)
+
+    return {
+        "model_name": model_name,
+        "message": MODEL_MESSAGES[model_name],
+        "label": label,
+        "score": score,
+    }
 
 
 @app.post(
-    "/images/multiple/", response_model=list[Image], status_code=HTTPStatus.CREATED
+    "/images/multiple/",
+    response_model=list[Image],
+    status_code=HTTPStatus.CREATED,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/Image"},
+                    }
+                }
+            },
+        }
+    },
 )
-def create_multiple_images(images: list[Image]):
-    return images
+async def create_multiple_images(request: Request) -> StreamingResponse:
+    """
+    Validate a JSON array of images and echo them back.
+
+    The array is parsed and validated a batch of elements at a time as it
+    arrives, and the echo is spooled to a file and streamed from there, so
+    memory stays flat however many images are sent.
+    """
+    # Validated images go to a spooled file rather than a list, as in
+    # `create_items_bulk`; errors are kept to answer with a 422 at the end
+    results = tempfile.SpooledTemporaryFile(max_size=BULK_RESULTS_SPOOL_SIZE)
+    results.write(b"[")
+    errors: list[dict[str, Any]] = []
+    count = 0
+
+    async for batch in abatched(aiter_json_array(request.stream()), BULK_BATCH_SIZE):
+        images, batch_errors = await run_in_threadpool(
+            validate_image_rows, batch, count
+        )
+        errors.extend(batch_errors)
+
+        if images and not errors:
+            if results.tell() > 1:
+                results.write(b",")
+
+            results.write(images)
+
+        count += len(batch)
+
+    if errors:
+        results.close()
+        raise RequestValidationError(errors)
+
+    results.write(b"]")
+
+    return StreamingResponse(
+        iter_file_chunks(results),
+        status_code=HTTPStatus.CREATED,
+        media_type="application/json",
+        background=BackgroundTask(results.close),
+    )
+
+
+def upsert_weights(body: bytes) -> None:
+    try:
+        weights = parse_weights(body)
+    except ValidationError as exc:
+        errors = [
+            {**error, "loc": ("body", *error["loc"])}
+            for error in exc.errors(include_url=False)
+        ]
+        raise RequestValidationError(errors, body=body) from exc
+    except WeightError as exc:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY, detail=str(exc)
+        ) from exc
+
+    weight_store.upsert(*weights)
 
 
 @app.post(
-    "/index-weights/", response_model=dict[int, Decimal], status_code=HTTPStatus.CREATED
+    "/index-weights/",
+    response_model=dict[int, Decimal],
+    status_code=HTTPStatus.CREATED,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "object",
+                        "additionalProperties": {
+                            "anyOf": [{"type": "number"}, {"type": "string"}]
+                        },
+                    }
+                }
+            },
+        }
+    },
 )
-def create_index_weights(weights: dict[int, Decimal]):
-    return weights
+async def create_index_weights(request: Request) -> Response:
+    """
+    Add or update weights, given as a JSON object of integer indexes to
+    decimals with up to six places, and echo them back.
+
+    The weights are stored without building a `Decimal` per weight, and the
+    echo is the accepted body itself rather than a re-serialization of it.
+    """
+    body = await request.body()
+    await run_in_threadpool(upsert_weights, body)
+
+    return Response(body, HTTPStatus.CREATED, media_type="application/json")
+
+
+@app.get("/index-weights/sum")
+async def sum_index_weights(
+    start: Optional[int] = None, stop: Optional[int] = None
+) -> dict[str, Any]:
+    keys, values = weight_store.current().span(start, stop)
+    total = await run_in_threadpool(sum, values)
+
+    return {"count": len(keys), "sum": format_fixed(total)}
+
+
+@app.get("/index-weights/normalized")
+async def normalize_index_weights(
+    start: Optional[int] = None, stop: Optional[int] = None
+) -> Response:
+    """The weights from `start` up to `stop`, divided by their sum."""
+    body = await run_in_threadpool(
+        lambda: render_weights(*weight_store.current().normalized(start, stop))
+    )
+
+    return Response(body, media_type="application/json")
+
+
+@app.get("/index-weights/range")
+async def read_index_weights(
+    start: Optional[int] = None, stop: Optional[int] = None
+) -> Response:
+    """The weights of the indexes from `start` up to but excluding `stop`."""
+    body = await run_in_threadpool(
+        lambda: render_weights(*weight_store.current().span(start, stop))
+    )
+
+    return Response(body, media_type="application/json")
+
+
+@app.get("/index-weights/top")
+async def top_index_weights(k: int = Query(10, ge=1, le=10_000)) -> list[dict]:
+    top = await run_in_threadpool(weight_store.current().top, k)
+
+    return [{"index": key, "weight": format_fixed(value)} for key, value in top]
+
+
+async def process_event(event: ScheduledEvent) -> None:
+    logger.info("Processing event %s (run %d)", event.event_id, event.runs)
+
+
+# Events from `POST /event/{event_id}`, each run by `process_event` when due.
+# They live in the memory of this process only, which is why serve.py turns
+# them off when it starts more than one worker.
+event_scheduler = EventScheduler(process_event)
+
+
+def events_enabled() -> None:
+    if not EVENTS_ENABLED:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail="Events are disabled"
+        )
+
+
+EVENTS_REQUIRED = [Depends(events_enabled)]
 
 
 @app.post(
-    "/event/{event_id}", response_model=dict[str, Any], status_code=HTTPStatus.CREATED
+    "/event/{event_id}",
+    response_model=dict[str, Any],
+    status_code=HTTPStatus.CREATED,
+    dependencies=EVENTS_REQUIRED,
 )
-def create_event(
+async def create_event(
     event_id: UUID,
     start_datetime: Optional[datetime] = Body(None),
     end_datetime: Optional[datetime] = Body(None),
     repeat_at: Optional[time] = Body(None),
     process_after: Optional[timedelta] = Body(None),
 ):
-    start_process = start_datetime + process_after
-    duration = end_datetime - start_process
+    # Naive datetimes are taken as UTC, so they can be compared with aware ones
+    start = aware(start_datetime or datetime.now(timezone.utc))
+    end = None if end_datetime is None else aware(end_datetime)
+    start_process = start + (process_after or timedelta())
+    duration = None if end is None else end - start_process
+    event_scheduler.schedule(ScheduledEvent(event_id, start_process, repeat_at, end))
 
     return {
         "event_id": event_id,
@@ -319,15 +1137,36 @@ def create_event(
         "repeat_at": repeat_at,
         "process_after": process_after,
         "duration": duration,
+        "next_run": start_process,
     }
 
 
-def fake_password_hasher(raw_password: str) -> str:
-    return "supersecret" + raw_password
+@app.get(
+    "/event/{event_id}", response_model=dict[str, Any], dependencies=EVENTS_REQUIRED
+)
+@run_inline
+def read_event(event_id: UUID):
+    event = event_scheduler.get(event_id)
+
+    if event is None:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Event not found")
+
+    return {"event_id": event_id, "next_run": event.next_run, "runs": event.runs}
+
+
+@app.delete(
+    "/event/{event_id}",
+    status_code=HTTPStatus.NO_CONTENT,
+    dependencies=EVENTS_REQUIRED,
+)
+@run_inline
+def cancel_event(event_id: UUID) -> None:
+    if not event_scheduler.cancel(event_id):
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Event not found")
 
 
-def fake_save_user(user_in: UserIn) -> UserInDB:
-    hashed_password = fake_password_hasher(user_in.password)
+async def fake_save_user(user_in: UserIn) -> UserInDB:
+    hashed_password = await password_hasher.hash(user_in.password)
     user_in_db = UserInDB(**user_in.model_dump(), hashed_password=hashed_password)
     return user_in_db
 
@@ -338,26 +1177,35 @@ def fake_save_user(user_in: UserIn) -> UserInDB:
     response_model_exclude_unset=True,
     status_code=HTTPStatus.CREATED,
 )
-def create_user(user: UserIn):
-    return fake_save_user(user_in=user)
+async def create_user(user: UserIn):
+    return await fake_save_user(user_in=user)
 
 
 @app.post("/login/")
-def login(username: str = Form(), password: str = Form()):
-    return {"username": username, "password_hash": hash(password)}
+async def login(username: str = Form(), password: str = Form()):
+    return {
+        "username": username,
+        "password_hash": await password_hasher.hash(password),
+    }
 
 
 @app.post("/file/")
 async def create_file(
-    file: Optional[bytes] = File(default=None, description="A file read as bytes"),
+    file: Optional[UploadFile] = File(
+        default=None, description="A file hashed chunk by chunk"
+    ),
     fileb: Optional[UploadFile] = File(default=None),
     token: Optional[str] = Form(default=None),
 ):
-    if not file:
+    # A file part with no content counts as no file
+    if file is None or file.size == 0:
         return {"message": "No file sent"}
 
+    digest = await digest_upload(file)
+
     return {
-        "file_size": len(file),
+        "file_size": digest.size,
+        "file_sha256": digest.sha256,
         "fileb_name": fileb.filename if fileb else None,
         "token": token,
     }
@@ -365,9 +1213,14 @@ async def create_file(
 
 @app.post("/files/")
 async def create_files(
-    files: list[bytes] = File(description="Multiple files as bytes"),
+    files: list[UploadFile] = File(description="Multiple files hashed chunk by chunk"),
 ):
-    return {"file_sizes": [len(file) for file in files]}
+    digests = [await digest_upload(file) for file in files]
+
+    return {
+        "file_sizes": [digest.size for digest in digests],
+        "file_sha256s": [digest.sha256 for digest in digests],
+    }
 
 
 @app.post("/uploadfile/")
@@ -376,17 +1229,61 @@ async def create_upload_file(
         default=None, description="A file read as UploadFile"
     ),
 ):
-    if not file:
+    # A file part with no content counts as no file
+    if file is None or file.size == 0:
         return {"message": "No upload file sent"}
 
-    return {"filename": file.filename}
+    blob = await blob_store.ingest(file)
+
+    return {"filename": file.filename, **asdict(blob)}
 
 
 @app.post("/uploadfiles/")
 async def create_upload_files(
     files: list[UploadFile] = File(description="Multiple files as UploadFile"),
 ):
-    return {"filenames": [file.filename for file in files]}
+    blobs = await blob_store.ingest_many(files)
+
+    return {
+        "filenames": [file.filename for file in files],
+        "files": [
+            {"filename": file.filename, **asdict(blob)}
+            for file, blob in zip(files, blobs, strict=True)
+        ],
+    }
+
+
+@app.get("/blobs/{sha256}", operation_id="read_blob")
+@app.head("/blobs/{sha256}", operation_id="read_blob_head")
+async def read_blob(
+    sha256: str = Path(..., pattern=r"^[0-9a-f]{64}$"),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    """
+    Serve a stored upload by its SHA-256. `Range` and `If-Range` requests are
+    answered with partial content, and servers implementing the ASGI pathsend
+    extension send the file without it passing through Python.
+    """
+    path = blob_store.path_for(sha256)
+
+    try:
+        stat_result = await run_in_threadpool(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail="Blob not found"
+        ) from None
+
+    headers = {"ETag": f'"{sha256}"', "Cache-Control": BLOB_CACHE_CONTROL}
+
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+
+    return FileResponse(
+        path,
+        headers=headers,
+        media_type="application/octet-stream",
+        stat_result=stat_result,
+    )
 
 
 @app.get("/unicorns/{name}")
@@ -0,0 +1,453 @@
+"""In-process Prometheus metrics with multi-process aggregation"""
+
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: a single process renders
+    fcntl = None
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = tuple(float(4**exponent) for exponent in range(3, 13))
+UNROUTED = "unrouted"
+# Counters and histograms of exited processes, folded together
+EXITED_FILE = "metrics-exited.json"
+
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Iterable[str]) -> str:
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)
+    )
+    return "{" + pairs + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, labels: Labels = ()) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def snapshot(self) -> list:
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+    @staticmethod
+    def merge(total: dict, samples: list) -> None:
+        for labels, value in samples:
+            key = tuple(labels)
+            total[key] = total.get(key, 0.0) + value
+
+    def render(self, total: dict) -> list[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}"
+            for labels, v in sorted(total.items())
+        ]
+
+
+class Gauge(Counter):
+    """
+    A value that can go down as well as up. Values from several processes are
+    summed, which suits gauges such as in-flight requests or queue depths.
+    """
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def dec(self, amount: float = 1.0, labels: Labels = ()) -> None:
+        self.inc(-amount, labels)
+
+    def set(self, value: float, labels: Labels = ()) -> None:
+        self.values[labels] = value
+
+    def snapshot(self) -> list:
+        if self.function is not None:
+            self.values[()] = float(self.function())
+
+        return super().snapshot()
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., count above the last bucket, sum]
+        self.values: dict[Labels, list[float]] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        counts = self.values.get(labels)
+
+        if counts is None:
+            counts = self.values[labels] = [0.0] * (len(self.buckets) + 2)
+
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def snapshot(self) -> list:
+        return [[list(labels), counts] for labels, counts in self.values.items()]
+
+    @staticmethod
+    def merge(total: dict, samples: list) -> None:
+        for labels, counts in samples:
+            key = tuple(labels)
+
+            if key not in total:
+                total[key] = list(counts)
+            else:
+                total[key] = [a + b for a, b in zip(total[key], counts, strict=True)]
+
+    def render(self, total: dict) -> list[str]:
+        lines = self.header()
+
+        for labels, counts in sorted(total.items()):
+            cumulative = 0.0
+
+            for bound, count in zip(
+                (*self.buckets, math.inf), counts[:-1], strict=True
+            ):
+                cumulative += count
+                bucket_labels = _format_labels(
+                    (*self.labelnames, "le"), (*labels, _format_value(bound))
+                )
+                lines.append(
+                    f"{self.name}_bucket{bucket_labels} {_format_value(cumulative)}"
+                )
+
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{label_text} {_format_value(cumulative)}")
+
+        return lines
+
+
+class Registry:
+    """
+    The metrics of one process.
+
+    When `multiprocess_dir` is set, every process periodically writes a
+    snapshot of its metrics to a file named after its pid there, and `render`
+    merges the snapshots of all processes. Gauges only count processes that are
+    still alive, while counters and histograms keep the totals of exited
+    processes so they never go backwards: those are folded into a single
+    `EXITED_FILE` and the exited processes' own files removed, so the
+    directory does not grow with every worker restart.
+    """
+
+    def __init__(
+        self, multiprocess_dir: Optional[str] = None, flush_interval: float = 1.0
+    ) -> None:
+        self.metrics: dict[str, Metric] = {}
+        self.multiprocess_dir = Path(multiprocess_dir) if multiprocess_dir else None
+        self.flush_interval = flush_interval
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Any:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+
+        self.metrics[metric.name] = metric
+
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None,
+    ) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> dict[str, list]:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def maybe_flush(self) -> None:
+        if (
+            self.multiprocess_dir is not None
+            and time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Atomically replace this process's snapshot file."""
+        self._last_flush = time.monotonic()
+        self.multiprocess_dir.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.multiprocess_dir, suffix=".tmp", delete=False
+        ) as tmp:
+            json.dump(self.snapshot(), tmp)
+
+        os.replace(tmp.name, self.multiprocess_dir / f"metrics-{os.getpid()}.json")
+
+    def render(self) -> str:
+        snapshots = [(self.snapshot(), True)]
+
+        if self.multiprocess_dir is not None:
+            self.flush()
+            snapshots = self._read_snapshots()
+
+        lines: list[str] = []
+
+        for name, metric in self.metrics.items():
+            total: dict = {}
+
+            for snapshot, alive in snapshots:
+                if name in snapshot and (alive or not isinstance(metric, Gauge)):
+                    metric.merge(total, snapshot[name])
+
+            lines.extend(metric.render(total))
+
+        return "\n".join(lines) + "\n"
+
+    def _read_snapshots(self) -> list[tuple[dict, bool]]:
+        snapshots: list[tuple[dict, bool]] = []
+        exited: list[tuple[Path, dict]] = []
+
+        # Under the lock, so that no render sees an exited process both in its
+        # own file and in `EXITED_FILE`, nor folds it in twice
+        with self._locked():
+            for path in self.multiprocess_dir.glob("metrics-*.json"):
+                if path.name == EXITED_FILE:
+                    continue
+
+                try:
+                    snapshot = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    continue
+
+                pid = int(path.stem.removeprefix("metrics-"))
+
+                if _pid_alive(pid):
+                    snapshots.append((snapshot, True))
+                else:
+                    exited.append((path, snapshot))
+
+            snapshots.append((self._fold_exited(exited), False))
+
+        return snapshots
+
+    def _fold_exited(self, exited: list[tuple[Path, dict]]) -> dict:
+        """
+        Merge the snapshots of `exited` processes into `EXITED_FILE`, delete
+        their own files and return what `EXITED_FILE` then holds.
+        """
+        path = self.multiprocess_dir / EXITED_FILE
+
+        try:
+            folded = json.loads(path.read_text())
+        except FileNotFoundError:
+            folded = {}
+
+        if not exited:
+            return folded
+
+        for name, metric in self.metrics.items():
+            if isinstance(metric, Gauge):
+                continue
+
+            total: dict = {}
+
+            for snapshot in (folded, *(snapshot for _, snapshot in exited)):
+                if name in snapshot:
+                    metric.merge(total, snapshot[name])
+
+            folded[name] = [[list(labels), value] for labels, value in total.items()]
+
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.multiprocess_dir, suffix=".tmp", delete=False
+        ) as tmp:
+            json.dump(folded, tmp)
+
+        os.replace(tmp.name, path)
+
+        for exited_path, _ in exited:
+            exited_path.unlink(missing_ok=True)
+
+        return folded
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+
+            with open(self.multiprocess_dir / "metrics.lock", "a+b") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+REGISTRY = Registry(multiprocess_dir=os.getenv("METRICS_DIR") or None)
+
+REQUESTS = REGISTRY.counter(
+    "http_requests_total",
+    "HTTP requests by method, route template and status code.",
+    ("method", "route", "status"),
+)
+LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response.",
+    ("method", "route"),
+)
+RESPONSE_SIZE = REGISTRY.histogram(
+    "http_response_size_bytes",
+    "Size of response bodies.",
+    ("method", "route"),
+    buckets=SIZE_BUCKETS,
+)
+IN_PROGRESS = REGISTRY.gauge(
+    "http_requests_in_progress", "HTTP requests currently being served."
+)
+
+
+class MetricsMiddleware:
+    """
+    Record count, latency, response size and status of every HTTP request,
+    labelled by the template of the route that served it (e.g.
+    `/items/{item_id}`), so that label cardinality stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp, registry: Registry = REGISTRY) -> None:
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+
+            await send(message)
+
+        IN_PROGRESS.inc()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_PROGRESS.dec()
+            route = getattr(scope.get("route"), "path", UNROUTED)
+            labels = (scope["method"], route)
+            REQUESTS.inc(labels=(*labels, str(status)))
+            LATENCY.observe(time.perf_counter() - started, labels)
+            RESPONSE_SIZE.observe(size, labels)
+            self.registry.maybe_flush()
@@ -0,0 +1,181 @@
+"""Password hashing with scrypt, off the event loop and bounded in concurrency"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Optional, TypeVar
+
+from metrics import REGISTRY
+
+T = TypeVar("T")
+
+HASH_DURATION = REGISTRY.histogram(
+    "password_hash_duration_seconds",
+    "Time password hashes and checks took to compute.",
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "password_hash_queue_wait_seconds",
+    "Time password hashes and checks waited for a free worker.",
+)
+PENDING = REGISTRY.gauge(
+    "password_hash_pending", "Password hashes and checks queued or running."
+)
+REJECTED = REGISTRY.counter(
+    "password_hash_rejected_total",
+    "Password hashes and checks refused because the queue was full.",
+)
+
+
+class HasherBusy(Exception):
+    """Too many password hashes are waiting for a worker already."""
+
+
+@dataclass(frozen=True)
+class ScryptParams:
+    """Cost parameters of scrypt; `n` must be a power of 2."""
+
+    n: int = 2**14
+    r: int = 8
+    p: int = 1
+    salt_size: int = 16
+    key_size: int = 32
+
+    @property
+    def memory(self) -> int:
+        """Bytes scrypt allocates to hash with these parameters."""
+        return 128 * self.r * (self.n + self.p + 2)
+
+    def derive(self, password: str, salt: bytes) -> bytes:
+        return hashlib.scrypt(
+            password.encode(),
+            salt=salt,
+            n=self.n,
+            r=self.r,
+            p=self.p,
+            maxmem=self.memory,
+            dklen=self.key_size,
+        )
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def hash_password(password: str, params: ScryptParams = ScryptParams()) -> str:
+    """
+    Hash `password` with a random salt, as `scrypt$n$r$p$salt$key` with the
+    salt and key in base64, so that it can be checked whatever the parameters
+    are by then.
+    """
+    salt = os.urandom(params.salt_size)
+    key = params.derive(password, salt)
+
+    return f"scrypt${params.n}${params.r}${params.p}${_b64(salt)}${_b64(key)}"
+
+
+def check_password(password: str, hashed: str) -> bool:
+    """Whether `password` is the one `hashed` was made from by `hash_password`."""
+    scheme, _, encoded = hashed.partition("$")
+
+    if scheme != "scrypt":
+        return False
+
+    try:
+        n, r, p, salt, key = encoded.split("$")
+        expected = base64.b64decode(key, validate=True)
+        params = ScryptParams(int(n), int(r), int(p), key_size=len(expected))
+        derived = params.derive(password, base64.b64decode(salt, validate=True))
+    except ValueError:
+        # Not made by `hash_password`, or with parameters scrypt rejects
+        return False
+
+    return hmac.compare_digest(derived, expected)
+
+
+def _timed(func: Callable[..., T], *args: Any) -> tuple[float, float, T]:
+    started = time.perf_counter()
+    result = func(*args)
+
+    return started, time.perf_counter() - started, result
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords in `workers` threads of its own.
+
+    `hashlib.scrypt` releases the GIL, so hashes run alongside the event loop
+    and each other, and a burst of signups or logins only ever occupies these
+    threads rather than the threadpool the other routes share. At most
+    `max_queue` calls wait for a free worker; beyond that, `HasherBusy` is
+    raised at once rather than letting the wait grow without bound. The
+    threads are started on first use and again after `close`.
+    """
+
+    def __init__(
+        self,
+        params: ScryptParams = ScryptParams(),
+        workers: int = 2,
+        max_queue: int = 64,
+    ) -> None:
+        self.params = params
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self.rejected = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password, self.params)
+
+    async def check(self, password: str, hashed: str) -> bool:
+        return await self._run(check_password, password, hashed)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "workers": self.workers,
+            "running": min(self.pending, self.workers),
+            "queued": max(0, self.pending - self.workers),
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            REJECTED.inc()
+            raise HasherBusy(f"{self.max_queue} password hashes are queued already")
+
+        submitted = time.perf_counter()
+        self.pending += 1
+        PENDING.inc()
+
+        try:
+            future = self._executor().submit(_timed, func, *args)
+            started, duration, result = await asyncio.wrap_future(future)
+        finally:
+            self.pending -= 1
+            PENDING.dec()
+
+        QUEUE_WAIT.observe(started - submitted)
+        HASH_DURATION.observe(duration)
+
+        return result
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="password-hasher"
+            )
+
+        return self._pool
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,145 @@
+"""On-demand memray allocation profiling of individual requests"""
+
+import hmac
+import itertools
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import parse_qsl
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import memray
+except ImportError:  # pragma: no cover - memray is in the profiling extra
+    memray = None
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+CAPTURE_HEADER = "X-Profile-Capture"
+
+
+class RequestProfilerMiddleware:
+    """
+    Run selected HTTP requests under a memray `Tracker` and keep the capture.
+
+    A request is profiled when its X-Profile header matches `token`, or when it
+    is the `sample_rate`-th request since the last sampled one. Each capture is
+    written to `directory` as `<name>.bin`, next to `<name>.json` holding the
+    method, path, route template, parameters, status and duration of the
+    request, and its name is returned in the X-Profile-Capture header. Only the
+    newest `keep` captures are kept.
+
+    memray allows a single tracker per process, so a request that arrives while
+    another one is being profiled is served without profiling. The tracker sees
+    every allocation of the process, including those of concurrent requests.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        directory: str,
+        token: Optional[str] = None,
+        sample_rate: int = 0,
+        keep: int = 20,
+    ) -> None:
+        if memray is None:
+            raise RuntimeError(
+                "Request profiling requires memray: install the profiling extra"
+            )
+
+        self.app = app
+        self.directory = Path(directory)
+        self._token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self._requests = itertools.count(1)
+        self._sequence = itertools.count()
+        self._active = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self._active or not self.is_selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(self._sequence)}"
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append(CAPTURE_HEADER, name)
+
+            await send(message)
+
+        tracker = memray.Tracker(
+            self.directory / f"{name}.bin",
+            trace_python_allocators=True,
+            file_format=memray.FileFormat.AGGREGATED_ALLOCATIONS,
+        )
+
+        try:
+            tracker.__enter__()
+        except RuntimeError:
+            # e.g. the whole process already runs under `memray run`
+            await self.app(scope, receive, send)
+            return
+
+        self._active = True
+        started = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            tracker.__exit__(None, None, None)
+            self._active = False
+            self.write_metadata(name, scope, status, time.perf_counter() - started)
+            self.rotate()
+
+    def is_selected(self, scope: Scope) -> bool:
+        if self.sample_rate > 0 and next(self._requests) % self.sample_rate == 0:
+            return True
+
+        if self._token is None:
+            return False
+
+        for header, value in scope["headers"]:
+            if header == PROFILE_HEADER:
+                return hmac.compare_digest(value, self._token)
+
+        return False
+
+    def write_metadata(
+        self, name: str, scope: Scope, status: int, duration: float
+    ) -> None:
+        path = scope["path"]
+        metadata: dict[str, Any] = {
+            "method": scope["method"],
+            "path": path,
+            "route": getattr(scope.get("route"), "path", None),
+            "path_params": scope.get("path_params", {}),
+            "query_params": parse_qsl(scope["query_string"].decode("latin-1")),
+            "status": status,
+            "duration": duration,
+            "pid": os.getpid(),
+        }
+        (self.directory / f"{name}.json").write_text(json.dumps(metadata, default=str))
+        logger.info("Wrote memray capture %s for %s %s", name, scope["method"], path)
+
+    def rotate(self) -> None:
+        """Delete all but the newest `keep` captures."""
+        captures = sorted(
+            self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime
+        )
+
+        for metadata in captures[: max(len(captures) - self.keep, 0)]:
+            metadata.with_suffix(".bin").unlink(missing_ok=True)
+            metadata.unlink(missing_ok=True)
@@ -0,0 +1,277 @@
+"""Scheduling of events on a hierarchical timer wheel"""
+
+import asyncio
+import logging
+import math
+from collections.abc import Awaitable, Callable, Hashable, Iterator
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta, timezone
+from time import monotonic
+from typing import Any, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+FIRED = REGISTRY.counter("scheduler_events_fired_total", "Scheduled event runs.")
+LATENESS = REGISTRY.histogram(
+    "scheduler_lateness_seconds",
+    "Time scheduled events ran after they were due.",
+)
+
+
+class _Timer:
+    __slots__ = ("key", "value", "expires", "slot")
+
+    def __init__(self, key: Hashable, value: Any, expires: int) -> None:
+        self.key = key
+        self.value = value
+        self.expires = expires
+        self.slot: dict[Hashable, "_Timer"] = {}
+
+
+class TimerWheel:
+    """
+    Timers keyed by any hashable, in a hierarchical timing wheel.
+
+    Time advances in ticks of `resolution` seconds. Level 0 has a slot for
+    each of the next 2**bits ticks, and each further level has slots that
+    each span a whole turn of the level below. A timer goes in the lowest
+    level whose span reaches its deadline, and whenever a level completes a
+    turn, the next slot of the level above is emptied into the lower levels.
+    Adding, cancelling and firing a timer each take constant time, whatever
+    the number of timers; deadlines beyond the top level's span are parked in
+    its last slot and placed again when it comes round.
+    """
+
+    def __init__(
+        self,
+        resolution: float = 0.01,
+        start: float = 0.0,
+        bits: int = 6,
+        levels: int = 5,
+    ) -> None:
+        self.resolution = resolution
+        self.bits = bits
+        self.tick = math.floor(start / resolution)
+        self._mask = (1 << bits) - 1
+        self._span = 1 << (bits * levels)
+        self._levels: list[list[dict[Hashable, _Timer]]] = [
+            [{} for _ in range(1 << bits)] for _ in range(levels)
+        ]
+        self._timers: dict[Hashable, _Timer] = {}
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    def get(self, key: Hashable) -> Any:
+        timer = self._timers.get(key)
+
+        return None if timer is None else timer.value
+
+    def add(self, key: Hashable, deadline: float, value: Any = None) -> None:
+        """Fire `value` at `deadline` seconds, replacing any timer of `key`."""
+        self.cancel(key)
+        expires = max(math.ceil(deadline / self.resolution), self.tick + 1)
+        timer = self._timers[key] = _Timer(key, value, expires)
+        self._place(timer)
+
+    def cancel(self, key: Hashable) -> bool:
+        timer = self._timers.pop(key, None)
+
+        if timer is None:
+            return False
+
+        del timer.slot[key]
+
+        return True
+
+    def _place(self, timer: _Timer) -> None:
+        expires = min(timer.expires, self.tick + self._span - 1)
+        delta = expires - self.tick
+        level = 0
+
+        while delta >> (self.bits * (level + 1)):
+            level += 1
+
+        slot = self._levels[level][(expires >> (self.bits * level)) & self._mask]
+        slot[timer.key] = timer
+        timer.slot = slot
+
+    def advance(self, now: float) -> Iterator[Any]:
+        """Move time on to `now` seconds, yielding the values of due timers."""
+        target = math.floor(now / self.resolution)
+
+        while self.tick < target:
+            if not self._timers:
+                self.tick = target
+                break
+
+            self.tick += 1
+            self._cascade()
+            slot = self._levels[0][self.tick & self._mask]
+
+            while slot:
+                key, timer = slot.popitem()
+                del self._timers[key]
+                yield timer.value
+
+    def _cascade(self) -> None:
+        for level in range(1, len(self._levels)):
+            if self.tick & ((1 << (self.bits * level)) - 1):
+                return
+
+            slots = self._levels[level]
+            index = (self.tick >> (self.bits * level)) & self._mask
+            slot, slots[index] = slots[index], {}
+
+            for timer in slot.values():
+                self._place(timer)
+
+
+def aware(moment: datetime) -> datetime:
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+@dataclass(slots=True)
+class ScheduledEvent:
+    event_id: Hashable
+    next_run: datetime
+    # Run again every day at this time of day, until `end_datetime`
+    repeat_at: Optional[time] = None
+    end_datetime: Optional[datetime] = None
+    runs: int = 0
+
+    def following_run(self) -> Optional[datetime]:
+        """When the event runs after `next_run`, if it repeats."""
+        if self.repeat_at is None:
+            return None
+
+        last = aware(self.next_run)
+        zone = self.repeat_at.tzinfo or last.tzinfo
+        local = last.astimezone(zone)
+        following = datetime.combine(
+            local.date(), self.repeat_at.replace(tzinfo=None), tzinfo=zone
+        )
+
+        if following <= local:
+            following += timedelta(days=1)
+
+        if self.end_datetime is not None and following > aware(self.end_datetime):
+            return None
+
+        return following
+
+
+class EventScheduler:
+    """
+    Runs `action` for each scheduled event when it is due, on the event loop.
+
+    Events wait in a `TimerWheel` ticking every `resolution` seconds, so they
+    run at most about one tick late. Due times are wall-clock datetimes,
+    converted to `clock` time when an event is scheduled; naive ones are
+    taken as UTC. Events live in this process only.
+    """
+
+    def __init__(
+        self,
+        action: Callable[[ScheduledEvent], Awaitable[None]],
+        resolution: float = 0.01,
+        clock: Callable[[], float] = monotonic,
+        wall_clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc),
+    ) -> None:
+        self.action = action
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.wheel = TimerWheel(resolution, start=clock())
+        self._runner: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Future] = None
+        self._running: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self.wheel)
+
+    def get(self, event_id: Hashable) -> Optional[ScheduledEvent]:
+        return self.wheel.get(event_id)
+
+    def schedule(self, event: ScheduledEvent) -> None:
+        """Schedule `event`, replacing any event of the same id."""
+        self._add(event)
+        self._start()
+
+    def cancel(self, event_id: Hashable) -> bool:
+        return self.wheel.cancel(event_id)
+
+    def _add(self, event: ScheduledEvent) -> None:
+        delay = (aware(event.next_run) - self.wall_clock()).total_seconds()
+        self.wheel.add(event.event_id, self.clock() + delay, event)
+
+    def _start(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        if (
+            self._runner is None
+            or self._runner.done()
+            or self._runner.get_loop() is not loop
+        ):
+            self._runner = loop.create_task(self._run())
+        elif self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            if self.wheel:
+                # Until the start of the next tick
+                next_tick = (self.wheel.tick + 1) * self.wheel.resolution
+                await asyncio.sleep(max(0.0, next_tick - self.clock()))
+            else:
+                self._wakeup = loop.create_future()
+                await self._wakeup
+                self._wakeup = None
+
+            for event in self.wheel.advance(self.clock()):
+                self._fire(event)
+
+    def _fire(self, event: ScheduledEvent) -> None:
+        LATENESS.observe(
+            max(0.0, (self.wall_clock() - aware(event.next_run)).total_seconds())
+        )
+        FIRED.inc()
+        event.runs += 1
+        task = asyncio.create_task(self._perform(event))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        following = event.following_run()
+
+        if following is not None:
+            event.next_run = following
+            self._add(event)
+
+    async def _perform(self, event: ScheduledEvent) -> None:
+        try:
+            await self.action(event)
+        except Exception:
+            logger.exception("Scheduled event %s failed", event.event_id)
+
+    async def close(self) -> None:
+        """Stop running events; those still scheduled are dropped."""
+        loop = asyncio.get_running_loop()
+        tasks = [*self._running]
+
+        if self._runner is not None:
+            tasks.append(self._runner)
+            self._runner = None
+
+        # Tasks of an event loop that has since closed were cancelled with it
+        tasks = [task for task in tasks if task.get_loop() is loop]
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.wheel = TimerWheel(self.wheel.resolution, start=self.clock())
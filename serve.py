@@ -0,0 +1,261 @@
+"""
+Serve the app with uvicorn in several worker processes.
+
+Workers default to one per CPU available to the process, respecting CPU
+affinity and cgroup quotas. uvloop and httptools are used when installed.
+
+Send SIGHUP to the parent process for a rolling restart: workers are replaced
+one at a time, and each old worker is only stopped, finishing its in-flight
+requests, once its replacement has started and is accepting connections.
+SIGTTIN and SIGTTOU add and remove a worker.
+
+    python serve.py [--host 0.0.0.0] [--port 8000] [--workers N]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+from pathlib import Path
+from socket import socket
+from typing import Optional
+
+import uvicorn
+from uvicorn.supervisors.multiprocess import Multiprocess, Process
+
+logger = logging.getLogger("uvicorn.error")
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+# Seconds a stopping worker gives the connections it has just accepted to send
+# their request, before it closes those that sent none
+SHUTDOWN_DRAIN = 0.5
+
+
+def cgroup_cpu_quota(root: Path = CGROUP_ROOT) -> Optional[float]:
+    """CPUs allowed by the cgroup CPU quota (v2 or v1), or None if unlimited."""
+    try:
+        quota, period = (root / "cpu.max").read_text().split()
+    except (OSError, ValueError):
+        pass
+    else:
+        return None if quota == "max" else int(quota) / int(period)
+
+    for controller in ("cpu", "cpu,cpuacct"):
+        try:
+            quota = (root / controller / "cpu.cfs_quota_us").read_text()
+            period = (root / controller / "cpu.cfs_period_us").read_text()
+        except OSError:
+            continue
+
+        return None if int(quota) <= 0 else int(quota) / int(period)
+
+    return None
+
+
+def available_cpus(root: Path = CGROUP_ROOT) -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS and Windows
+        cpus = os.cpu_count() or 1
+
+    quota = cgroup_cpu_quota(root)
+
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+
+    return cpus
+
+
+def best_implementation(preferred: str, fallback: str) -> str:
+    return preferred if importlib.util.find_spec(preferred) else fallback
+
+
+class WorkerServer(uvicorn.Server):
+    """
+    A uvicorn server that sets `ready` once it accepts connections, and that
+    answers every connection it accepted before it stops.
+    """
+
+    def __init__(self, config: uvicorn.Config, ready=None) -> None:
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets: Optional[list[socket]] = None) -> None:
+        await super().startup(sockets)
+
+        if self.ready is not None and not self.should_exit:
+            self.ready.set()
+
+    async def shutdown(self, sockets: Optional[list[socket]] = None) -> None:
+        # Stop accepting first: uvicorn closes every connection that has not
+        # sent a request yet, including those accepted a moment ago whose
+        # request has not been read, and their clients would get no response
+        for server in self.servers:
+            server.close()
+
+        await asyncio.sleep(SHUTDOWN_DRAIN)
+        await super().shutdown(sockets)
+
+
+class RollingMultiprocess(Multiprocess):
+    """
+    uvicorn's process supervisor, with restarts that never drop a worker.
+
+    It overrides `Multiprocess.restart_all` and relies on how `Process` starts
+    workers, neither of which is a documented API: pyproject.toml pins uvicorn
+    to one version, and test_serve.py runs a rolling restart against it.
+    """
+
+    def __init__(
+        self, config: uvicorn.Config, sockets: list[socket], ready_timeout: float
+    ) -> None:
+        super().__init__(config, WorkerServer(config).run, sockets)
+        self.ready_timeout = ready_timeout
+
+    def restart_all(self) -> None:
+        for idx, old in enumerate(list(self.processes)):
+            # uvicorn starts its workers with the spawn method too
+            ready = multiprocessing.get_context("spawn").Event()
+            new = Process(
+                self.config, WorkerServer(self.config, ready).run, self.sockets
+            )
+            new.start()
+
+            if not ready.wait(self.ready_timeout):
+                logger.error(
+                    "Worker [%s] did not start in time, keeping worker [%s]",
+                    new.pid,
+                    old.pid,
+                )
+                new.terminate()
+                new.join()
+                continue
+
+            self.processes[idx] = new
+            old.terminate()
+            old.join()
+
+
+def build_config(args: argparse.Namespace) -> uvicorn.Config:
+    return uvicorn.Config(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=best_implementation("uvloop", "asyncio"),
+        http=best_implementation("httptools", "h11"),
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        limit_concurrency=args.limit_concurrency,
+        limit_max_requests=args.max_requests,
+        limit_max_requests_jitter=args.max_requests_jitter,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=args.proxy_headers,
+        access_log=args.access_log,
+    )
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", "0")) or available_cpus(),
+        help="Worker processes (default: $WEB_CONCURRENCY, else available CPUs)",
+    )
+    parser.add_argument(
+        "--backlog", type=int, default=2048, help="Pending connections queue size"
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=int,
+        default=5,
+        help="Seconds an idle keep-alive connection stays open",
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        default=None,
+        help="Connections and tasks per worker before answering 503",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=None,
+        help="Requests a worker serves before it is replaced",
+    )
+    parser.add_argument(
+        "--max-requests-jitter",
+        type=int,
+        default=0,
+        help="Up to this many requests are added at random to --max-requests, "
+        "so that workers are not all replaced at once",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=30,
+        help="Seconds a stopping worker waits for in-flight requests",
+    )
+    parser.add_argument(
+        "--ready-timeout",
+        type=float,
+        default=60.0,
+        help="Seconds a rolling restart waits for each new worker to start",
+    )
+    parser.add_argument("--proxy-headers", action="store_true")
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false")
+
+    args = parser.parse_args(argv)
+    # Each worker keeps its own events, so another worker would not find them
+    if args.workers > 1 and os.getenv("EVENTS_ENABLED", "") not in ("", "0"):
+        parser.error("EVENTS_ENABLED requires --workers 1")
+
+    return args
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    args = parse_args(argv)
+    config = build_config(args)
+    logger.info(
+        "Serving with %d workers (loop=%s, http=%s)",
+        args.workers,
+        config.loop,
+        config.http,
+    )
+
+    # Every worker, including those started by restarts, serves the same items
+    os.environ.setdefault(
+        "ITEM_SNAPSHOT_DIR", tempfile.mkdtemp(prefix="fastapi-hello-items-")
+    )
+    # and the same weights
+    os.environ.setdefault(
+        "WEIGHT_INDEX_PATH",
+        os.path.join(tempfile.mkdtemp(prefix="fastapi-hello-weights-"), "weights.idx"),
+    )
+
+    if args.workers > 1:
+        # Let /metrics report the totals of all workers
+        os.environ.setdefault(
+            "METRICS_DIR", tempfile.mkdtemp(prefix="fastapi-hello-metrics-")
+        )
+        # and answer /event/ with 404s rather than lose events between workers
+        os.environ["EVENTS_ENABLED"] = "0"
+
+    sock = config.bind_socket()
+    supervisor = RollingMultiprocess(config, [sock], args.ready_timeout)
+
+    try:
+        supervisor.run()
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
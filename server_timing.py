@@ -0,0 +1,184 @@
+"""Opt-in per-request phase timing reported in a Server-Timing header"""
+
+import functools
+import heapq
+import inspect
+import itertools
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from types import CodeType
+from typing import Any, NamedTuple, Optional
+
+import fastapi
+import fastapi.routing
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Phase name -> the fastapi.routing function whose run time is that phase
+PHASES = {
+    "validate": "solve_dependencies",
+    "handler": "run_endpoint_function",
+    "serialize": "serialize_response",
+}
+
+# Seconds spent per phase by the request being served, when timing is on
+_phase_durations: ContextVar[Optional[dict[str, float]]] = ContextVar(
+    "phase_durations", default=None
+)
+_originals: dict[str, Callable[..., Awaitable[Any]]] = {}
+
+
+def _timed(phase: str, func: Callable[..., Awaitable[Any]]) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        durations = _phase_durations.get()
+
+        if durations is None:
+            return await func(*args, **kwargs)
+
+        started = time.perf_counter()
+
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            durations[phase] = durations.get(phase, 0.0) + elapsed
+
+    return wrapper
+
+
+def _names_used(code: CodeType) -> set[str]:
+    """Global and attribute names used by `code` and the functions it defines."""
+    names = set(code.co_names)
+
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names |= _names_used(const)
+
+    return names
+
+
+def check_phase_functions() -> None:
+    """
+    Raise RuntimeError unless each function of `PHASES` is a coroutine function
+    of fastapi.routing that its request handler looks up by name, the way the
+    FastAPI version pinned in pyproject.toml does: patching anything else would
+    leave a phase untimed, or break requests.
+    """
+    used = _names_used(fastapi.routing.get_request_handler.__code__)
+
+    for name in PHASES.values():
+        func = getattr(fastapi.routing, name, None)
+
+        if not inspect.iscoroutinefunction(func) or name not in used:
+            raise RuntimeError(
+                f"Server timing cannot wrap fastapi.routing.{name} "
+                f"in FastAPI {fastapi.__version__}"
+            )
+
+
+def install_phase_timers() -> None:
+    """
+    Wrap the functions FastAPI uses to validate a request, call its handler and
+    serialize its result, so each call adds its duration to the current
+    request's phases.
+
+    Nothing is patched until this is called, so the request path is untouched
+    while timing is disabled. These functions are FastAPI internals, so they
+    are checked first with `check_phase_functions`.
+    """
+    check_phase_functions()
+
+    for phase, name in PHASES.items():
+        if name not in _originals:
+            _originals[name] = getattr(fastapi.routing, name)
+            setattr(fastapi.routing, name, _timed(phase, _originals[name]))
+
+
+def uninstall_phase_timers() -> None:
+    while _originals:
+        name, func = _originals.popitem()
+        setattr(fastapi.routing, name, func)
+
+
+def format_server_timing(durations: dict[str, float]) -> str:
+    return ", ".join(
+        f"{phase};dur={seconds * 1000:.3f}" for phase, seconds in durations.items()
+    )
+
+
+class SlowRequest(NamedTuple):
+    total: float
+    method: str
+    path: str
+    durations: dict[str, float]
+
+
+class ServerTimingMiddleware:
+    """
+    Time every HTTP request and add a `Server-Timing` header holding how long
+    it spent in each phase, in milliseconds, plus its total time up to the
+    start of the response.
+
+    With `slowest` > 0 the slowest `slowest` requests seen so far are kept and
+    each request that joins them is logged with its breakdown.
+    """
+
+    def __init__(self, app: ASGIApp, slowest: int = 0) -> None:
+        self.app = app
+        self.slowest = slowest
+        # Min-heap of (total, sequence, request), so the fastest is evicted
+        self._slowest: list[tuple[float, int, SlowRequest]] = []
+        self._sequence = itertools.count()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        durations: dict[str, float] = {}
+        token = _phase_durations.set(durations)
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                durations["total"] = time.perf_counter() - started
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", format_server_timing(durations))
+
+                if self.slowest > 0:
+                    self.record(scope, dict(durations))
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _phase_durations.reset(token)
+
+    def record(self, scope: Scope, durations: dict[str, float]) -> None:
+        request = SlowRequest(
+            durations["total"], scope["method"], scope["path"], durations
+        )
+        entry = (request.total, next(self._sequence), request)
+
+        if len(self._slowest) < self.slowest:
+            heapq.heappush(self._slowest, entry)
+        elif request.total > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+        else:
+            return
+
+        logger.warning(
+            "Slow request %s %s: %s",
+            request.method,
+            request.path,
+            format_server_timing(durations),
+        )
+
+    def slowest_requests(self) -> list[SlowRequest]:
+        return [request for *_, request in sorted(self._slowest, reverse=True)]
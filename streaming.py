@@ -0,0 +1,264 @@
+"""Helpers for streamed request and response bodies"""
+
+import codecs
+import json
+import re
+from collections.abc import AsyncIterable, AsyncIterator, Iterable, Iterator
+from decimal import Decimal
+from typing import Any, BinaryIO, NamedTuple, Optional, TypeVar, Union
+
+from pydantic_core import to_json
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MAX_ROW_SIZE = 1024 * 1024
+
+T = TypeVar("T")
+
+_WHITESPACE_RE = re.compile(r"\s*")
+
+
+class MalformedRow(NamedTuple):
+    """Stands in for a row of a streamed body that could not be split out."""
+
+    reason: str
+
+
+def accepts_ndjson(accept: Optional[str]) -> bool:
+    """Whether an `Accept` header value asks for newline-delimited JSON."""
+    if not accept:
+        return False
+
+    return any(
+        media_range.split(";", 1)[0].strip() == NDJSON_MEDIA_TYPE
+        for media_range in accept.split(",")
+    )
+
+
+def iter_ndjson(objects: Iterable[Any], lines_per_chunk: int = 256) -> Iterator[bytes]:
+    """
+    Serialize `objects` to NDJSON, yielding a few hundred lines per chunk.
+
+    Grouping lines keeps the per-chunk overhead of a streaming response low
+    while memory stays bounded by `lines_per_chunk`. Bytes-like objects are
+    taken to be JSON already and written as they are.
+    """
+    lines: list[Any] = []
+
+    for obj in objects:
+        lines.append(obj if isinstance(obj, (bytes, memoryview)) else to_json(obj))
+
+        if len(lines) >= lines_per_chunk:
+            yield b"\n".join(lines) + b"\n"
+            lines.clear()
+
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+def json_object(**members: Any) -> bytes:
+    """
+    Serialize `members` as a JSON object, splicing bytes-like values in as is.
+
+    Lets a response embed JSON that is already serialized, such as items read
+    from a snapshot, without parsing it back into Python objects first.
+    """
+    parts: list[Any] = [b"{"]
+
+    for name, value in members.items():
+        if len(parts) > 1:
+            parts.append(b",")
+
+        parts.append(to_json(name))
+        parts.append(b":")
+        parts.append(
+            value if isinstance(value, (bytes, memoryview)) else to_json(value)
+        )
+
+    parts.append(b"}")
+
+    return b"".join(parts)
+
+
+def iter_file_chunks(file: BinaryIO, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Read `file` from its start in chunks, e.g. to stream it as a response body."""
+    file.seek(0)
+
+    while chunk := file.read(chunk_size):
+        yield chunk
+
+
+async def abatched(items: AsyncIterable[T], size: int) -> AsyncIterator[list[T]]:
+    """Group an async stream into lists of at most `size` items."""
+    batch: list[T] = []
+
+    async for item in items:
+        batch.append(item)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+async def aiter_lines(
+    chunks: AsyncIterable[bytes], max_line_size: int = MAX_ROW_SIZE
+) -> AsyncIterator[Union[bytes, MalformedRow]]:
+    """
+    Split a byte stream into its non-blank lines as they arrive.
+
+    A line longer than `max_line_size` is dropped rather than buffered and a
+    `MalformedRow` is yielded in its place, so memory stays bounded by the limit.
+    """
+    buffer = bytearray()
+    oversized = False
+
+    async for chunk in chunks:
+        buffer += chunk
+        start = 0
+
+        while (end := buffer.find(b"\n", start)) != -1:
+            if oversized:
+                oversized = False
+            elif line := bytes(buffer[start:end]).strip():
+                yield line
+
+            start = end + 1
+
+        del buffer[:start]
+
+        if len(buffer) > max_line_size:
+            if not oversized:
+                yield MalformedRow(f"Row exceeds {max_line_size} bytes")
+
+            oversized = True
+            buffer.clear()
+
+    if not oversized and (line := bytes(buffer).strip()):
+        yield line
+
+
+class JSONArrayParser:
+    """
+    Incremental parser for a top-level JSON array, fed text as it arrives.
+
+    Each call to `feed` returns the elements completed so far, so only the
+    element currently being received is held in memory. Numbers with a
+    fraction are parsed as `Decimal` to keep them exact.
+    """
+
+    def __init__(self, max_element_size: int = MAX_ROW_SIZE) -> None:
+        self.max_element_size = max_element_size
+        self._decoder = json.JSONDecoder(parse_float=Decimal)
+        self._buffer = ""
+        self._state = "start"
+        self._error: Optional[ValueError] = None
+
+    def feed(self, text: str) -> list[Any]:
+        """
+        Parse `text` on top of what was buffered before.
+
+        If the data turns out to be malformed after some elements were completed,
+        those elements are returned and the error is raised on the next call.
+        """
+        if self._error is not None:
+            raise self._error
+
+        elements: list[Any] = []
+
+        try:
+            self._parse(self._buffer + text, elements)
+        except ValueError as exc:
+            if not elements:
+                raise
+
+            self._error = exc
+
+        return elements
+
+    def close(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+        if self._state != "done" or self._buffer.strip():
+            raise ValueError("Unterminated JSON array")
+
+    def _parse(self, buffer: str, elements: list[Any]) -> None:
+        pos = 0
+
+        while (pos := _WHITESPACE_RE.match(buffer, pos).end()) < len(buffer):
+            char = buffer[pos]
+
+            if self._state == "start":
+                self._expect(char, "[")
+                self._state = "first"
+            elif self._state == "first" and char == "]":
+                self._state = "done"
+            elif self._state in ("first", "element"):
+                element, end = self._decode(buffer, pos)
+
+                if end is None:
+                    break
+
+                elements.append(element)
+                self._state = "separator"
+                pos = end
+                continue
+            elif self._state == "separator":
+                self._expect(char, ",]")
+                self._state = "element" if char == "," else "done"
+            else:
+                raise ValueError("Unexpected data after the end of the JSON array")
+
+            pos += 1
+
+        self._buffer = buffer[pos:]
+
+    def _decode(self, buffer: str, pos: int) -> tuple[Any, Optional[int]]:
+        try:
+            element, end = self._decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            element, end = None, None
+        else:
+            # A number or literal running up to the end of the buffer may
+            # continue in the next chunk.
+            if end < len(buffer) or buffer[end - 1] in '}]"':
+                return element, end
+
+            end = None
+
+        if len(buffer) - pos > self.max_element_size:
+            raise ValueError("Malformed or oversized JSON array element")
+
+        return element, end
+
+    @staticmethod
+    def _expect(char: str, allowed: str) -> None:
+        if char not in allowed:
+            raise ValueError(f"Expected one of {allowed!r} in JSON array, got {char!r}")
+
+
+async def aiter_json_array(
+    chunks: AsyncIterable[bytes], max_element_size: int = MAX_ROW_SIZE
+) -> AsyncIterator[Any]:
+    """
+    Yield the elements of a streamed JSON array body as each one completes.
+
+    If the body turns out to be malformed, a final `MalformedRow` describing
+    the problem is yielded and the rest of the body is ignored.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = JSONArrayParser(max_element_size)
+
+    try:
+        async for chunk in chunks:
+            for element in parser.feed(decoder.decode(chunk)):
+                yield element
+
+        for element in parser.feed(decoder.decode(b"", final=True)):
+            yield element
+
+        parser.close()
+    except ValueError as exc:
+        yield MalformedRow(str(exc))
@@ -0,0 +1,174 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from admission import AdmissionController, AdmissionControlMiddleware, Priority
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.anyio
+async def test_admits_up_to_the_limit_then_queues():
+    controller = AdmissionController(limit=2, queue_size=10)
+
+    assert await controller.acquire() is None
+    assert await controller.acquire() is None
+
+    waiting = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    assert controller.queued == 1 and not waiting.done()
+
+    controller.release()
+
+    assert await waiting is None
+    assert controller.queued == 0 and controller.active == 2
+
+
+@pytest.mark.anyio
+async def test_sheds_when_the_queue_is_full():
+    controller = AdmissionController(limit=1, queue_size=1)
+    await controller.acquire()
+    waiting = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+
+    assert await controller.acquire() == "queue_full"
+
+    controller.release()
+    await waiting
+
+
+@pytest.mark.anyio
+async def test_freed_slots_go_to_the_highest_priority():
+    controller = AdmissionController(limit=1, queue_size=10)
+    await controller.acquire()
+    admitted = []
+
+    async def request(priority: Priority) -> None:
+        await controller.acquire(priority=priority)
+        admitted.append(priority)
+
+    tasks = [
+        asyncio.create_task(request(priority))
+        for priority in (Priority.LOW, Priority.NORMAL, Priority.HIGH)
+    ]
+    await asyncio.sleep(0)
+
+    for count in range(1, len(tasks) + 1):
+        controller.release()
+
+        while len(admitted) < count:
+            await asyncio.sleep(0)
+
+    assert admitted == [Priority.HIGH, Priority.NORMAL, Priority.LOW]
+
+
+@pytest.mark.anyio
+async def test_route_limit_does_not_hold_back_other_routes():
+    controller = AdmissionController(limit=3, queue_size=10)
+
+    assert await controller.acquire("/bulk", 1, Priority.LOW) is None
+
+    bulk = asyncio.create_task(controller.acquire("/bulk", 1, Priority.LOW))
+    await asyncio.sleep(0)
+
+    assert not bulk.done()
+    assert await controller.acquire("/other") is None
+
+    controller.release("/bulk")
+
+    assert await bulk is None
+    assert controller.route_active == {"/bulk": 1, "/other": 1}
+
+
+@pytest.mark.anyio
+async def test_standing_queue_waits_only_target():
+    clock = FakeClock()
+    controller = AdmissionController(
+        limit=1, queue_size=10, target=0.01, interval=0.2, clock=clock
+    )
+    await controller.acquire()
+
+    # A burst: the queue was empty until now
+    assert controller.timeout() == 0.2
+
+    waiting = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+    clock.now = 0.5
+
+    # The queue has not drained for longer than `interval`
+    assert controller.timeout() == 0.01
+    assert await controller.acquire() == "timeout"
+
+    controller.release()
+    await waiting
+    controller.release()
+    clock.now = 1.0
+
+    assert controller.timeout() == 0.2
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_leaves_the_queue():
+    controller = AdmissionController(limit=1, queue_size=10)
+    await controller.acquire()
+    waiting = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+
+    waiting.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+    assert controller.queued == 0
+
+    controller.release()
+
+    assert controller.active == 0
+
+
+@pytest.mark.anyio
+async def test_middleware_answers_shed_requests_with_503():
+    app = FastAPI()
+    started, finish = asyncio.Event(), asyncio.Event()
+
+    @app.get("/slow")
+    async def slow():
+        started.set()
+        await finish.wait()
+        return {"done": True}
+
+    app.add_middleware(AdmissionControlMiddleware, limit=1, queue_size=0, retry_after=3)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        first = asyncio.create_task(client.get("/slow"))
+        await started.wait()
+        shed = await client.get("/slow")
+        finish.set()
+
+        assert (await first).status_code == 200
+
+    assert shed.status_code == 503
+    assert shed.headers["Retry-After"] == "3"
+
+
+def test_policy_matches_route_templates():
+    middleware = AdmissionControlMiddleware(FastAPI(), limit=1, queue_size=1)
+
+    assert middleware.policy("GET", "/") == ("/", Priority.HIGH, None)
+    assert middleware.policy("GET", "/model/resnet")[1] == Priority.HIGH
+    assert middleware.policy("POST", "/items/bulk") == ("/items/bulk", Priority.LOW, 2)
+    assert middleware.policy("GET", "/items/1") == (None, Priority.NORMAL, None)
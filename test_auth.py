@@ -0,0 +1,54 @@
+from http import HTTPStatus
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from auth import TokenGuardMiddleware
+
+SECRET = "sesame"
+
+
+def make_client(received: list) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(
+        TokenGuardMiddleware, token=SECRET, routes=[("POST", "/things/{id}")]
+    )
+
+    @app.post("/things/{thing_id}")
+    async def create_thing(request: Request):
+        received.append(await request.body())
+        return {"ok": True}
+
+    @app.get("/things/{thing_id}")
+    def read_thing():
+        return {"ok": True}
+
+    return TestClient(app=app)
+
+
+def test_rejects_before_body_is_read():
+    received = []
+    resp = make_client(received).post(
+        "/things/1", content=b"payload", headers={"X-Token": "wrong"}
+    )
+
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
+    assert resp.json() == {"detail": "Invalid X-Token header"}
+    assert received == []
+
+
+def test_accepts_valid_token():
+    received = []
+    resp = make_client(received).post(
+        "/things/1", content=b"payload", headers={"X-Token": SECRET}
+    )
+
+    assert resp.status_code == HTTPStatus.OK
+    assert received == [b"payload"]
+
+
+def test_unprotected_method_and_path_pass_through():
+    client = make_client([])
+
+    assert client.get("/things/1").status_code == HTTPStatus.OK
+    assert client.post("/things/1/more").status_code == HTTPStatus.NOT_FOUND
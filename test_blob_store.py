@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import io
+import os
+from tempfile import SpooledTemporaryFile
+
+from fastapi import UploadFile
+
+from blob_store import BlobStore, copy_file_contents
+
+
+def test_copy_file_contents_from_disk(tmp_path):
+    content = os.urandom(300_000)
+    src = SpooledTemporaryFile(max_size=10)
+    src.write(content)
+
+    with open(tmp_path / "dst", "wb") as dst:
+        copy_file_contents(src, dst, len(content))
+
+    assert (tmp_path / "dst").read_bytes() == content
+
+
+def test_copy_file_contents_from_memory(tmp_path):
+    src = SpooledTemporaryFile(max_size=1024)
+    src.write(b"small")
+
+    with open(tmp_path / "dst", "wb") as dst:
+        copy_file_contents(src, dst, 5)
+
+    assert (tmp_path / "dst").read_bytes() == b"small"
+    assert not src._rolled
+
+
+def test_copy_file_contents_after_a_partial_kernel_copy(tmp_path, monkeypatch):
+    content = os.urandom(300_000)
+    src = SpooledTemporaryFile(max_size=10)
+    src.write(content)
+    calls = []
+
+    def copy_then_stop(src_fd, dst_fd, count, offset):
+        calls.append(offset)
+
+        if len(calls) > 1:
+            return 0
+
+        return os.write(dst_fd, content[:1000])
+
+    monkeypatch.setattr(os, "copy_file_range", copy_then_stop, raising=False)
+
+    with open(tmp_path / "dst", "wb") as dst:
+        copy_file_contents(src, dst, len(content))
+
+    assert calls == [0, 1000]
+    assert (tmp_path / "dst").read_bytes() == content
+
+
+def test_ingest_file_deduplicates(tmp_path):
+    store = BlobStore(str(tmp_path))
+    sha256 = hashlib.sha256(b"payload").hexdigest()
+
+    try:
+        first = store.ingest_file(io.BytesIO(b"payload"))
+        second = store.ingest_file(io.BytesIO(b"payload"))
+    finally:
+        store.close()
+
+    assert (first.sha256, first.size, first.deduplicated) == (sha256, 7, False)
+    assert second.deduplicated
+    assert store.exists(sha256)
+    assert os.listdir(store.path_for(sha256).parent) == [sha256]
+
+
+def test_ingest_after_close(tmp_path):
+    store = BlobStore(str(tmp_path))
+    store.close()
+
+    async def ingest() -> None:
+        await store.ingest(UploadFile(io.BytesIO(b"payload")))
+
+    try:
+        asyncio.run(ingest())
+    finally:
+        store.close()
+
+    assert store.exists(hashlib.sha256(b"payload").hexdigest())
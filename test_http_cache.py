@@ -0,0 +1,169 @@
+import asyncio
+
+import pytest
+
+from http_cache import LRUTTLCache, SingleFlight, etag_matches, make_etag
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_make_etag_is_strong_and_stable():
+    etag = make_etag(b"hello")
+
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == make_etag(b"hello")
+    assert etag != make_etag(b"hello!")
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('"x", W/"abc"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"abd"', '"abc"')
+    assert not etag_matches(None, '"abc"')
+
+
+def test_lru_eviction():
+    cache = LRUTTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = LRUTTLCache(ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now = 9.9
+
+    assert cache.get("a") == 1
+
+    clock.now = 10
+
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_invalidate_by_tag():
+    cache = LRUTTLCache()
+    cache.set((1, "x"), "one-x", tag=1)
+    cache.set((1, "y"), "one-y", tag=1)
+    cache.set((2, "x"), "two-x", tag=2)
+    cache.invalidate(1)
+    cache.invalidate(99)
+
+    assert cache.get((1, "x")) is None
+    assert cache.get((1, "y")) is None
+    assert cache.get((2, "x")) == "two-x"
+    assert cache.stats()["invalidations"] == 2
+
+    cache.clear()
+
+    assert len(cache) == 0
+
+
+@pytest.mark.anyio
+async def test_single_flight_shares_one_call():
+    flights = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def render() -> bytes:
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return b"body"
+
+    waiters = [asyncio.create_task(flights.do("key", render)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*waiters) == [b"body"] * 5
+    assert calls == 1
+    assert flights.coalesced == 4
+    assert len(flights) == 0
+
+    # Once the call is over, the next one runs again
+    assert await flights.do("key", render) == b"body"
+    assert calls == 2
+
+
+@pytest.mark.anyio
+async def test_single_flight_shares_exceptions():
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def fail() -> None:
+        await release.wait()
+        raise LookupError("missing")
+
+    waiters = [asyncio.create_task(flights.do("key", fail)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+
+    assert all(isinstance(result, LookupError) for result in results)
+    assert len(flights) == 0
+
+
+@pytest.mark.anyio
+async def test_single_flight_survives_a_cancelled_caller():
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def render() -> bytes:
+        await release.wait()
+        return b"body"
+
+    leader = asyncio.create_task(flights.do("key", render))
+    follower = asyncio.create_task(flights.do("key", render))
+    await asyncio.sleep(0)
+    leader.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await follower == b"body"
+    assert leader.cancelled()
+
+
+@pytest.mark.anyio
+async def test_single_flight_cancels_the_call_nobody_waits_for():
+    flights = SingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def render() -> None:
+        started.set()
+
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    waiter = asyncio.create_task(flights.do("key", render))
+    await started.wait()
+    waiter.cancel()
+    await cancelled.wait()
+
+    assert len(flights) == 0
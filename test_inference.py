@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from inference import STAND_IN_MODELS, MicroBatcher
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class RecordingModel:
+    def __init__(self) -> None:
+        self.batches: list[list[int]] = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, batch: list[int]) -> list[int]:
+        self.batches.append(batch)
+        await self.release.wait()
+        return [value * 10 for value in batch]
+
+
+@pytest.mark.anyio
+async def test_concurrent_calls_are_batched_up_to_the_limit():
+    model = RecordingModel()
+    model.release.set()
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait=1.0)
+
+    results = await asyncio.gather(*(batcher.submit(n) for n in range(6)))
+
+    assert results == [n * 10 for n in range(6)]
+    # A full batch goes at once; the rest collect while it runs
+    assert model.batches == [[0, 1, 2, 3], [4, 5]]
+
+
+@pytest.mark.anyio
+async def test_a_call_to_an_idle_batcher_is_sent_right_away():
+    model = RecordingModel()
+    model.release.set()
+    batcher = MicroBatcher(model, max_batch_size=32, max_wait=60)
+
+    assert await asyncio.wait_for(batcher.submit(1), 1.0) == 10
+    assert model.batches == [[1]]
+
+
+@pytest.mark.anyio
+async def test_calls_collect_while_batches_are_in_flight():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=32, max_wait=0, max_in_flight=1)
+    first = asyncio.create_task(batcher.submit(0))
+
+    while not model.batches:
+        await asyncio.sleep(0)
+
+    rest = [asyncio.create_task(batcher.submit(n)) for n in range(1, 4)]
+    await asyncio.sleep(0.01)
+
+    assert batcher.in_flight == 1 and len(model.batches) == 1
+
+    model.release.set()
+
+    assert await first == 0
+    assert await asyncio.gather(*rest) == [10, 20, 30]
+    assert model.batches == [[0], [1, 2, 3]]
+
+
+@pytest.mark.anyio
+async def test_a_failed_batch_fails_its_calls():
+    async def broken(batch: list[int]) -> list[int]:
+        raise RuntimeError("out of memory")
+
+    batcher = MicroBatcher(broken, max_batch_size=2, max_wait=0)
+
+    with pytest.raises(RuntimeError, match="out of memory"):
+        await asyncio.gather(batcher.submit(1), batcher.submit(2))
+
+    assert batcher.in_flight == 0
+
+
+def test_batched_forward_pass_matches_one_row_at_a_time():
+    model = STAND_IN_MODELS["lenet"].load()
+    rows = [[(n * 7 + i) % 5 - 2.0 for i in range(32)] for n in range(3)]
+
+    batched = model.forward(rows)
+
+    assert batched == [model.forward([row])[0] for row in rows]
+    assert all(sum(row) == pytest.approx(1.0) for row in batched)
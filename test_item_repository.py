@@ -0,0 +1,142 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from item_repository import SQLiteItemRepository
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_save_and_load_round_trip(tmp_path):
+    repository = SQLiteItemRepository(str(tmp_path / "items.db"), pool_size=2)
+    await repository.open()
+
+    try:
+        await repository.save(
+            {
+                "id": 7,
+                "name": "Bazz",
+                "description": None,
+                "price": Decimal("1.590"),
+                "tax": Decimal("0.0000000000000000000001"),
+                "tags": ["i", "j"],
+                "images": [{"url": "http://1.2.3.4/img/1.jpg", "name": "img"}],
+            }
+        )
+
+        item = await repository.get(7)
+
+        assert item["price"] == Decimal("1.590")
+        assert str(item["price"]) == "1.590"
+        assert item["tax"] == Decimal("1E-22")
+        assert item["tags"] == ["i", "j"]
+        assert item["images"][0]["url"] == "http://1.2.3.4/img/1.jpg"
+        assert await repository.get(8) is None
+    finally:
+        await repository.close()
+
+
+@pytest.mark.anyio
+async def test_concurrent_writes_are_group_committed(tmp_path):
+    repository = SQLiteItemRepository(str(tmp_path / "items.db"))
+    await repository.open()
+
+    try:
+        await asyncio.gather(
+            *(
+                repository.save({"id": item_id, "name": "x", "price": Decimal(item_id)})
+                for item_id in range(1, 201)
+            )
+        )
+
+        assert repository.rows_committed == 200
+        assert repository.batches_committed < 200
+        assert len(await repository.load_all()) == 200
+    finally:
+        await repository.close()
+
+
+@pytest.mark.anyio
+async def test_save_requires_open_repository(tmp_path):
+    repository = SQLiteItemRepository(str(tmp_path / "items.db"))
+
+    with pytest.raises(RuntimeError):
+        await repository.save({"id": 1, "name": "x", "price": Decimal(1)})
+
+
+def test_items_survive_restart(tmp_path, monkeypatch):
+    monkeypatch.setenv("ITEM_DB_PATH", str(tmp_path / "items.db"))
+
+    with TestClient(app=main.app) as client:
+        resp = client.post(
+            "/item",
+            headers={"X-Token": "coneofsilence"},
+            json={"id": 301, "name": "Durable", "price": "2.500", "tax": "0.125"},
+        )
+        assert resp.status_code == 201
+
+        resp = client.put("/item/302", json={"item": {"name": "Put", "price": "1"}})
+        assert resp.status_code == 200
+
+    main.item_snapshots.publish({301: None, 302: None})
+
+    with TestClient(app=main.app) as client:
+        resp = client.get(
+            "/items/301", params={"needy": "x"}, headers={"X-Token": "coneofsilence"}
+        )
+
+        assert resp.json()["item"]["price"] == "2.500"
+        assert resp.json()["item"]["tax"] == "0.125"
+        assert 302 in main.item_snapshots.current()
+
+    assert main.item_repository is None
+
+
+def test_items_are_not_published_when_saving_them_fails(tmp_path, monkeypatch):
+    monkeypatch.setenv("ITEM_DB_PATH", str(tmp_path / "items.db"))
+
+    async def fail(item_dicts):
+        raise RuntimeError("disk full")
+
+    with TestClient(app=main.app, raise_server_exceptions=False) as client:
+        save_many = main.item_repository.save_many
+        monkeypatch.setattr(main.item_repository, "save_many", fail)
+
+        resp = client.post(
+            "/item",
+            headers={"X-Token": "coneofsilence"},
+            json={"id": 311, "name": "Lost", "price": "1"},
+        )
+        assert resp.status_code == 500
+
+        resp = client.put("/item/312", json={"item": {"name": "Lost", "price": "1"}})
+        assert resp.status_code == 500
+
+        resp = client.post(
+            "/items/bulk",
+            headers={"X-Token": "coneofsilence"},
+            content=b'{"id": 313, "name": "Lost", "price": "1"}\n',
+        )
+        assert resp.status_code == 500
+
+        snapshot = main.item_snapshots.current()
+
+        assert all(item_id not in snapshot for item_id in (311, 312, 313))
+
+        # The id is free again
+        monkeypatch.setattr(main.item_repository, "save_many", save_many)
+        resp = client.post(
+            "/item",
+            headers={"X-Token": "coneofsilence"},
+            json={"id": 311, "name": "Kept", "price": "1"},
+        )
+        assert resp.status_code == 201
+
+    main.item_snapshots.publish({311: None})
@@ -0,0 +1,263 @@
+import json
+import multiprocessing
+import threading
+import time
+from decimal import Decimal
+
+import pytest
+
+import item_snapshot
+from item_snapshot import ItemSnapshot, SnapshotStore, tokenize
+
+ITEMS = {
+    1: {"name": "Red Lamp", "description": "A desk lamp", "price": "3.50"},
+    2: {
+        "name": "Blue Lamp",
+        "description": None,
+        "price": Decimal("7.25"),
+        "tags": ["blue", "sale"],
+    },
+    3: {"name": "Chair", "price": Decimal("12"), "tags": ["sale"]},
+}
+
+
+@pytest.fixture
+def store(tmp_path) -> SnapshotStore:
+    store = SnapshotStore(str(tmp_path))
+    store.seed(ITEMS)
+
+    return store
+
+
+def search(snapshot: ItemSnapshot, **kwargs) -> list[int]:
+    return list(snapshot.iter_search(**kwargs))
+
+
+def test_get_returns_stored_json(store):
+    snapshot = store.current()
+
+    assert len(snapshot) == 3
+    assert 2 in snapshot and 4 not in snapshot and "2" not in snapshot
+    assert json.loads(bytes(snapshot.get_json(1)))["name"] == "Red Lamp"
+    assert snapshot.get(2)["price"] == "7.25"
+    assert snapshot.get(4) is None
+    assert snapshot.next_id() == 4
+
+
+def test_tokenize():
+    assert tokenize("A desk-lamp, A DESK") == {"a", "desk", "lamp"}
+    assert tokenize(None) == set()
+
+
+@pytest.mark.parametrize(
+    "kwargs, ids",
+    [
+        ({}, [1, 2, 3]),
+        ({"q": "lamp"}, [1, 2]),
+        ({"q": "desk lamp"}, [1]),
+        ({"q": "sofa"}, []),
+        ({"q": "--"}, []),
+        ({"tags": ["sale"]}, [2, 3]),
+        ({"tags": ["sale", "blue"]}, [2]),
+        ({"tags": ["nope"]}, []),
+        ({"price_min": Decimal("3.50"), "price_max": Decimal("7.25")}, [1, 2]),
+        ({"price_min": Decimal("8")}, [3]),
+        ({"q": "lamp", "tags": ["sale"], "price_max": Decimal("10")}, [2]),
+        ({"after": 1}, [2, 3]),
+        ({"tags": ["sale"], "after": 2}, [3]),
+        ({"after": 3}, []),
+    ],
+)
+def test_search(store, kwargs: dict, ids: list[int]):
+    assert search(store.current(), **kwargs) == ids
+
+
+def test_scan_reads_ids_a_chunk_at_a_time(store, monkeypatch):
+    monkeypatch.setattr(item_snapshot, "_SCAN_CHUNK", 2)
+    store.publish({4: {"name": "Desk", "price": "40"}, 2: None})
+
+    assert search(store.current()) == [1, 3, 4]
+    assert search(store.current(), after=1) == [3, 4]
+
+
+def test_publish_swaps_versions(store):
+    before = store.current()
+
+    store.publish(
+        {
+            2: {"name": "Green Lamp", "price": "1", "tags": ["green"]},
+            3: None,
+            9: {"name": "Sofa", "price": "99.99", "tags": ["sale"]},
+        }
+    )
+    after = store.current()
+
+    assert after.version == before.version + 1 == store.version
+    assert search(after) == [1, 2, 9]
+    assert after.revision(1) == before.revision(1)
+    assert after.revision(2) == after.version
+    assert search(after, tags=["sale"]) == [9]
+    assert search(after, q="lamp", price_max=Decimal("2")) == [2]
+    assert search(after, q="blue") == []
+    assert after.next_id() == 10
+    # The previous version stays readable while it is in use
+    assert search(before, tags=["sale"]) == [2, 3]
+
+
+def test_seed_only_publishes_the_first_version(store, tmp_path):
+    SnapshotStore(str(tmp_path)).seed({5: {"name": "Other", "price": "1"}})
+
+    assert search(store.current()) == [1, 2, 3]
+
+
+@pytest.mark.parametrize("max_delta, files", [(0, 2), (1024, 3)])
+def test_stale_versions_are_removed(tmp_path, max_delta: int, files: int):
+    store = SnapshotStore(str(tmp_path), keep=2, max_delta=max_delta)
+    store.seed(ITEMS)
+
+    for n in range(5):
+        store.publish({10 + n: {"name": f"Item {n}", "price": "1"}})
+
+    # Besides the newest versions, the base segment of the current one is kept
+    assert len(list(tmp_path.glob("items-*.snap"))) == files
+    assert len(store.current()) == 8
+
+
+def test_deltas_are_folded_into_a_new_base(tmp_path):
+    store = SnapshotStore(str(tmp_path), max_delta=3)
+    store.seed(ITEMS)
+    store.publish({2: {"name": "Green Lamp", "price": "1", "tags": ["green"]}})
+    store.publish({3: None, 9: {"name": "Sofa", "price": "99.99"}})
+    delta = store.current()
+
+    assert delta.base.version == 1 and len(delta.delta) == 2
+    assert search(delta) == [1, 2, 9]
+    assert search(delta, tags=["sale"]) == []
+    assert search(delta, q="lamp", after=1) == [2]
+    assert search(delta, price_min=Decimal("2")) == [1, 9]
+    assert len(delta) == 3 and 3 not in delta and delta.next_id() == 10
+
+    store.publish({9: None})
+    folded = store.current()
+
+    assert folded.base.version == folded.version == 4
+    assert len(folded.delta) == 0 and len(folded.base) == 2
+    assert [folded.revision(item_id) for item_id in (1, 2)] == [1, 2]
+    assert folded.next_id() == 3
+    assert search(folded, tags=["green"]) == [2]
+    # The previous version still reads from its own base and delta
+    assert delta.get(9)["name"] == "Sofa"
+
+
+def test_concurrent_publishes_are_all_applied(store):
+    threads = [
+        threading.Thread(
+            target=store.publish, args=({item_id: {"name": "x", "price": "1"}},)
+        )
+        for item_id in range(10, 30)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert search(store.current()) == [1, 2, 3, *range(10, 30)]
+
+
+def test_every_publish_of_a_failed_version_raises(store, monkeypatch):
+    writing, release = threading.Event(), threading.Event()
+    write = store._write
+
+    def failing_write(changes) -> None:
+        if not writing.is_set():
+            # The first version blocks, so that the next two publishes queue up
+            writing.set()
+            release.wait()
+            return write(changes)
+
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(store, "_write", failing_write)
+    errors: dict[int, BaseException] = {}
+
+    def publish(item_id: int) -> None:
+        try:
+            store.publish({item_id: {"name": "x", "price": "1"}})
+        except OSError as exc:
+            errors[item_id] = exc
+
+    threads = [threading.Thread(target=publish, args=(10,))]
+    threads[0].start()
+    writing.wait()
+    threads.extend(threading.Thread(target=publish, args=(n,)) for n in (11, 12))
+
+    for thread in threads[1:]:
+        thread.start()
+
+    while len(store._pending.changes) < 2:
+        time.sleep(0.001)
+
+    release.set()
+
+    for thread in threads:
+        thread.join()
+
+    assert sorted(errors) == [11, 12]
+    assert search(store.current()) == [1, 2, 3, 10]
+
+
+def test_insert_gives_out_ids_and_refuses_taken_ones(store):
+    store.publish({9: {"name": "Sofa", "price": "99.99"}, 3: None})
+    stored = store.insert(
+        [
+            {"id": None, "name": "Stool", "price": "5"},
+            {"id": 2, "name": "Taken", "price": "1"},
+            {"id": 3, "name": "Deleted", "price": "1"},
+            {"id": None, "name": "Desk", "price": "40"},
+        ]
+    )
+
+    assert [item and item["id"] for item in stored] == [10, None, 3, 11]
+    assert store.current().get(10) == {"id": 10, "name": "Stool", "price": "5"}
+    assert store.current().get(2)["name"] == "Blue Lamp"
+
+
+def test_concurrent_inserts_never_share_an_id(store):
+    results: list = []
+
+    def insert(item_id) -> None:
+        results.extend(store.insert([{"id": item_id, "name": "x", "price": "1"}]))
+
+    threads = [
+        threading.Thread(target=insert, args=(item_id,))
+        for item_id in [None] * 10 + [500] * 5
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    stored = [item["id"] for item in results if item is not None]
+
+    assert len(stored) == len(set(stored)) == 11
+    assert 500 in stored
+    assert len(store.current()) == 14
+
+
+def publish_from_another_process(directory: str) -> None:
+    SnapshotStore(directory).publish({4: {"name": "Stool", "price": "5"}})
+
+
+def test_other_processes_see_published_versions(store, tmp_path):
+    process = multiprocessing.get_context("spawn").Process(
+        target=publish_from_another_process, args=(str(tmp_path),)
+    )
+    process.start()
+    process.join()
+
+    assert process.exitcode == 0
+    assert store.current().get(4)["name"] == "Stool"
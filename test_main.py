@@ -1,9 +1,20 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
+from uuid import UUID
 
+import anyio.to_thread
 import pytest
 from fastapi.testclient import TestClient
 
-from main import app
+import main
+from auth import TokenProtectedRoutes
+from main import Image, app
 
 test_client = TestClient(app=app)
 
@@ -35,6 +46,94 @@ def test_read_items(data_for_read_items):
     assert "q3" not in resp.json()
 
 
+def test_read_items_search_no_match():
+    resp = test_client.get("/items", params={"q": "abcdefg"})
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json()["items"] == []
+    assert resp.json()["q"] == "abcdefg"
+
+
+def test_read_items_filter_by_tags_and_price():
+    for item_id, price, tags in [(101, "3.50", ["red"]), (102, "7.25", ["red", "big"])]:
+        test_client.post(
+            "/item",
+            headers={"X-Token": "coneofsilence"},
+            json={"id": item_id, "name": "Lamp", "price": price, "tags": tags},
+        )
+
+    resp = test_client.get("/items", params={"tags": ["red"], "price_min": "3"})
+
+    assert resp.status_code == HTTPStatus.OK
+    assert [item["id"] for item in resp.json()["items"]] == [101, 102]
+
+    resp = test_client.get(
+        "/items", params={"tags": ["red", "big"], "price_max": "10.00"}
+    )
+
+    assert [item["id"] for item in resp.json()["items"]] == [102]
+
+    resp = test_client.get("/items", params={"q": "lamp", "price_max": "4"})
+
+    assert [item["id"] for item in resp.json()["items"]] == [101]
+
+
+def test_read_items_paginated_with_cursor():
+    for item_id in range(401, 406):
+        test_client.post(
+            "/item",
+            headers={"X-Token": "coneofsilence"},
+            json={"id": item_id, "name": "Page", "price": "1", "tags": ["paged"]},
+        )
+
+    resp = test_client.get("/items", params={"tags": "paged", "limit": 2})
+
+    assert resp.status_code == HTTPStatus.OK
+    assert [item["id"] for item in resp.json()["items"]] == [401, 402]
+    assert resp.json()["next_cursor"] == 402
+
+    resp = test_client.get(
+        "/items", params={"tags": "paged", "limit": 2, "cursor": 404}
+    )
+
+    assert [item["id"] for item in resp.json()["items"]] == [405]
+    assert resp.json()["next_cursor"] is None
+
+    resp = test_client.get("/items", params={"cursor": 400, "limit": 3})
+
+    assert [item["id"] for item in resp.json()["items"]] == [401, 402, 403]
+
+
+def test_read_items_ndjson_stream():
+    for item_id in (411, 412):
+        test_client.post(
+            "/item",
+            headers={"X-Token": "coneofsilence"},
+            json={"id": item_id, "name": "Stream", "price": "2.50", "tags": ["nd"]},
+        )
+
+    resp = TestClient(app=app, cookies={"ads_id": "dummy_cookie"}).get(
+        "/items",
+        params={"tags": "nd", "q-2": ["x"]},
+        headers={"Accept": "application/x-ndjson"},
+    )
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.headers["content-type"] == "application/x-ndjson"
+
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+
+    assert lines[0] == {"q2": ["x"], "cookies": {"ads_id": "dummy_cookie"}}
+    assert [line["id"] for line in lines[1:]] == [411, 412]
+    assert lines[1]["price"] == "2.50"
+
+
+def test_read_items_invalid_limit():
+    resp = test_client.get("/items", params={"limit": 0})
+
+    assert resp.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
 def test_read_items_leave_fields_as_default():
     resp = test_client.get("/items", params={})
 
@@ -81,7 +180,7 @@ def test_read_item():
 
 def test_read_item_missing_mandatory_query_param():
     resp = test_client.get(
-        "/item/1", params={"q": "blahblah"}, headers={"X-Token": "hailhydra"}
+        "/item/1", params={"q": "blahblah"}, headers={"X-Token": "coneofsilence"}
     )
 
     assert resp.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
@@ -97,6 +196,18 @@ def test_read_item_invalid_token():
     assert resp.json() == {"detail": "Invalid X-Token header"}
 
 
+def test_read_item_invalid_token_checked_before_validation():
+    resp = test_client.get("/item/not-an-id", headers={"X-Token": "hailhydra"})
+
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
+    assert resp.headers["x-error"] == "token"
+
+    resp = test_client.get("/items/1", params={"needy": "abcde"})
+
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
+    assert resp.json() == {"detail": "Invalid X-Token header"}
+
+
 def test_read_item_inexistent_item():
     resp = test_client.get(
         "/items/99999", params={"needy": "abcde"}, headers={"X-Token": "coneofsilence"}
@@ -106,6 +217,94 @@ def test_read_item_inexistent_item():
     assert resp.json() == {"detail": "Item not found"}
 
 
+def test_read_item_etag_and_not_modified():
+    params = {"needy": "etag", "short": True}
+    headers = {"X-Token": "coneofsilence"}
+    resp = test_client.get("/items/2", params=params, headers=headers)
+    etag = resp.headers["etag"]
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json()["description"] == "desc"
+
+    resp = test_client.get(
+        "/item/2", params=params, headers={**headers, "If-None-Match": etag}
+    )
+
+    assert resp.status_code == HTTPStatus.NOT_MODIFIED
+    assert resp.content == b""
+    assert resp.headers["etag"] == etag
+
+    resp = test_client.get(
+        "/item/2", params=params, headers={**headers, "If-None-Match": '"stale"'}
+    )
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.headers["etag"] == etag
+
+
+def test_read_item_cache_invalidated_by_update():
+    params = {"needy": "cache"}
+    headers = {"X-Token": "coneofsilence"}
+    test_client.put("/item/501", json={"item": {"name": "Old", "price": "1"}})
+    before = test_client.get("/items/501", params=params, headers=headers)
+    stats = test_client.get("/stats/item-cache").json()
+
+    test_client.get("/items/501", params=params, headers=headers)
+
+    assert test_client.get("/stats/item-cache").json()["hits"] == stats["hits"] + 1
+
+    test_client.put("/item/501", json={"item": {"name": "New", "price": "1"}})
+    after = test_client.get("/items/501", params=params, headers=headers)
+
+    assert before.json()["item"]["name"] == "Old"
+    assert after.json()["item"]["name"] == "New"
+    assert after.headers["etag"] != before.headers["etag"]
+
+
+def test_read_items_batch():
+    resp = test_client.get(
+        "/items/batch",
+        params={"ids": "2,99999,1,2", "needy": "many", "short": True},
+        headers={"X-Token": "coneofsilence"},
+    )
+
+    assert resp.status_code == HTTPStatus.OK
+    assert [item["name"] for item in resp.json()["items"]] == ["Bar", "Foo"]
+    assert resp.json()["missing"] == [99999]
+    assert resp.json()["needy"] == "many"
+    assert resp.json()["description"] == "desc"
+
+
+def test_read_items_batch_by_body():
+    resp = test_client.post(
+        "/items/batch",
+        params={"needy": "many"},
+        json={"ids": list(range(1, 3)) + [88888]},
+        headers={"X-Token": "coneofsilence"},
+    )
+
+    assert resp.status_code == HTTPStatus.OK
+    assert len(resp.json()["items"]) == 2
+    assert resp.json()["missing"] == [88888]
+    assert resp.json()["q"] is None
+
+
+def test_read_items_batch_invalid():
+    resp = test_client.get(
+        "/items/batch",
+        params={"ids": "1,a", "needy": "x"},
+        headers={"X-Token": "coneofsilence"},
+    )
+
+    assert resp.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    resp = test_client.get(
+        "/items/batch", params={"ids": "1", "needy": "x"}, headers={"X-Token": "no"}
+    )
+
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+
 def test_create_item():
     resp = test_client.post(
         "/item",
@@ -144,6 +343,15 @@ def test_create_item_invalid_token():
     assert resp.json() == {"detail": "Invalid X-Token header"}
 
 
+def test_create_item_invalid_token_and_body():
+    resp = test_client.post(
+        "/item", headers={"X-Token": "hailhydra"}, json={"name": 123}
+    )
+
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
+    assert resp.json() == {"detail": "Invalid X-Token header"}
+
+
 def test_create_item_existing_item():
     resp = test_client.post(
         "/item",
@@ -155,6 +363,103 @@ def test_create_item_existing_item():
     assert resp.json() == {"detail": "Item already exists"}
 
 
+def test_concurrent_creates_get_distinct_ids():
+    def create(item_id):
+        return test_client.post(
+            "/item",
+            headers={"X-Token": "coneofsilence"},
+            json={"id": item_id, "name": "Racer", "price": "1"},
+        )
+
+    with ThreadPoolExecutor(max_workers=15) as executor:
+        responses = list(executor.map(create, [None] * 10 + [500] * 5))
+
+    created = [resp.json()["id"] for resp in responses[:10]]
+    statuses = sorted(resp.status_code for resp in responses[10:])
+
+    assert all(resp.status_code == HTTPStatus.CREATED for resp in responses[:10])
+    assert len(set(created)) == 10
+    assert statuses == [HTTPStatus.CREATED] + [HTTPStatus.BAD_REQUEST] * 4
+
+
+def test_create_items_bulk_ndjson():
+    body = b"\n".join(
+        [
+            b'{"id": 601, "name": "Bulk", "price": "1.10", "tax": "0.05"}',
+            b'{"id": 602, "name": "Bulk", "price": "-1"}',
+            b"",
+            b"{not json",
+            b'{"id": 2, "name": "Dup", "price": "1"}',
+            b'{"name": "No id", "price": "3.333"}',
+        ]
+    )
+    resp = test_client.post(
+        "/items/bulk",
+        content=body,
+        headers={"X-Token": "coneofsilence", "Content-Type": "application/x-ndjson"},
+    )
+    results = [json.loads(line) for line in resp.text.splitlines()]
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.headers["x-accepted-count"] == "2"
+    assert resp.headers["x-rejected-count"] == "3"
+    assert [result["row"] for result in results] == [1, 2, 3, 4, 5]
+    assert [result["status"] for result in results] == [
+        "accepted",
+        "rejected",
+        "rejected",
+        "rejected",
+        "accepted",
+    ]
+    assert results[0]["item"]["price_with_tax"] == "1.15"
+    assert results[1]["errors"][0]["loc"] == ["price"]
+    assert results[2]["errors"][0]["type"] == "json_invalid"
+    assert results[3]["errors"][0]["msg"] == "Item already exists"
+    assert results[4]["item"]["price"] == "3.333"
+
+    resp = test_client.get(
+        "/items/601", params={"needy": "x"}, headers={"X-Token": "coneofsilence"}
+    )
+
+    assert resp.json()["item"]["tax"] == "0.05"
+
+
+def test_create_items_bulk_json_array():
+    resp = test_client.post(
+        "/items/bulk",
+        json=[
+            {"id": 611, "name": "Array", "price": 2.675},
+            {"id": 611, "name": "Again", "price": "1"},
+        ],
+        headers={"X-Token": "coneofsilence"},
+    )
+    results = [json.loads(line) for line in resp.text.splitlines()]
+
+    assert resp.status_code == HTTPStatus.OK
+    assert results[0]["item"]["price"] == "2.675"
+    assert results[1]["status"] == "rejected"
+
+
+def test_create_items_bulk_malformed_array():
+    resp = test_client.post(
+        "/items/bulk",
+        content=b'[{"id": 621, "name": "Ok", "price": "1"} {"id": 622}]',
+        headers={"X-Token": "coneofsilence", "Content-Type": "application/json"},
+    )
+    results = [json.loads(line) for line in resp.text.splitlines()]
+
+    assert [result["status"] for result in results] == ["accepted", "rejected"]
+    assert results[1]["errors"][0]["type"] == "malformed_row"
+
+
+def test_create_items_bulk_invalid_token():
+    resp = test_client.post(
+        "/items/bulk", content=b"{}", headers={"X-Token": "hailhydra"}
+    )
+
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
+
+
 def test_update_item():
     resp = test_client.put(
         "/item/1",
@@ -236,6 +541,18 @@ def test_get_model(name: str):
     assert resp.json()["model_name"] == name
 
 
+def test_get_model_predicts_for_x():
+    resp = test_client.get("/model/lenet", params={"x": [0.5] * 32})
+
+    assert resp.status_code == HTTPStatus.OK
+    assert 0 <= resp.json()["label"] < 10
+    assert 0 < resp.json()["score"] <= 1
+
+    resp = test_client.get("/model/lenet", params={"x": [0.5] * 3})
+
+    assert resp.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
 @pytest.mark.parametrize("name", ["mock_name"])
 def test_get_model_invalid_model(name: str):
     resp = test_client.get(f"/model/{name}")
@@ -257,6 +574,101 @@ def test_create_multiple_images():
     assert resp.json()[0] == {"url": "http://127.0.0.1/1.png", "name": "img1"}
 
 
+def test_create_multiple_images_streams_many_with_repeated_urls():
+    images = [
+        {"url": f"https://cdn.example.org/{n % 3}.png", "name": f"img{n}"}
+        for n in range(1200)
+    ]
+
+    resp = test_client.post("/images/multiple/", json=images)
+
+    assert resp.status_code == HTTPStatus.CREATED
+    assert resp.json() == images
+
+
+@pytest.mark.parametrize("images", [[], [{"url": "https://example.org", "name": "a"}]])
+def test_create_multiple_images_echoes_normalized_urls(images: list):
+    resp = test_client.post("/images/multiple/", json=images)
+
+    assert resp.status_code == HTTPStatus.CREATED
+    assert resp.json() == [{**image, "url": image["url"] + "/"} for image in images]
+
+
+def test_image_urls_are_validated_once_while_cached(monkeypatch):
+    monkeypatch.setattr(main, "image_urls", OrderedDict())
+    monkeypatch.setattr(main, "IMAGE_URL_CACHE_SIZE", 2)
+    first = Image(url="https://example.org/1.png", name="a")
+
+    assert Image(url="https://example.org/1.png", name="b").url is first.url
+
+    for n in range(2, 5):
+        Image(url=f"https://example.org/{n}.png", name="c")
+
+    assert list(main.image_urls) == [
+        "https://example.org/3.png",
+        "https://example.org/4.png",
+    ]
+
+
+def test_image_urls_evict_the_least_recently_used(monkeypatch):
+    monkeypatch.setattr(main, "image_urls", OrderedDict())
+    monkeypatch.setattr(main, "IMAGE_URL_CACHE_SIZE", 2)
+    first = Image(url="https://example.org/1.png", name="a")
+    Image(url="https://example.org/2.png", name="b")
+    Image(url="https://example.org/1.png", name="c")
+    Image(url="https://example.org/3.png", name="d")
+
+    assert list(main.image_urls) == [
+        "https://example.org/1.png",
+        "https://example.org/3.png",
+    ]
+    assert Image(url="https://example.org/1.png", name="e").url is first.url
+
+
+def test_image_urls_are_not_cached_with_a_cache_size_of_zero(monkeypatch):
+    monkeypatch.setattr(main, "image_urls", OrderedDict())
+    monkeypatch.setattr(main, "IMAGE_URL_CACHE_SIZE", 0)
+
+    resp = test_client.post(
+        "/item",
+        headers={"X-Token": "coneofsilence"},
+        json={
+            "id": 701,
+            "name": "Framed",
+            "price": "1",
+            "images": [{"url": "https://example.org/1.png", "name": "a"}],
+        },
+    )
+
+    assert resp.status_code == HTTPStatus.CREATED
+    assert not main.image_urls
+
+
+def test_create_multiple_images_rejects_invalid_elements():
+    resp = test_client.post(
+        "/images/multiple/",
+        json=[{"url": "http://127.0.0.1/1.png", "name": "img1"}] * 600
+        + [{"url": "not a url", "name": "img2"}, {"url": "http://127.0.0.1/3.png"}],
+    )
+
+    assert resp.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert [error["loc"] for error in resp.json()["detail"]] == [
+        ["body", 600, "url"],
+        ["body", 601, "name"],
+    ]
+
+
+def test_create_multiple_images_rejects_malformed_json():
+    resp = test_client.post(
+        "/images/multiple/",
+        content=b'[{"url": "http://127.0.0.1/1.png", "name": "img1"}, {',
+        headers={"Content-Type": "application/json"},
+    )
+
+    assert resp.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert resp.json()["detail"][0]["type"] == "json_invalid"
+
+
 def test_create_index_weights():
     resp = test_client.post(
         "/index-weights/",
@@ -287,7 +699,47 @@ def test_create_index_weights_with_alphabetic():
     assert resp.json()["detail"]
 
 
-@pytest.mark.skip("temporarily skip this due to UUID serialization issue")
+def test_index_weights_queries():
+    resp = test_client.post(
+        "/index-weights/", json={"1000": "1.5", "1001": 2.5, "1002": "-1"}
+    )
+
+    assert resp.status_code == HTTPStatus.CREATED
+    # The accepted body is echoed as it was sent
+    assert resp.json() == {"1000": "1.5", "1001": 2.5, "1002": "-1"}
+
+    params = {"start": 1000, "stop": 1002}
+
+    assert test_client.get("/index-weights/sum", params=params).json() == {
+        "count": 2,
+        "sum": "4",
+    }
+    assert test_client.get("/index-weights/normalized", params=params).json() == {
+        "1000": "0.375",
+        "1001": "0.625",
+    }
+    assert test_client.get("/index-weights/range", params=params).json() == {
+        "1000": "1.5",
+        "1001": "2.5",
+    }
+    assert test_client.get("/index-weights/top", params={"k": 1}).json()[0]["weight"]
+
+
+def test_create_index_weights_rejects_inexact_weights():
+    resp = test_client.post("/index-weights/", json={"0": "0.1234567"})
+
+    assert resp.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_openapi_documents_index_weights_bodies():
+    operation = app.openapi()["paths"]["/index-weights/"]["post"]
+    request_schema = operation["requestBody"]["content"]["application/json"]
+    response = operation["responses"]["201"]["content"]["application/json"]
+
+    assert request_schema["schema"]["type"] == "object"
+    assert response["schema"]["additionalProperties"]["type"] == "string"
+
+
 def test_create_event():
     resp = test_client.post(
         "/event/ad6ac861-e46d-46f5-abe9-1aef94155f5b",
@@ -304,6 +756,76 @@ def test_create_event():
     assert resp.json()["duration"]
 
 
+def test_create_event_without_body_schedules_it_now():
+    event_id = "3f2b8e0a-6a47-4a8e-9d1c-0d6f2f0b1c11"
+    resp = test_client.post(f"/event/{event_id}", json={})
+
+    assert resp.status_code == HTTPStatus.CREATED
+    assert resp.json()["duration"] is None
+    assert resp.json()["next_run"]
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        ("2030-01-01T00:00:00", "2030-01-01T02:00:00+01:00"),
+        ("2030-01-01T00:00:00+01:00", "2030-01-01T00:00:00"),
+        ("2030-01-01T00:00:00", "2030-01-01T01:00:00"),
+    ],
+)
+def test_create_event_with_naive_and_aware_datetimes(start: str, end: str):
+    resp = test_client.post(
+        "/event/5c0e7d52-93a1-4b7e-8f3e-2a6d1b9c4e70",
+        json={"start_datetime": start, "end_datetime": end},
+    )
+
+    assert resp.status_code == HTTPStatus.CREATED
+    assert resp.json()["duration"] == "PT1H"
+
+
+def test_create_event_with_only_a_naive_end():
+    resp = test_client.post(
+        "/event/0b7c9e2d-4f61-4a3b-9d8e-6c5a4b3f2e10",
+        json={"end_datetime": "2999-01-01T00:00:00"},
+    )
+
+    assert resp.status_code == HTTPStatus.CREATED
+    assert not resp.json()["duration"].startswith("-")
+
+
+def test_read_and_cancel_event():
+    event_id = "9a1f0c3e-2b4d-4e6f-8a0b-1c2d3e4f5a6b"
+    resp = test_client.post(
+        f"/event/{event_id}",
+        json={"start_datetime": "2999-01-01T00:00:00+00:00", "repeat_at": "12:00:00"},
+    )
+
+    assert resp.status_code == HTTPStatus.CREATED
+
+    resp = test_client.get(f"/event/{event_id}")
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json()["next_run"] == "2999-01-01T00:00:00Z"
+    assert resp.json()["runs"] == 0
+
+    assert test_client.delete(f"/event/{event_id}").status_code == HTTPStatus.NO_CONTENT
+    assert test_client.get(f"/event/{event_id}").status_code == HTTPStatus.NOT_FOUND
+    assert test_client.delete(f"/event/{event_id}").status_code == HTTPStatus.NOT_FOUND
+
+
+def test_disabled_events(monkeypatch):
+    monkeypatch.setattr(main, "EVENTS_ENABLED", False)
+    event_id = "7d3c2b1a-0f9e-4d8c-b7a6-5f4e3d2c1b0a"
+
+    for method in ("POST", "GET", "DELETE"):
+        resp = test_client.request(method, f"/event/{event_id}", json={})
+
+        assert resp.status_code == HTTPStatus.NOT_FOUND
+        assert resp.json() == {"detail": "Events are disabled"}
+
+    assert main.event_scheduler.get(UUID(event_id)) is None
+
+
 def test_create_event_invalid_request():
     resp = test_client.post(
         "/event/123456",
@@ -364,7 +886,21 @@ def test_login():
 
     assert resp.status_code == HTTPStatus.OK
     assert resp.json()["username"] == "joeblogs"
-    assert resp.json()["password_hash"] != "Passw0rd"
+    assert resp.json()["password_hash"].startswith("scrypt$")
+
+
+def test_login_when_password_hasher_is_busy(monkeypatch):
+    hasher = main.PasswordHasher(workers=1, max_queue=0)
+    hasher.pending = 1
+    monkeypatch.setattr(main, "password_hasher", hasher)
+
+    resp = test_client.post(
+        "/login/", data={"username": "joeblogs", "password": "Passw0rd"}
+    )
+
+    assert resp.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert resp.headers["retry-after"] == "1"
+    assert test_client.get("/stats/password-hasher").json()["rejected"] == 1
 
 
 def test_create_file():
@@ -379,10 +915,21 @@ def test_create_file():
 
     assert resp.status_code == HTTPStatus.OK
     assert resp.json()["file_size"] == len(b"hello\nworld\n")
+    assert resp.json()["file_sha256"] == hashlib.sha256(b"hello\nworld\n").hexdigest()
     assert resp.json()["fileb_name"] == "dummy2.txt"
     assert resp.json()["token"] == "abcdef"
 
 
+def test_create_file_larger_than_spool_threshold():
+    content = os.urandom(3 * 1024 * 1024 + 17)
+    resp = test_client.post("/file/", files=[("file", ("big.bin", content))])
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json()["file_size"] == len(content)
+    assert resp.json()["file_sha256"] == hashlib.sha256(content).hexdigest()
+    assert resp.json()["fileb_name"] is None
+
+
 def test_create_file_with_no_file():
     resp = test_client.post("/file/")
 
@@ -390,6 +937,13 @@ def test_create_file_with_no_file():
     assert resp.json()["message"] == "No file sent"
 
 
+def test_create_file_with_an_empty_file():
+    resp = test_client.post("/file/", files={"file": ("empty.txt", b"")})
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json() == {"message": "No file sent"}
+
+
 def test_create_files():
     resp = test_client.post(
         "/files/",
@@ -404,15 +958,31 @@ def test_create_files():
         len(b"hello\nworld\n"),
         len(b"use\npython\n"),
     ]
+    assert resp.json()["file_sha256s"] == [
+        hashlib.sha256(b"hello\nworld\n").hexdigest(),
+        hashlib.sha256(b"use\npython\n").hexdigest(),
+    ]
 
 
-def test_create_upload_file():
+# blob_store is a fixture from conftest.py
+def test_create_upload_file(blob_store):
     resp = test_client.post(
         "/uploadfile/", files={"file": ("dummy.txt", b"hello\nworld\n")}
     )
+    sha256 = hashlib.sha256(b"hello\nworld\n").hexdigest()
 
     assert resp.status_code == HTTPStatus.OK
     assert resp.json()["filename"] == "dummy.txt"
+    assert resp.json()["sha256"] == sha256
+    assert resp.json()["size"] == len(b"hello\nworld\n")
+    assert resp.json()["deduplicated"] is False
+    assert blob_store.path_for(sha256).read_bytes() == b"hello\nworld\n"
+
+    resp = test_client.post(
+        "/uploadfile/", files={"file": ("again.txt", b"hello\nworld\n")}
+    )
+
+    assert resp.json()["deduplicated"] is True
 
 
 def test_create_upload_file_with_no_file():
@@ -422,7 +992,15 @@ def test_create_upload_file_with_no_file():
     assert resp.json()["message"] == "No upload file sent"
 
 
-def test_create_upload_files():
+def test_create_upload_file_with_an_empty_file(blob_store):
+    resp = test_client.post("/uploadfile/", files={"file": ("empty.txt", b"")})
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.json() == {"message": "No upload file sent"}
+    assert not any(blob_store.root.rglob("*"))
+
+
+def test_create_upload_files(blob_store):
     resp = test_client.post(
         "/uploadfiles/",
         files=[
@@ -433,6 +1011,112 @@ def test_create_upload_files():
 
     assert resp.status_code == HTTPStatus.OK
     assert resp.json()["filenames"] == ["dummy1.txt", "dummy2.txt"]
+    assert [file["sha256"] for file in resp.json()["files"]] == [
+        hashlib.sha256(b"hello\nworld\n").hexdigest(),
+        hashlib.sha256(b"use\npython\n").hexdigest(),
+    ]
+
+
+def test_create_upload_files_large_and_duplicated(blob_store):
+    content = os.urandom(2 * 1024 * 1024 + 3)
+    resp = test_client.post(
+        "/uploadfiles/",
+        files=[("files", ("a.bin", content)), ("files", ("b.bin", content))],
+    )
+    files = resp.json()["files"]
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    assert resp.status_code == HTTPStatus.OK
+    assert {file["sha256"] for file in files} == {sha256}
+    assert sorted(file["deduplicated"] for file in files) == [False, True]
+    assert blob_store.path_for(sha256).read_bytes() == content
+
+
+def test_read_blob(blob_store):
+    content = os.urandom(200_000)
+    sha256 = test_client.post(
+        "/uploadfile/", files={"file": ("blob.bin", content)}
+    ).json()["sha256"]
+
+    resp = test_client.get(f"/blobs/{sha256}")
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.content == content
+    assert resp.headers["etag"] == f'"{sha256}"'
+    assert resp.headers["accept-ranges"] == "bytes"
+
+    resp = test_client.head(f"/blobs/{sha256}")
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.headers["content-length"] == str(len(content))
+
+    resp = test_client.get(f"/blobs/{sha256}", headers={"If-None-Match": f'"{sha256}"'})
+
+    assert resp.status_code == HTTPStatus.NOT_MODIFIED
+    assert resp.content == b""
+
+
+def test_read_blob_range(blob_store):
+    content = os.urandom(100_000)
+    sha256 = test_client.post(
+        "/uploadfile/", files={"file": ("blob.bin", content)}
+    ).json()["sha256"]
+
+    resp = test_client.get(f"/blobs/{sha256}", headers={"Range": "bytes=10-19"})
+
+    assert resp.status_code == HTTPStatus.PARTIAL_CONTENT
+    assert resp.content == content[10:20]
+    assert resp.headers["content-range"] == f"bytes 10-19/{len(content)}"
+
+    resp = test_client.get(
+        f"/blobs/{sha256}",
+        headers={"Range": "bytes=-5", "If-Range": f'"{sha256}"'},
+    )
+
+    assert resp.status_code == HTTPStatus.PARTIAL_CONTENT
+    assert resp.content == content[-5:]
+
+    resp = test_client.get(
+        f"/blobs/{sha256}", headers={"Range": "bytes=0-4", "If-Range": '"other"'}
+    )
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.content == content
+
+
+def test_read_blob_not_found(blob_store):
+    resp = test_client.get(f"/blobs/{'0' * 64}")
+
+    assert resp.status_code == HTTPStatus.NOT_FOUND
+
+    resp = test_client.get("/blobs/not-a-digest")
+
+    assert resp.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_metrics_by_route_template():
+    headers = {"X-Token": "coneofsilence"}
+    test_client.get("/items/1", params={"needy": "m"}, headers=headers)
+    test_client.get("/item/1", params={"needy": "m"}, headers=headers)
+    test_client.get("/item/1", params={"needy": "m"}, headers={"X-Token": "no"})
+
+    resp = test_client.get("/metrics")
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert (
+        'http_requests_total{method="GET",route="/items/{item_id}",status="200"}'
+        in resp.text
+    )
+    assert (
+        'http_requests_total{method="GET",route="/item/{item_id}",status="200"}'
+        in resp.text
+    )
+    assert 'route="unrouted",status="400"' in resp.text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/item' in (
+        resp.text
+    )
+    assert "http_requests_in_progress 1" in resp.text
 
 
 def test_read_unicorn():
@@ -448,3 +1132,67 @@ def test_read_unicorn_should_return_418():
     assert resp.status_code == HTTPStatus.IM_A_TEAPOT
     assert "unicorn" not in resp.json()
     assert "yolo" in resp.json()["message"]
+
+
+def test_metrics_are_flushed_at_shutdown(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.REGISTRY, "multiprocess_dir", tmp_path)
+    # No periodic flush: only the one at shutdown writes the file
+    monkeypatch.setattr(main.REGISTRY, "flush_interval", math.inf)
+
+    with TestClient(app=app) as client:
+        client.get("/")
+
+        assert not list(tmp_path.glob("metrics-*.json"))
+
+    snapshot = json.loads((tmp_path / f"metrics-{os.getpid()}.json").read_text())
+    routes = [labels for labels, _ in snapshot["http_requests_total"]]
+
+    assert ["GET", "/", "200"] in routes
+
+
+def test_failed_startup_restores_the_threadpool_wait_timer(tmp_path, monkeypatch):
+    monkeypatch.setenv("ITEM_DB_PATH", str(tmp_path / "missing" / "items.db"))
+    run_sync = anyio.to_thread.run_sync
+
+    with pytest.raises(sqlite3.OperationalError):
+        with TestClient(app=app):
+            pass
+
+    assert anyio.to_thread.run_sync is run_sync
+
+
+def test_openapi_operation_ids_are_unique():
+    operation_ids = [
+        operation["operationId"]
+        for path in app.openapi()["paths"].values()
+        for operation in path.values()
+    ]
+
+    assert len(operation_ids) == len(set(operation_ids))
+
+
+def test_openapi_documents_x_token_on_protected_routes():
+    paths = app.openapi()["paths"]
+    protected = list(TokenProtectedRoutes(app.routes))
+
+    assert ("POST", "/items/bulk") in protected
+    assert ("GET", "/items/{item_id}") in protected
+
+    for method, path in protected:
+        assert paths[path][method.lower()]["security"] == [{"APIKeyHeader": []}]
+
+    for path, operations in paths.items():
+        for method, operation in operations.items():
+            if (method.upper(), path) not in protected:
+                assert "security" not in operation
+
+
+@pytest.mark.parametrize(
+    "method, path",
+    [("GET", "/items/batch"), ("POST", "/items/batch"), ("GET", "/item/1")],
+)
+def test_routes_with_the_token_dependency_are_guarded(method: str, path: str):
+    resp = test_client.request(method, path, headers={"X-Token": "hailhydra"})
+
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
+    assert resp.headers["X-Error"] == "token"
@@ -0,0 +1,216 @@
+"""
+Peak memory of payload-heavy endpoints, checked against declared budgets.
+
+Each request is sent straight to the ASGI app with its body prepared in
+advance, so `tracemalloc` only sees what the server allocates to handle it.
+Every endpoint is measured at several payload sizes: a budget of the form
+`fixed + per_unit * units` is what catches memory that grows with the payload
+where it should stay flat.
+"""
+
+import json
+import os
+import tracemalloc
+from typing import NamedTuple
+
+import anyio
+import pytest
+
+import main
+from item_snapshot import SnapshotStore
+from main import FAKE_SECRET_TOKEN, app
+
+MiB = 1024 * 1024
+RECEIVE_CHUNK_SIZE = 64 * 1024
+BOUNDARY = "memory-budget-boundary"
+
+
+class Budget(NamedTuple):
+    fixed: int
+    per_unit: int = 0
+
+    def limit(self, units: int) -> int:
+        return self.fixed + self.per_unit * units
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def peak_memory(
+    method: str, path: str, body: bytes, headers: list[tuple[bytes, bytes]]
+) -> tuple[int, int]:
+    """Status and peak traced bytes of serving one request with `body`."""
+    chunks = [
+        body[offset : offset + RECEIVE_CHUNK_SIZE]
+        for offset in range(0, len(body), RECEIVE_CHUNK_SIZE)
+    ]
+    chunks.reverse()
+    status = 0
+    body_sent = False
+    response_complete = anyio.Event()
+
+    async def receive() -> dict:
+        nonlocal body_sent
+
+        if chunks:
+            return {"type": "http.request", "body": chunks.pop(), "more_body": True}
+
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        nonlocal status
+
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get(
+            "more_body", False
+        ):
+            response_complete.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"testserver"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+        "client": ("127.0.0.1", 12345),
+        "server": ("testserver", 80),
+    }
+    # Warm up once so that lazily built state (routes, validators) is not counted
+    await app(dict(scope), receive, send)
+    chunks = [
+        body[offset : offset + RECEIVE_CHUNK_SIZE]
+        for offset in range(0, len(body), RECEIVE_CHUNK_SIZE)
+    ]
+    chunks.reverse()
+    body_sent = False
+    response_complete = anyio.Event()
+    tracemalloc.start()
+
+    try:
+        await app(scope, receive, send)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return status, peak
+
+
+def multipart(files: list[tuple[str, bytes]]) -> tuple[bytes, bytes]:
+    parts = [
+        (
+            f"--{BOUNDARY}\r\nContent-Disposition: form-data; "
+            f'name="{name}"; filename="{name}.bin"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        + content
+        + b"\r\n"
+        for name, content in files
+    ]
+    body = b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+    return body, f"multipart/form-data; boundary={BOUNDARY}".encode()
+
+
+JSON = [(b"content-type", b"application/json")]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("size", [2 * MiB, 8 * MiB, 32 * MiB])
+async def test_file_upload_memory_is_flat(size, blob_store):
+    body, content_type = multipart([("file", os.urandom(size))])
+
+    status, peak = await peak_memory(
+        "POST", "/file/", body, [(b"content-type", content_type)]
+    )
+
+    assert status == 200
+    assert peak < Budget(fixed=3 * MiB).limit(size)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("size", [2 * MiB, 8 * MiB])
+async def test_files_upload_memory_is_flat(size, blob_store):
+    body, content_type = multipart([("files", os.urandom(size)) for _ in range(4)])
+
+    status, peak = await peak_memory(
+        "POST", "/files/", body, [(b"content-type", content_type)]
+    )
+
+    assert status == 200
+    assert peak < Budget(fixed=3 * MiB).limit(size)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("size", [2 * MiB, 8 * MiB, 32 * MiB])
+async def test_uploadfile_memory_is_flat(size, blob_store):
+    body, content_type = multipart([("file", os.urandom(size))])
+
+    status, peak = await peak_memory(
+        "POST", "/uploadfile/", body, [(b"content-type", content_type)]
+    )
+
+    assert status == 200
+    assert peak < Budget(fixed=3 * MiB).limit(size)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("rows", [1_000, 5_000, 20_000])
+async def test_bulk_ingest_memory_is_flat(rows, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "item_snapshots", SnapshotStore(str(tmp_path)))
+    main.item_snapshots.seed({})
+    body = b"".join(
+        json.dumps({"name": f"bulk{row}", "price": "1.50"}).encode() + b"\n"
+        for row in range(rows)
+    )
+
+    status, peak = await peak_memory(
+        "POST", "/items/bulk", body, [(b"x-token", FAKE_SECRET_TOKEN.encode())]
+    )
+
+    assert status == 200
+    # The stored items themselves grow with the body, everything else must not
+    assert peak < Budget(fixed=4 * MiB, per_unit=800).limit(rows)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("images", [1_000, 10_000, 50_000])
+async def test_images_memory_per_image(images):
+    body = json.dumps(
+        [
+            {"url": f"https://example.org/images/{n}.png", "name": f"image {n}"}
+            for n in range(images)
+        ]
+    ).encode()
+
+    status, peak = await peak_memory("POST", "/images/multiple/", body, JSON)
+
+    assert status == 201
+    assert peak < Budget(fixed=5 * MiB).limit(images)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("weights", [1_000, 10_000, 100_000])
+async def test_index_weights_memory_per_weight(weights):
+    body = json.dumps({str(n): f"{n}.25" for n in range(weights)}).encode()
+
+    status, peak = await peak_memory("POST", "/index-weights/", body, JSON)
+
+    assert status == 201
+    assert peak < Budget(fixed=MiB, per_unit=300).limit(weights)
@@ -0,0 +1,117 @@
+import json
+import math
+import os
+
+import pytest
+
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_counter_render_escapes_labels():
+    counter = Counter("hits_total", "Hits.", ("path",))
+    counter.inc(labels=('a"b\\c',))
+    counter.inc(2, labels=('a"b\\c',))
+    total = {}
+    counter.merge(total, counter.snapshot())
+
+    assert counter.render(total)[2] == 'hits_total{path="a\\"b\\\\c"} 3'
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+
+    total = {}
+    histogram.merge(total, histogram.snapshot())
+
+    assert histogram.render(total)[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 5.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_gauge_function():
+    gauge = Gauge("depth", "Depth.", function=lambda: 7)
+
+    assert gauge.snapshot() == [[[], 7.0]]
+
+
+def test_register_twice_fails():
+    registry = Registry()
+    registry.counter("a_total", "A.")
+
+    with pytest.raises(ValueError):
+        registry.counter("a_total", "A.")
+
+
+def test_multiprocess_aggregation(tmp_path):
+    registry = Registry(multiprocess_dir=str(tmp_path))
+    requests = registry.counter("requests_total", "Requests.", ("route",))
+    in_flight = registry.gauge("in_flight", "In flight.")
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(1.0,))
+    requests.inc(labels=("/a",))
+    in_flight.inc()
+    latency.observe(0.5)
+
+    # A worker that has exited: its counters still count, its gauges do not.
+    dead_pid = 2**22 + 12345
+    (tmp_path / f"metrics-{dead_pid}.json").write_text(
+        json.dumps(
+            {
+                "requests_total": [[["/a"], 2.0], [["/b"], 1.0]],
+                "in_flight": [[[], 5.0]],
+                "latency_seconds": [[[], [0.0, 1.0, 3.0]]],
+            }
+        )
+    )
+    text = registry.render()
+
+    assert 'requests_total{route="/a"} 3' in text
+    assert 'requests_total{route="/b"} 1' in text
+    assert "in_flight 1" in text
+    assert "latency_seconds_count 2" in text
+    assert "latency_seconds_sum 3.5" in text
+    assert any(path.name.startswith("metrics-") for path in tmp_path.iterdir())
+
+
+def test_render_single_process():
+    registry = Registry()
+    registry.gauge("temperature", "Temperature.").set(-math.inf)
+
+    assert "temperature -Inf" in registry.render()
+
+
+def test_exited_processes_are_folded_into_one_file(tmp_path):
+    registry = Registry(multiprocess_dir=str(tmp_path))
+    registry.counter("requests_total", "Requests.", ("route",)).inc(labels=("/a",))
+    registry.gauge("in_flight", "In flight.")
+    registry.histogram("latency_seconds", "Latency.", buckets=(1.0,))
+
+    for dead_pid in (2**22 + 12345, 2**22 + 12346):
+        (tmp_path / f"metrics-{dead_pid}.json").write_text(
+            json.dumps(
+                {
+                    "requests_total": [[["/a"], 2.0]],
+                    "in_flight": [[[], 5.0]],
+                    "latency_seconds": [[[], [1.0, 0.0, 0.5]]],
+                }
+            )
+        )
+
+    first = registry.render()
+    second = registry.render()
+
+    assert first == second
+    assert 'requests_total{route="/a"} 5' in first
+    assert "in_flight 0" not in first and "in_flight 5" not in first
+    assert "latency_seconds_count 2" in first
+    assert {path.name for path in tmp_path.glob("metrics-*.json")} == {
+        "metrics-exited.json",
+        f"metrics-{os.getpid()}.json",
+    }
+    assert "in_flight" not in json.loads((tmp_path / "metrics-exited.json").read_text())
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from passwords import (
+    HasherBusy,
+    PasswordHasher,
+    ScryptParams,
+    check_password,
+    hash_password,
+)
+
+# Cheap parameters: these tests are about the hasher, not scrypt's cost
+FAST = ScryptParams(n=2**4, r=1)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def test_hashes_are_salted_and_checkable():
+    first, second = hash_password("P@ssw0rd", FAST), hash_password("P@ssw0rd", FAST)
+
+    assert first != second
+    assert first.startswith("scrypt$16$1$1$")
+    assert check_password("P@ssw0rd", first)
+    assert not check_password("Passw0rd", first)
+
+
+@pytest.mark.parametrize(
+    "hashed",
+    ["supersecretP@ssw0rd", "scrypt$16$1$1$c2FsdA==", "scrypt$3$1$1$AA==$AA=="],
+)
+def test_check_rejects_malformed_hashes(hashed: str):
+    assert not check_password("P@ssw0rd", hashed)
+
+
+def test_hashes_checked_with_their_own_parameters():
+    hashed = hash_password("P@ssw0rd", ScryptParams(n=2**5, r=2, p=2, key_size=16))
+
+    assert check_password("P@ssw0rd", hashed)
+
+
+@pytest.mark.anyio
+async def test_hasher_hashes_off_the_event_loop():
+    hasher = PasswordHasher(FAST, workers=2)
+
+    try:
+        hashed = await hasher.hash("P@ssw0rd")
+
+        assert await hasher.check("P@ssw0rd", hashed)
+        assert hasher.stats()["running"] == 0
+    finally:
+        hasher.close()
+
+
+@pytest.mark.anyio
+async def test_hasher_refuses_calls_beyond_its_queue():
+    hasher = PasswordHasher(ScryptParams(n=2**14), workers=1, max_queue=1)
+
+    try:
+        results = await asyncio.gather(
+            *(hasher.hash("P@ssw0rd") for _ in range(3)), return_exceptions=True
+        )
+    finally:
+        hasher.close()
+
+    assert [type(result) for result in results[:2]] == [str, str]
+    assert isinstance(results[2], HasherBusy)
+    assert hasher.stats() == {
+        "workers": 1,
+        "running": 0,
+        "queued": 0,
+        "max_queue": 1,
+        "rejected": 1,
+    }
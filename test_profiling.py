@@ -0,0 +1,76 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from profiling import CAPTURE_HEADER, RequestProfilerMiddleware
+
+TOKEN = "profile-me"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def make_client(directory, **kwargs) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(RequestProfilerMiddleware, directory=str(directory), **kwargs)
+
+    @app.put("/item/{item_id}")
+    def update_item(item_id: int, q: str = ""):
+        return {"item_id": item_id, "blob": "x" * 100_000, "q": q}
+
+    return TestClient(app)
+
+
+def test_trigger_header(tmp_path):
+    client = make_client(tmp_path, token=TOKEN)
+
+    assert CAPTURE_HEADER.lower() not in client.put("/item/1").headers
+    assert CAPTURE_HEADER.lower() not in (
+        client.put("/item/1", headers={"X-Profile": "wrong"}).headers
+    )
+
+    response = client.put("/item/7?q=hi", headers={"X-Profile": TOKEN})
+
+    assert response.status_code == 200
+    name = response.headers[CAPTURE_HEADER]
+    assert (tmp_path / f"{name}.bin").stat().st_size > 0
+    metadata = json.loads((tmp_path / f"{name}.json").read_text())
+    assert metadata["method"] == "PUT"
+    assert metadata["route"] == "/item/{item_id}"
+    assert metadata["path_params"] == {"item_id": "7"}
+    assert metadata["query_params"] == [["q", "hi"]]
+    assert metadata["status"] == 200
+
+
+def test_sampling_and_rotation(tmp_path):
+    client = make_client(tmp_path, sample_rate=2, keep=2)
+    names = []
+
+    for _ in range(8):
+        names.append(client.put("/item/1").headers.get(CAPTURE_HEADER))
+
+    assert names[0::2] == [None] * 4
+    assert None not in names[1::2]
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        f"{name}{suffix}" for name in names[-3::2] for suffix in (".bin", ".json")
+    )
+
+
+@pytest.mark.anyio
+async def test_skips_while_a_tracker_is_active(tmp_path):
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(middleware._active)
+
+    middleware = RequestProfilerMiddleware(app, str(tmp_path), sample_rate=1)
+    middleware._active = True
+
+    await middleware({"type": "http", "headers": []}, None, None)
+
+    assert calls == [True]
+    assert not list(tmp_path.iterdir())
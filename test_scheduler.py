@@ -0,0 +1,110 @@
+import asyncio
+import random
+from datetime import datetime, time, timedelta, timezone
+
+import pytest
+
+from scheduler import EventScheduler, ScheduledEvent, TimerWheel
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def test_timers_fire_in_their_tick_across_levels():
+    rng = random.Random(7)  # noqa: S311
+    wheel = TimerWheel(resolution=1, start=3, bits=2, levels=3)
+    deadlines: dict[int, int] = {}
+
+    for tick in range(4, 400):
+        # Added while time moves on, due from the next tick to past the span
+        # of the top level, which holds 4**3 ticks
+        for _ in range(rng.randrange(4)):
+            key = len(deadlines)
+            deadlines[key] = tick - 1 + rng.randrange(1, 150)
+            wheel.add(key, deadlines[key], key)
+
+        fired = sorted(wheel.advance(tick))
+
+        assert fired == [key for key, due in deadlines.items() if due == tick]
+
+    assert len(wheel) == sum(due >= 400 for due in deadlines.values())
+
+
+def test_cancelled_and_replaced_timers():
+    wheel = TimerWheel(resolution=1)
+    wheel.add("a", 5, "first")
+    wheel.add("b", 5, "b")
+    wheel.add("a", 10, "second")
+
+    assert wheel.cancel("b")
+    assert not wheel.cancel("b")
+    assert wheel.get("a") == "second"
+    assert list(wheel.advance(9)) == []
+    assert list(wheel.advance(10)) == ["second"]
+
+
+def test_past_deadlines_fire_on_the_next_tick():
+    wheel = TimerWheel(resolution=1, start=100)
+    wheel.add("late", 3)
+
+    assert list(wheel.advance(101)) == [None]
+
+
+def test_daily_repeats_until_the_end():
+    event = ScheduledEvent(
+        "e",
+        datetime(2022, 1, 1, 9, 15, tzinfo=timezone.utc),
+        repeat_at=time(12, 0),
+        end_datetime=datetime(2022, 1, 2, 18, 0, tzinfo=timezone.utc),
+    )
+
+    assert event.following_run() == datetime(2022, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+    event.next_run = event.following_run()
+
+    assert event.following_run() == datetime(2022, 1, 2, 12, 0, tzinfo=timezone.utc)
+
+    event.next_run = event.following_run()
+
+    assert event.following_run() is None
+
+
+def test_repeat_at_in_its_own_time_zone():
+    plus_eight = timezone(timedelta(hours=8))
+    event = ScheduledEvent(
+        "e",
+        datetime(2022, 1, 1, 9, 0, tzinfo=timezone.utc),
+        repeat_at=time(12, 0, tzinfo=plus_eight),
+    )
+
+    # 09:00 UTC is 17:00 in UTC+8, past noon there
+    assert event.following_run() == datetime(2022, 1, 2, 12, 0, tzinfo=plus_eight)
+
+
+@pytest.mark.anyio
+async def test_scheduler_runs_due_events_and_skips_cancelled_ones():
+    ran = []
+
+    async def action(event: ScheduledEvent) -> None:
+        ran.append(event.event_id)
+
+    scheduler = EventScheduler(action, resolution=0.005)
+    now = datetime.now(timezone.utc)
+    scheduler.schedule(ScheduledEvent("soon", now + timedelta(seconds=0.02)))
+    scheduler.schedule(ScheduledEvent("cancelled", now + timedelta(seconds=0.02)))
+    scheduler.schedule(ScheduledEvent("later", now + timedelta(hours=1)))
+
+    assert scheduler.cancel("cancelled")
+
+    await asyncio.sleep(0.1)
+
+    assert ran == ["soon"]
+    assert scheduler.get("soon") is None
+    assert scheduler.get("later").runs == 0
+    assert len(scheduler) == 1
+
+    await scheduler.close()
+
+    assert len(scheduler) == 0
@@ -0,0 +1,161 @@
+import os
+import signal
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+import uvicorn
+from uvicorn.supervisors.multiprocess import SIGNALS
+
+import serve
+
+
+async def pid_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": str(os.getpid()).encode()})
+
+
+def test_cgroup_v2_quota(tmp_path):
+    (tmp_path / "cpu.max").write_text("150000 100000\n")
+
+    assert serve.cgroup_cpu_quota(tmp_path) == 1.5
+
+
+def test_cgroup_v2_unlimited(tmp_path):
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+
+    assert serve.cgroup_cpu_quota(tmp_path) is None
+
+
+@pytest.mark.parametrize("quota, expected", [("200000", 2.0), ("-1", None)])
+def test_cgroup_v1_quota(tmp_path, quota, expected):
+    controller = tmp_path / "cpu,cpuacct"
+    controller.mkdir()
+    (controller / "cpu.cfs_quota_us").write_text(f"{quota}\n")
+    (controller / "cpu.cfs_period_us").write_text("100000\n")
+
+    assert serve.cgroup_cpu_quota(tmp_path) == expected
+
+
+def test_no_cgroup(tmp_path):
+    assert serve.cgroup_cpu_quota(tmp_path) is None
+
+
+def test_available_cpus_rounds_quota_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(serve.os, "sched_getaffinity", lambda pid: set(range(8)))
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+
+    assert serve.available_cpus(tmp_path) == 3
+
+    (tmp_path / "cpu.max").write_text("10000 100000\n")
+
+    assert serve.available_cpus(tmp_path) == 1
+
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+
+    assert serve.available_cpus(tmp_path) == 8
+
+
+def test_build_config(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    args = serve.parse_args(
+        ["--max-requests", "1000", "--max-requests-jitter", "100", "--backlog", "64"]
+    )
+    config = serve.build_config(args)
+
+    assert config.workers == 3
+    assert config.limit_max_requests == 1000
+    assert config.limit_max_requests_jitter == 100
+    assert config.backlog == 64
+    assert config.loop in ("uvloop", "asyncio")
+    assert config.http in ("httptools", "h11")
+
+
+def test_best_implementation():
+    assert serve.best_implementation("not_a_real_module", "asyncio") == "asyncio"
+    assert serve.best_implementation("json", "asyncio") == "json"
+
+
+def test_several_workers_refuse_events(monkeypatch):
+    monkeypatch.setenv("EVENTS_ENABLED", "1")
+
+    with pytest.raises(SystemExit):
+        serve.parse_args(["--workers", "2"])
+
+    assert serve.parse_args(["--workers", "1"]).workers == 1
+
+    monkeypatch.setenv("EVENTS_ENABLED", "0")
+
+    assert serve.parse_args(["--workers", "2"]).workers == 2
+
+
+def test_rolling_restart_replaces_every_worker_without_dropping_requests():
+    config = uvicorn.Config(
+        "test_serve:pid_app",
+        host="127.0.0.1",
+        port=0,
+        workers=2,
+        lifespan="off",
+        log_level="warning",
+    )
+    sock = config.bind_socket()
+    url = "http://127.0.0.1:%d/" % sock.getsockname()[1]
+    handlers = {sig: signal.getsignal(sig) for sig in SIGNALS}
+    supervisor = serve.RollingMultiprocess(config, [sock], ready_timeout=30)
+    served: list[int] = []
+    failures: list[Exception] = []
+    done = threading.Event()
+
+    def client() -> None:
+        while not done.is_set():
+            try:
+                with urllib.request.urlopen(url, timeout=10) as resp:  # noqa: S310
+                    served.append(int(resp.read()))
+            except OSError as exc:
+                failures.append(exc)
+
+    try:
+        supervisor.init_processes()
+        old = {process.pid for process in supervisor.processes}
+        deadline = time.monotonic() + 30
+
+        # The socket only listens once a worker has started
+        while True:
+            try:
+                with urllib.request.urlopen(url, timeout=10) as resp:  # noqa: S310
+                    assert int(resp.read()) in old
+                break
+            except urllib.error.URLError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=client)
+        thread.start()
+
+        try:
+            supervisor.restart_all()
+        finally:
+            done.set()
+            thread.join()
+
+        new = {process.pid for process in supervisor.processes}
+
+        assert len(new) == 2
+        assert not new & old
+        assert all(process.is_alive() for process in supervisor.processes)
+        assert served
+        assert not failures
+        assert set(served) <= old | new
+
+        with urllib.request.urlopen(url, timeout=10) as resp:  # noqa: S310
+            assert int(resp.read()) in new
+    finally:
+        supervisor.terminate_all()
+        supervisor.join_all()
+        sock.close()
+
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
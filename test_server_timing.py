@@ -0,0 +1,140 @@
+import logging
+from decimal import Decimal
+
+import fastapi.routing
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from server_timing import (
+    PHASES,
+    ServerTimingMiddleware,
+    format_server_timing,
+    install_phase_timers,
+    uninstall_phase_timers,
+)
+
+
+class Price(BaseModel):
+    amount: Decimal
+
+
+@pytest.fixture
+def phase_timers():
+    originals = {name: getattr(fastapi.routing, name) for name in PHASES.values()}
+    install_phase_timers()
+    yield
+    uninstall_phase_timers()
+
+    for name, func in originals.items():
+        assert getattr(fastapi.routing, name) is func
+
+
+def make_app_with_timing(slowest: int = 0) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(ServerTimingMiddleware, slowest=slowest)
+
+    @app.get("/price/{amount}", response_model=Price)
+    def read_price(amount: Decimal):
+        return {"amount": amount}
+
+    return app
+
+
+def parse(header: str) -> dict[str, float]:
+    phases = {}
+
+    for part in header.split(", "):
+        name, duration = part.split(";dur=")
+        phases[name] = float(duration)
+
+    return phases
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "solve_dependencies_renamed",
+        # Not a coroutine function
+        "get_request_handler",
+        # A coroutine function, but not called by the request handler
+        "run_endpoint_function_elsewhere",
+    ],
+)
+def test_install_refuses_functions_it_cannot_wrap(monkeypatch, name):
+    async def elsewhere():
+        pass
+
+    monkeypatch.setattr(
+        fastapi.routing, "run_endpoint_function_elsewhere", elsewhere, raising=False
+    )
+    monkeypatch.setitem(PHASES, "validate", name)
+    solve_dependencies = fastapi.routing.solve_dependencies
+
+    with pytest.raises(RuntimeError, match=name):
+        install_phase_timers()
+
+    assert fastapi.routing.solve_dependencies is solve_dependencies
+    assert fastapi.routing.run_endpoint_function.__name__ == "run_endpoint_function"
+    assert not hasattr(fastapi.routing.run_endpoint_function, "__wrapped__")
+
+
+def test_format_server_timing():
+    assert (
+        format_server_timing({"handler": 0.0012345, "total": 0.002})
+        == "handler;dur=1.234, total;dur=2.000"
+    )
+
+
+@pytest.mark.usefixtures("phase_timers")
+def test_phases_in_header():
+    client = TestClient(make_app_with_timing())
+
+    response = client.get("/price/2.50")
+
+    assert response.json() == {"amount": "2.50"}
+    phases = parse(response.headers["server-timing"])
+    assert list(phases) == ["validate", "handler", "serialize", "total"]
+    assert sum(phases.values()) - phases["total"] <= phases["total"]
+
+
+@pytest.mark.usefixtures("phase_timers")
+def test_validation_error_has_no_handler_phase():
+    client = TestClient(make_app_with_timing())
+
+    response = client.get("/price/abc")
+
+    assert response.status_code == 422
+    assert list(parse(response.headers["server-timing"])) == ["validate", "total"]
+
+
+def test_total_only_without_phase_timers():
+    client = TestClient(make_app_with_timing())
+
+    response = client.get("/price/1")
+
+    assert list(parse(response.headers["server-timing"])) == ["total"]
+
+
+@pytest.mark.usefixtures("phase_timers")
+def test_slowest_requests_are_logged(caplog):
+    app = make_app_with_timing(slowest=2)
+    client = TestClient(app)
+
+    with caplog.at_level(logging.WARNING, logger="server_timing"):
+        for _ in range(5):
+            client.get("/price/1")
+
+    middleware = app.middleware_stack.app
+
+    while not isinstance(middleware, ServerTimingMiddleware):
+        middleware = middleware.app
+
+    slowest = middleware.slowest_requests()
+    assert len(slowest) == 2
+    assert slowest[0].total >= slowest[1].total
+    assert slowest[0].path == "/price/1"
+    assert {"validate", "handler", "serialize", "total"} <= set(slowest[0].durations)
+    assert 2 <= len(caplog.records) <= 5
+    assert caplog.records[0].getMessage().startswith("Slow request GET /price/1: ")
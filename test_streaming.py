@@ -0,0 +1,94 @@
+import pytest
+
+from streaming import (
+    JSONArrayParser,
+    MalformedRow,
+    abatched,
+    accepts_ndjson,
+    aiter_json_array,
+    aiter_lines,
+    iter_ndjson,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def agen(items):
+    for item in items:
+        yield item
+
+
+async def collect(aiterable):
+    return [item async for item in aiterable]
+
+
+def test_accepts_ndjson():
+    assert accepts_ndjson("application/x-ndjson")
+    assert accepts_ndjson("application/json, application/x-ndjson;q=0.5")
+    assert not accepts_ndjson("*/*")
+    assert not accepts_ndjson(None)
+
+
+def test_iter_ndjson_groups_lines():
+    chunks = list(iter_ndjson(({"n": n} for n in range(5)), lines_per_chunk=2))
+
+    assert chunks == [b'{"n":0}\n{"n":1}\n', b'{"n":2}\n{"n":3}\n', b'{"n":4}\n']
+
+
+@pytest.mark.anyio
+async def test_abatched():
+    assert await collect(abatched(agen(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+
+
+@pytest.mark.anyio
+async def test_aiter_lines_across_chunks():
+    chunks = [b'{"a"', b": 1}\n\n  \n{", b'"b": 2}\n{"c": 3}']
+
+    assert await collect(aiter_lines(agen(chunks))) == [
+        b'{"a": 1}',
+        b'{"b": 2}',
+        b'{"c": 3}',
+    ]
+
+
+@pytest.mark.anyio
+async def test_aiter_lines_drops_oversized_line():
+    chunks = [b"ok\n", b"x" * 6, b"x" * 6, b"xx\nafter\n"]
+    lines = await collect(aiter_lines(agen(chunks), max_line_size=8))
+
+    assert lines[0] == b"ok"
+    assert isinstance(lines[1], MalformedRow)
+    assert lines[2:] == [b"after"]
+
+
+def test_json_array_parser_byte_by_byte():
+    parser = JSONArrayParser()
+    elements = []
+
+    for char in ' [ {"a": 1.50}, 12, "x" , [1,2], true , 3] ':
+        elements += parser.feed(char)
+
+    parser.close()
+
+    assert elements == [{"a": pytest.approx(1.5)}, 12, "x", [1, 2], True, 3]
+    assert str(elements[0]["a"]) == "1.50"
+
+
+@pytest.mark.parametrize("body", ["{}", "[1 2]", "[1,", "[1] 2"])
+def test_json_array_parser_rejects_malformed(body):
+    parser = JSONArrayParser()
+
+    with pytest.raises(ValueError):
+        parser.feed(body)
+        parser.close()
+
+
+@pytest.mark.anyio
+async def test_aiter_json_array_reports_malformed_tail():
+    elements = await collect(aiter_json_array(agen([b'[{"a": 1}, ', b"oops]"])))
+
+    assert elements[0] == {"a": 1}
+    assert isinstance(elements[1], MalformedRow)
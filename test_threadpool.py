@@ -0,0 +1,107 @@
+import threading
+
+import anyio.to_thread
+import pytest
+from fastapi import FastAPI, Query
+from fastapi.testclient import TestClient
+
+from threadpool import (
+    WAIT,
+    configure_threadpool,
+    install_wait_timer,
+    run_inline,
+    threadpool_stats,
+    uninstall_wait_timer,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def wait_timer():
+    original = anyio.to_thread.run_sync
+    install_wait_timer()
+    yield
+    uninstall_wait_timer()
+
+    assert anyio.to_thread.run_sync is original
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/threaded")
+    def threaded(n: int = Query(...)) -> dict:
+        return {"n": n, "thread": threading.get_ident()}
+
+    @app.get("/inline")
+    @run_inline
+    def inline(n: int = Query(...)) -> dict:
+        return {"n": n, "thread": threading.get_ident()}
+
+    @app.get("/loop")
+    async def loop() -> dict:
+        return {"thread": threading.get_ident()}
+
+    return app
+
+
+def test_run_inline_runs_on_the_event_loop():
+    with TestClient(make_app()) as client:
+        loop_thread = client.get("/loop").json()["thread"]
+        inline = client.get("/inline", params={"n": 3}).json()
+        threaded = client.get("/threaded", params={"n": 3}).json()
+
+        assert inline == {"n": 3, "thread": loop_thread}
+        assert threaded["thread"] != loop_thread
+        # Parameters are still validated from the wrapped function's signature
+        assert client.get("/inline", params={"n": "x"}).status_code == 422
+
+
+@pytest.mark.anyio
+async def test_configure_threadpool_sets_the_limit():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    original = limiter.total_tokens
+
+    try:
+        assert configure_threadpool(7) is limiter
+        assert limiter.total_tokens == 7
+        assert threadpool_stats() == {"threads": 7, "busy": 0, "waiting": 0}
+    finally:
+        limiter.total_tokens = original
+
+
+@pytest.mark.anyio
+async def test_wait_timer_observes_each_call(wait_timer):
+    def observations() -> float:
+        return sum(WAIT.values.get((), [0.0])[:-1])
+
+    before = observations()
+    results = []
+
+    async with anyio.create_task_group() as tg:
+        for n in range(5):
+            tg.start_soon(anyio.to_thread.run_sync, results.append, n)
+
+    assert sorted(results) == list(range(5))
+    assert observations() == before + 5
+
+
+def test_overlapping_installs_restore_run_sync_once_all_uninstalled():
+    original = anyio.to_thread.run_sync
+    install_wait_timer()
+    install_wait_timer()
+    uninstall_wait_timer()
+
+    assert anyio.to_thread.run_sync is not original
+
+    uninstall_wait_timer()
+
+    assert anyio.to_thread.run_sync is original
+
+    uninstall_wait_timer()
+
+    assert anyio.to_thread.run_sync is original
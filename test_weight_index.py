@@ -0,0 +1,138 @@
+from array import array
+from decimal import Decimal
+
+import pytest
+from pydantic import ValidationError
+
+from weight_index import (
+    SCALE,
+    WeightError,
+    WeightStore,
+    format_fixed,
+    parse_weights,
+    render_weights,
+    to_fixed,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return WeightStore(str(tmp_path / "weights.idx"))
+
+
+def test_parse_weights():
+    keys, values = parse_weights(b' { "0": "0.5", "1" : 1.8,"-2":"-2.90", "3": 7 } ')
+
+    assert list(keys) == [0, 1, -2, 3]
+    assert list(values) == [500_000, 1_800_000, -2_900_000, 7_000_000]
+    assert parse_weights(b"{}") == (array("q"), array("q"))
+
+
+@pytest.mark.parametrize(
+    "body, expected",
+    [
+        # Trailing zeros do not count as places
+        (b'{"1": "0.1234560"}', 123_456),
+        (b'{"1": 1e2}', 100 * SCALE),
+        (b'{"1": "2.5E-1"}', 250_000),
+        # Too large to go through a float exactly
+        (b'{"1": "4503599627.000001"}', 4_503_599_627_000_001),
+    ],
+)
+def test_parse_weights_keeps_every_weight_exact(body, expected):
+    assert parse_weights(body)[1] == array("q", [expected])
+
+
+@pytest.mark.parametrize("body", [b'{"a": "1"}', b'{"1": true}', b"[]", b"{"])
+def test_parse_weights_validates(body):
+    with pytest.raises(ValidationError):
+        parse_weights(body)
+
+
+def test_weights_must_fit():
+    with pytest.raises(WeightError):
+        parse_weights(b'{"1": "0.1234567"}')
+
+    with pytest.raises(WeightError):
+        parse_weights(b'{"1": 1e-7}')
+
+    with pytest.raises(WeightError):
+        parse_weights(b'{"99999999999999999999": "1"}')
+
+    with pytest.raises(WeightError):
+        parse_weights(b'{"1": "99999999999999"}')
+
+
+def test_format_fixed_round_trips():
+    for text in ["0", "1", "-1", "0.5", "-0.000001", "123456.789"]:
+        assert format_fixed(to_fixed(Decimal(text))) == text
+
+    assert render_weights([1, 2], [500_000, 0]) == b'{"1":"0.5","2":"0"}'
+
+
+def test_upserts_merge_into_the_sorted_index(store):
+    store.upsert(array("q", [5, 1, 9]), array("q", [50, 10, 90]))
+    index = store.upsert(array("q", [3, 9, 1, 3]), array("q", [30, 99, 11, 33]))
+
+    assert list(index.keys) == [1, 3, 5, 9]
+    assert list(index.values) == [11, 33, 50, 99]
+    assert index.get(3) == 33 and index.get(4) is None
+
+
+def test_aggregates(store):
+    index = store.upsert(
+        array("q", [1, 2, 3, 4]), array("q", [1_000_000, 3_000_000, 0, 4_000_000])
+    )
+
+    assert index.total() == 8_000_000
+    assert index.total(2, 4) == 3_000_000
+    assert [list(part) for part in index.span(2, 4)] == [[2, 3], [3_000_000, 0]]
+    assert index.top(2) == [(4, 4_000_000), (2, 3_000_000)]
+
+    keys, shares = index.normalized(1, 3)
+
+    assert list(keys) == [1, 2] and shares == [250_000, 750_000]
+
+
+def test_other_processes_see_upserts(store, tmp_path):
+    other = WeightStore(str(tmp_path / "weights.idx"))
+
+    assert len(other.current()) == 0
+
+    store.upsert(array("q", [1]), array("q", [1]))
+
+    assert list(other.current().keys) == [1]
+
+
+def test_upserts_go_to_a_delta_folded_into_the_base(tmp_path):
+    store = WeightStore(str(tmp_path / "weights.idx"), max_delta=3)
+    store.upsert(array("q", [1, 2, 3, 4, 5]), array("q", [10, 20, 30, 40, 50]))
+    weights = store.upsert(array("q", [6, 2]), array("q", [60, 5]))
+
+    assert weights.base.generation == weights.delta.generation == 1
+    assert len(weights.base) == 5 and len(weights.delta) == 2
+    assert list(weights.keys) == [1, 2, 3, 4, 5, 6] and len(weights) == 6
+    assert weights.get(2) == 5 and weights.get(6) == 60 and weights.get(7) is None
+    assert [list(part) for part in weights.span(2, 4)] == [[2, 3], [5, 30]]
+    assert weights.total(4) == 150
+    assert weights.top(3) == [(6, 60), (5, 50), (4, 40)]
+
+    folded = store.upsert(array("q", [7, 1]), array("q", [70, 0]))
+
+    assert folded.base.generation == 2 and len(folded.delta) == 0
+    assert list(folded.values) == [0, 5, 30, 40, 50, 60, 70]
+    assert list(WeightStore(str(tmp_path / "weights.idx")).current().keys) == [
+        *range(1, 8)
+    ]
+
+
+def test_a_delta_older_than_its_base_is_ignored(store):
+    store.upsert(array("q", [1]), array("q", [10]))
+    # As if a writer stopped between renaming a new base and its empty delta
+    store._replace(store.path, array("q", [1, 2]), array("q", [11, 20]), 1)
+
+    assert list(store.current().values) == [11, 20]
+
+    store.upsert(array("q", [3]), array("q", [30]))
+
+    assert list(store.current().values) == [11, 20, 30]
@@ -0,0 +1,140 @@
+"""Sizing and instrumentation of the threadpool that runs sync handlers"""
+
+import functools
+import time
+from collections.abc import Callable
+from typing import Any, Optional, TypeVar
+
+import anyio.to_thread
+from anyio import CapacityLimiter
+
+from metrics import REGISTRY
+
+T = TypeVar("T")
+
+_limiter: Optional[CapacityLimiter] = None
+_original_run_sync: Optional[Callable[..., Any]] = None
+# Lifespans that installed the wait timer and have not uninstalled it yet
+_installs = 0
+
+
+def _threads() -> float:
+    return 0 if _limiter is None else _limiter.total_tokens
+
+
+def _busy() -> float:
+    return 0 if _limiter is None else _limiter.borrowed_tokens
+
+
+def _waiting() -> float:
+    return 0 if _limiter is None else _limiter.statistics().tasks_waiting
+
+
+WAIT = REGISTRY.histogram(
+    "threadpool_wait_seconds",
+    "Time calls to the threadpool waited for a free thread.",
+)
+REGISTRY.gauge(
+    "threadpool_threads",
+    "Most threads the threadpool runs at once.",
+    function=_threads,
+)
+REGISTRY.gauge(
+    "threadpool_threads_busy",
+    "Threads of the threadpool currently running a call.",
+    function=_busy,
+)
+REGISTRY.gauge(
+    "threadpool_calls_waiting",
+    "Calls waiting for a free thread of the threadpool.",
+    function=_waiting,
+)
+
+
+def configure_threadpool(size: int) -> CapacityLimiter:
+    """
+    Let the threadpool of the running event loop run up to `size` threads.
+
+    This is the pool Starlette and FastAPI run sync handlers, sync
+    dependencies and `run_in_threadpool` calls in; anyio's default is 40.
+    """
+    global _limiter
+
+    _limiter = anyio.to_thread.current_default_thread_limiter()
+    _limiter.total_tokens = size
+
+    return _limiter
+
+
+def threadpool_stats() -> dict[str, int]:
+    return {
+        "threads": int(_threads()),
+        "busy": int(_busy()),
+        "waiting": int(_waiting()),
+    }
+
+
+async def _timed_run_sync(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    submitted = time.perf_counter()
+    started: Optional[float] = None
+
+    def timed(*func_args: Any) -> T:
+        nonlocal started
+        started = time.perf_counter()
+        return func(*func_args)
+
+    try:
+        return await _original_run_sync(timed, *args, **kwargs)
+    finally:
+        # Observed here rather than in the worker thread, which may run
+        # concurrently with other observations
+        if started is not None:
+            WAIT.observe(started - submitted)
+
+
+def install_wait_timer() -> None:
+    """
+    Wrap `anyio.to_thread.run_sync`, which every threadpool call goes through,
+    so the time each call waits before a thread picks it up is recorded.
+
+    anyio has no per-app hook for this, so the wrapper replaces the module
+    attribute: until `uninstall_wait_timer`, threadpool calls of every app and
+    event loop in the process are timed, and counted in `WAIT`. Each install
+    must be paired with an uninstall; the original is restored by the last one.
+    """
+    global _installs, _original_run_sync
+
+    if _installs == 0:
+        _original_run_sync = anyio.to_thread.run_sync
+        anyio.to_thread.run_sync = _timed_run_sync
+
+    _installs += 1
+
+
+def uninstall_wait_timer() -> None:
+    global _installs, _original_run_sync
+
+    if _installs == 0:
+        return
+
+    _installs -= 1
+
+    if _installs == 0:
+        anyio.to_thread.run_sync = _original_run_sync
+        _original_run_sync = None
+
+
+def run_inline(func: Callable[..., T]) -> Callable[..., Any]:
+    """
+    Make a sync handler run on the event loop rather than in the threadpool.
+
+    Saves the handler, and the validation of its response, two hops to a
+    worker thread. Only for handlers that do a little CPU work and never
+    block: while one runs, no other request makes progress.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,52 @@
+"""Chunked processing of uploaded files"""
+
+import hashlib
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.formparsers import MultiPartParser
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+
+@dataclass(frozen=True)
+class FileDigest:
+    size: int
+    sha256: str
+
+
+def set_spool_max_size(max_size: int) -> None:
+    """
+    Set how many bytes of each uploaded file are held in memory before the
+    multipart parser rolls it over to a temporary file on disk.
+
+    Starlette has no per-app setting for this, so it changes the class
+    attribute `MultiPartParser.spool_max_size`: every app in the process,
+    and every request parsed from then on, uses `max_size`.
+    """
+    MultiPartParser.spool_max_size = max_size
+
+
+def digest_file(file: BinaryIO, chunk_size: int = UPLOAD_CHUNK_SIZE) -> FileDigest:
+    """Size and SHA-256 of `file` from its start, read one chunk at a time."""
+    hasher = hashlib.sha256()
+    size = 0
+    file.seek(0)
+
+    while chunk := file.read(chunk_size):
+        hasher.update(chunk)
+        size += len(chunk)
+
+    file.seek(0)
+
+    return FileDigest(size=size, sha256=hasher.hexdigest())
+
+
+async def digest_upload(upload: UploadFile) -> FileDigest:
+    """
+    `digest_file` for an upload, run in a worker thread so reading a spooled
+    file from disk and hashing it never block the event loop.
+    """
+    return await run_in_threadpool(digest_file, upload.file)
@@ -0,0 +1,447 @@
+"""Weight indexes: exact decimal weights kept in compact, mmap'd typed arrays"""
+
+import heapq
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import cached_property
+from itertools import compress, islice
+from operator import lt, not_
+from pathlib import Path
+from typing import Annotated, Any, Optional
+
+from pydantic import Field, TypeAdapter
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: a single process writes
+    fcntl = None
+
+# Weights are stored as integers in millionths, so decimals with up to this
+# many places are kept exactly
+PLACES = 6
+SCALE = 10**PLACES
+MAGIC = b"WEIGHTS2"
+# Magic, generation of the base index, count
+_HEADER = struct.Struct("<8sQQ")
+
+# Weights of a body in which this finds nothing have at most `PLACES` decimal
+# places, so reading them as floats loses nothing (see `parse_weights`)
+_MANY_PLACES = re.compile(rb"\.[0-9]{%d}[0-9]*[1-9]" % PLACES)
+# Below this, a float read from a decimal with at most `PLACES` places,
+# multiplied by `SCALE` and rounded, gives back that decimal exactly
+_FLOAT_LIMIT = 2.0**50 / SCALE
+
+_float_weights = TypeAdapter(dict[int, Annotated[float, Field(allow_inf_nan=False)]])
+_decimal_weights = TypeAdapter(dict[int, Decimal])
+
+
+class WeightError(ValueError):
+    """A weight or index that does not fit the index."""
+
+
+def to_fixed(weight: Decimal) -> int:
+    """`weight` in millionths, when it has no more than `PLACES` places."""
+    scaled = weight.scaleb(PLACES)
+
+    if not scaled.is_finite() or scaled != scaled.to_integral_value():
+        raise WeightError(f"Weights have at most {PLACES} decimal places")
+
+    return int(scaled)
+
+
+def format_fixed(value: int) -> str:
+    """The shortest decimal text for a weight in millionths."""
+    whole, fraction = divmod(abs(value), SCALE)
+    sign = "-" if value < 0 else ""
+
+    if not fraction:
+        return f"{sign}{whole}"
+
+    return f"{sign}{whole}.{fraction:0{PLACES}d}".rstrip("0")
+
+
+def parse_weights(body: bytes) -> tuple[array, array]:
+    """
+    Validate a JSON object of indexes to decimal weights into arrays.
+
+    Plain decimals are parsed as floats, which is much faster than building a
+    `Decimal` for each and exact for them; only bodies with weights of more
+    places, exponents or large magnitudes go through `Decimal`. Raises
+    `ValidationError` for a body that is not such an object and `WeightError`
+    for weights that cannot be stored exactly.
+    """
+    # Bodies with exponents or booleans, spotted by their "e", also go through
+    # `Decimal`, which rejects booleans
+    plain = b"e" not in body and b"E" not in body
+
+    if plain and _MANY_PLACES.search(body) is None:
+        weights = _float_weights.validate_json(body)
+
+        if max(map(abs, weights.values()), default=0) < _FLOAT_LIMIT:
+            try:
+                keys = array("q", weights)
+            except OverflowError as exc:
+                raise WeightError("Indexes must fit in 64 bits") from exc
+
+            return keys, array(
+                "q", map(round, map(float(SCALE).__mul__, weights.values()))
+            )
+
+    return _from_decimals(_decimal_weights.validate_json(body))
+
+
+def _from_decimals(weights: Mapping[int, Decimal]) -> tuple[array, array]:
+    try:
+        return array("q", weights), array("q", map(to_fixed, weights.values()))
+    except OverflowError as exc:
+        raise WeightError("Indexes and weights must fit in 64 bits") from exc
+
+
+def render_weights(keys: Any, values: Any) -> bytes:
+    """A JSON object of `keys` to their weights as decimal strings."""
+    members = ",".join(
+        f'"{key}":"{format_fixed(value)}"'
+        for key, value in zip(keys, values, strict=True)
+    )
+
+    return f"{{{members}}}".encode()
+
+
+def _sorted_by_key(keys: Any, values: Any) -> tuple[array, array]:
+    """Both arrays in the order of `keys`, keeping runs of equal keys in order."""
+    # Sorting positions rather than (key, value) pairs builds no tuples, and
+    # takes linear time when `keys` is made of a few sorted runs
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+
+    return (
+        array("q", map(keys.__getitem__, order)),
+        array("q", map(values.__getitem__, order)),
+    )
+
+
+def _sorted_unique(keys: array, values: array) -> tuple[array, array]:
+    """`keys` sorted, keeping the last weight given for each."""
+    if all(map(lt, keys, islice(keys, 1, None))):
+        return keys, values
+
+    latest = dict(zip(keys, values, strict=True))
+
+    return _sorted_by_key(array("q", latest), array("q", latest.values()))
+
+
+def _extend(target: array, view: memoryview) -> None:
+    target.frombytes(view.cast("B"))
+
+
+class _Aggregates:
+    """Aggregates over the weights of a `span`."""
+
+    def span(
+        self, start: Optional[int] = None, stop: Optional[int] = None
+    ) -> tuple[Any, Any]:
+        raise NotImplementedError
+
+    def total(self, start: Optional[int] = None, stop: Optional[int] = None) -> int:
+        return sum(self.span(start, stop)[1])
+
+    def normalized(
+        self, start: Optional[int] = None, stop: Optional[int] = None
+    ) -> tuple[Any, list[int]]:
+        """The weights of a span divided by their total, in millionths, rounded."""
+        keys, values = self.span(start, stop)
+        total = sum(values)
+
+        if not total:
+            return keys, [0] * len(values)
+
+        return keys, [(2 * SCALE * value + total) // (2 * total) for value in values]
+
+
+class WeightIndex(_Aggregates):
+    """
+    A weight index file, mapped read-only: either a base index, or the delta
+    of the weights upserted since the base index of the same generation.
+
+    Indexes are kept sorted in one int64 array and their weights, in
+    millionths, in another. Lookups binary-search the mapped arrays in place
+    and aggregates run over them without building a Python object per
+    weight.
+    """
+
+    def __init__(self, buffer: Any) -> None:
+        view = memoryview(buffer)
+        magic, self.generation, count = _HEADER.unpack_from(view)
+
+        if magic != MAGIC:
+            raise ValueError("Not a weight index")
+
+        start = _HEADER.size
+        middle = start + count * 8
+        self.keys = view[start:middle].cast("q")
+        self.values = view[middle : middle + count * 8].cast("q")
+
+    @classmethod
+    def open(cls, path: Path) -> "WeightIndex":
+        with open(path, "rb") as file:
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get(self, key: int) -> Optional[int]:
+        position = bisect_left(self.keys, key)
+
+        if position < len(self.keys) and self.keys[position] == key:
+            return self.values[position]
+
+        return None
+
+    def span(
+        self, start: Optional[int] = None, stop: Optional[int] = None
+    ) -> tuple[memoryview, memoryview]:
+        """The indexes from `start` up to but excluding `stop`, and their weights."""
+        low = 0 if start is None else bisect_left(self.keys, start)
+        high = len(self.keys) if stop is None else bisect_left(self.keys, stop)
+        high = max(low, high)
+
+        return self.keys[low:high], self.values[low:high]
+
+    def top(self, k: int) -> list[tuple[int, int]]:
+        """The `k` heaviest indexes and their weights, heaviest first."""
+        positions = heapq.nlargest(k, range(len(self.values)), self.values.__getitem__)
+
+        return [(self.keys[position], self.values[position]) for position in positions]
+
+    def merged(self, keys: array, values: array) -> tuple[array, array]:
+        """This index's arrays with `keys` set to `values`."""
+        keys, values = _sorted_unique(keys, values)
+
+        if len(keys) * 32 < len(self.keys):
+            return _merge_runs(self.keys, self.values, keys, values)
+
+        # The weights that stay, followed by the new ones, sorted together
+        upserted = set(keys)
+        kept = list(map(not_, map(upserted.__contains__, self.keys)))
+        all_keys = array("q", compress(self.keys, kept))
+        all_values = array("q", compress(self.values, kept))
+        all_keys.extend(keys)
+        all_values.extend(values)
+
+        return _sorted_by_key(all_keys, all_values)
+
+
+def _merge_runs(
+    base_keys: Any, base_values: Any, keys: Any, values: Any
+) -> tuple[array, array]:
+    """The sorted `base_keys` and their values, with sorted `keys` set to `values`."""
+    merged_keys, merged_values = array("q"), array("q")
+    start = 0
+
+    # Untouched runs are copied whole, so merging a few weights into a large
+    # index costs little more than the copy
+    for key, value in zip(keys, values, strict=True):
+        position = bisect_left(base_keys, key, start)
+        _extend(merged_keys, base_keys[start:position])
+        _extend(merged_values, base_values[start:position])
+        merged_keys.append(key)
+        merged_values.append(value)
+        start = position
+
+        if position < len(base_keys) and base_keys[position] == key:
+            start += 1
+
+    _extend(merged_keys, base_keys[start:])
+    _extend(merged_values, base_values[start:])
+
+    return merged_keys, merged_values
+
+
+class Weights(_Aggregates):
+    """
+    The current weights: a base index overlaid with the delta of the weights
+    upserted since. Spans that the delta touches are merged when read, which
+    copies the span once; the others are views of the mapped base.
+    """
+
+    def __init__(self, base: WeightIndex, delta: WeightIndex) -> None:
+        self.base = base
+        self.delta = delta
+
+    @property
+    def keys(self) -> Any:
+        return self.span()[0]
+
+    @property
+    def values(self) -> Any:
+        return self.span()[1]
+
+    @cached_property
+    def _length(self) -> int:
+        added = sum(self.base.get(key) is None for key in self.delta.keys)
+
+        return len(self.base) + added
+
+    def __len__(self) -> int:
+        return self._length
+
+    def get(self, key: int) -> Optional[int]:
+        value = self.delta.get(key)
+
+        return self.base.get(key) if value is None else value
+
+    def span(
+        self, start: Optional[int] = None, stop: Optional[int] = None
+    ) -> tuple[Any, Any]:
+        """The indexes from `start` up to but excluding `stop`, and their weights."""
+        keys, values = self.base.span(start, stop)
+        delta_keys, delta_values = self.delta.span(start, stop)
+
+        if not len(delta_keys):
+            return keys, values
+
+        return _merge_runs(keys, values, delta_keys, delta_values)
+
+    def top(self, k: int) -> list[tuple[int, int]]:
+        """The `k` heaviest indexes and their weights, heaviest first."""
+        # Only as many of the base's heaviest as the delta holds can be outdated
+        candidates = [
+            (key, value)
+            for key, value in self.base.top(k + len(self.delta))
+            if self.delta.get(key) is None
+        ]
+        candidates.extend(zip(self.delta.keys, self.delta.values, strict=True))
+        # Ties go to the lower index, as in `WeightIndex.top`
+        candidates.sort()
+
+        return heapq.nlargest(k, candidates, key=lambda item: item[1])
+
+
+def write_index(file: Any, keys: array, values: array, generation: int = 0) -> None:
+    file.write(_HEADER.pack(MAGIC, generation, len(keys)))
+    keys.tofile(file)
+    values.tofile(file)
+
+
+# Stands in for a delta that has been folded into its base already
+_EMPTY = WeightIndex(_HEADER.pack(MAGIC, 0, 0))
+
+
+class _MappedIndex:
+    """A weight index file, mapped again whenever it has been replaced."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._index: Optional[WeightIndex] = None
+        self._stat: Optional[tuple[int, int]] = None
+
+    def current(self) -> WeightIndex:
+        stat = os.stat(self.path)
+        key = (stat.st_ino, stat.st_mtime_ns)
+
+        if key != self._stat:
+            self._index = WeightIndex.open(self.path)
+            self._stat = key
+
+        return self._index
+
+
+class WeightStore:
+    """
+    The weights kept in files, shared by worker processes.
+
+    A base index file holds every weight as of its generation, and a delta
+    file next to it the weights upserted since. `upsert` rewrites only the
+    delta, at a cost bounded by `max_delta` weights; once the delta would
+    hold more, it is folded into a new base index of the next generation
+    instead, which costs a rewrite of every weight. Each file is written next
+    to its place and renamed into it, and the base before the delta, so a
+    reader that finds a delta of a newer generation than its base only needs
+    to look at the base again, and one that finds an older delta knows it
+    has been folded in already. Readers notice new files on their next
+    access. Upserts are serialized across processes by a lock file.
+    """
+
+    def __init__(self, path: str, max_delta: int = 4096) -> None:
+        self.path = Path(path)
+        self.delta_path = self.path.with_suffix(".delta")
+        self.max_delta = max_delta
+        self._lock = threading.Lock()
+        self._base = _MappedIndex(self.path)
+        self._delta = _MappedIndex(self.delta_path)
+        self._weights: Optional[Weights] = None
+
+        if not self.path.exists() or not self.delta_path.exists():
+            with self._locked():
+                if not self.path.exists():
+                    self._replace(self.path, array("q"), array("q"), 0)
+
+                if not self.delta_path.exists():
+                    generation = self._base.current().generation
+                    self._replace(self.delta_path, array("q"), array("q"), generation)
+
+    def current(self) -> Weights:
+        base, delta = self._base.current(), self._delta.current()
+
+        if delta.generation > base.generation:
+            # A new base was renamed into place after it was looked at
+            base = self._base.current()
+
+        if delta.generation != base.generation:
+            # Folded into the base already
+            delta = _EMPTY
+
+        weights = self._weights
+
+        if weights is None or weights.base is not base or weights.delta is not delta:
+            weights = self._weights = Weights(base, delta)
+
+        return weights
+
+    def upsert(self, keys: array, values: array) -> Weights:
+        """Set the weights of `keys`, adding those not in the index yet."""
+        with self._locked():
+            current = self.current()
+            keys, values = current.delta.merged(keys, values)
+            generation = current.base.generation
+
+            if len(keys) > self.max_delta:
+                generation += 1
+                base = current.base.merged(keys, values)
+                self._replace(self.path, *base, generation)
+                keys, values = array("q"), array("q")
+
+            self._replace(self.delta_path, keys, values, generation)
+
+        return self.current()
+
+    def _replace(self, path: Path, keys: array, values: array, generation: int) -> None:
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=".weights-", delete=False
+        ) as tmp:
+            write_index(tmp, keys, values, generation)
+
+        os.replace(tmp.name, path)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+
+            with open(self.path.with_suffix(".lock"), "a+b") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)